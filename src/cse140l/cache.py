@@ -0,0 +1,29 @@
+import os
+from pathlib import Path
+
+from cse140l.log import log
+
+# Environment variable that overrides where the autograder keeps its local caches
+CACHE_DIR_ENV = "CSE140L_CACHE_DIR"
+
+
+def get_cache_dir(*parts: str) -> Path | None:
+    """
+    Returns (and creates) a directory inside the local autograder cache.
+
+    The cache root is taken from $CSE140L_CACHE_DIR, then $XDG_CACHE_HOME/cse140l,
+    then ~/.cache/cse140l. Returns None if the directory cannot be created, callers
+    should treat the cache as disabled in that case.
+    """
+    root = os.environ.get(CACHE_DIR_ENV)
+    if not root:
+        xdg_cache = os.environ.get("XDG_CACHE_HOME")
+        root = Path(xdg_cache, "cse140l") if xdg_cache else Path.home() / ".cache" / "cse140l"
+
+    cache_dir = Path(root, *parts)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        log.debug(f"Cache directory {cache_dir} is unavailable: {e}")
+        return None
+    return cache_dir
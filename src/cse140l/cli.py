@@ -0,0 +1,30 @@
+import sys
+from typing import List, Dict
+from importlib import import_module
+
+# Subcommands of `cse140l` mapped to "module:function". A command's module is only imported when it runs,
+# so every command starts without loading the dependencies of the others.
+COMMANDS: Dict[str, str] = {
+    "aggregate": "cse140l.gradescope.aggregate:main",
+    "serve": "cse140l.lab.daemon:main",
+    "warmup": "cse140l.digital.cds:main",
+}
+
+
+def main(argv: List[str] = None):
+    """
+    Entry point of the `cse140l` command. Known subcommands are dispatched to their module, anything
+    else is treated as the arguments of the lab runner so existing invocations keep working.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv and argv[0] in COMMANDS:
+        module_name, function_name = COMMANDS[argv[0]].split(":")
+        return getattr(import_module(module_name), function_name)(argv[1:])
+
+    from cse140l.lab.runner import main as run_lab
+    return run_lab(argv)
+
+
+if __name__ == '__main__':
+    main()
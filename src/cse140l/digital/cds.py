@@ -0,0 +1,229 @@
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from functools import cached_property
+from typing import List, Dict, Tuple
+
+from cse140l.cache import get_cache_dir
+from cse140l.log import log, setup_logger
+
+# Digital CLI commands that get their own class data sharing archive, each one loads a different set of classes
+CDS_COMMANDS = ("svg", "stats", "test", "verilog")
+
+# The JVM logs archive mismatches as "[warning][cds]" lines on stdout, where they would corrupt the SVG,
+# stats CSV or test output Digital writes there. An unusable archive is simply not used, so they are silenced.
+CDS_LOG_OPTIONS = ["-Xlog:cds=off", "-Xlog:cds+dynamic=off"]
+
+# Seconds a single warm-up run of Digital may take
+WARM_UP_TIMEOUT = 120.
+
+# Smallest circuit every CLI command runs on: a wire from an input to an output and a test case for it
+_WARM_UP_CIRCUIT = """<?xml version="1.0" encoding="utf-8"?>
+<circuit>
+  <version>2</version>
+  <attributes/>
+  <visualElements>
+    <visualElement>
+      <elementName>In</elementName>
+      <elementAttributes>
+        <entry>
+          <string>Label</string>
+          <string>A</string>
+        </entry>
+      </elementAttributes>
+      <pos x="0" y="0"/>
+    </visualElement>
+    <visualElement>
+      <elementName>Out</elementName>
+      <elementAttributes>
+        <entry>
+          <string>Label</string>
+          <string>Y</string>
+        </entry>
+      </elementAttributes>
+      <pos x="100" y="0"/>
+    </visualElement>
+    <visualElement>
+      <elementName>Testcase</elementName>
+      <elementAttributes>
+        <entry>
+          <string>Label</string>
+          <string>warmup</string>
+        </entry>
+        <entry>
+          <string>Testdata</string>
+          <testData>
+            <dataString>A Y
+0 0
+1 1
+</dataString>
+          </testData>
+        </entry>
+      </elementAttributes>
+      <pos x="0" y="100"/>
+    </visualElement>
+  </visualElements>
+  <wires>
+    <wire>
+      <p1 x="0" y="0"/>
+      <p2 x="100" y="0"/>
+    </wire>
+  </wires>
+  <measurementOrdering/>
+</circuit>
+"""
+
+
+def _warm_up_args(command: str, circuit: Path) -> List[str]:
+    """Arguments of a warm-up run of a CLI command, matching how the Digital modules invoke it."""
+    if command == "svg":
+        return ["svg", "-ieee", "-dig", str(circuit)]
+    if command == "stats":
+        return ["stats", "-dig", str(circuit)]
+    if command == "test":
+        return ["test", "-circ", str(circuit), "-tests", str(circuit), "-verbose"]
+    if command == "verilog":
+        return ["verilog", "-dig", str(circuit), "-verilog", str(circuit.with_suffix(".v"))]
+    raise ValueError(f"No warm-up for Digital command {command}")
+
+
+class ClassDataArchive:
+    """
+    AppCDS archives of a Digital jar, one per CLI command, kept in the local cache.
+
+    An archive holds the classes a command loaded in a previous run already parsed and verified, so later
+    JVMs map them in instead of loading them from the jar. Archives are keyed by the resolved path, size and
+    modification time of the jar and the java executable, the same things the JVM checks before using an
+    archive, so a new or moved jar or JVM gets new archives without the jar ever being read. The JVM ignores
+    an unusable archive (-Xshare:auto), at worst falling back to normal class loading.
+    """
+
+    def __init__(self, jar_file: Path, java: str = "java"):
+        self.jar_file = jar_file
+        self.java = java
+
+    @cached_property
+    def directory(self) -> Path | None:
+        """Cache directory of this jar's archives, None if the jar or the cache is unavailable."""
+        # The JVM refuses an archive whose class path entry moved or changed size or modification time
+        try:
+            jar_path = os.path.realpath(self.jar_file)
+            jar_stat = os.stat(jar_path)
+        except OSError as e:
+            log.debug(f"Not using class data sharing, cannot stat {self.jar_file}: {e}")
+            return None
+        key = [jar_path, jar_stat.st_size, jar_stat.st_mtime_ns]
+
+        # Archives only work with the exact JVM that created them
+        java_path = shutil.which(self.java)
+        if java_path is not None:
+            java_path = os.path.realpath(java_path)
+            java_stat = os.stat(java_path)
+            key.extend([java_path, java_stat.st_size, java_stat.st_mtime_ns])
+
+        return get_cache_dir("cds", hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:16])
+
+    def get_path(self, command: str) -> Path | None:
+        if command not in CDS_COMMANDS or self.directory is None:
+            return None
+        return Path(self.directory, f"{command}.jsa")
+
+    def get_jvm_options(self, command: str) -> List[str]:
+        """JVM options that use the archive of a CLI command, if it has been created."""
+        path = self.get_path(command)
+        if path is None or not path.is_file():
+            return []
+        return [f"-XX:SharedArchiveFile={path}", "-Xshare:auto", *CDS_LOG_OPTIONS]
+
+    def _time_run(self, cli_cmd: List[str], args: List[str], jvm_options: List[str]) -> float | None:
+        start = time.perf_counter()
+        try:
+            result = subprocess.run([cli_cmd[0], *jvm_options, *cli_cmd[1:], *args], capture_output=True,
+                                    timeout=WARM_UP_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            log.warning(f"Warm-up run of `{args[0]}` failed: {e}")
+            return None
+        if result.returncode != 0:
+            log.debug(f"Warm-up run of `{args[0]}` exited with {result.returncode}: {result.stderr.decode('utf-8', 'replace')}")
+        return time.perf_counter() - start
+
+    def warm_up(self, cli_cmd: List[str], force: bool = False) -> Dict[str, Tuple[float, float]]:
+        """
+        Creates the archive of every CLI command that does not have one yet (or all of them with force) by
+        running it once on a tiny circuit with -XX:ArchiveClassesAtExit. Each command is then timed with and
+        without its archive, returns the (without, with) seconds of every command that was archived.
+        """
+        if self.directory is None:
+            log.warning("Class data sharing is unavailable, skipping warm-up")
+            return {}
+
+        timings: Dict[str, Tuple[float, float]] = {}
+        with tempfile.TemporaryDirectory(prefix="cse140l_warmup_") as tmp_dir:
+            circuit = Path(tmp_dir, "warmup.dig")
+            circuit.write_text(_WARM_UP_CIRCUIT)
+
+            for command in CDS_COMMANDS:
+                path = self.get_path(command)
+                if path.is_file() and not force:
+                    continue
+
+                args = _warm_up_args(command, circuit)
+
+                # The JVM writes the archive on exit, writing it elsewhere first keeps a half written one from being used
+                tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                self._time_run(cli_cmd, args, [f"-XX:ArchiveClassesAtExit={tmp_path}", *CDS_LOG_OPTIONS])
+                if not tmp_path.is_file():
+                    log.warning(f"The JVM did not create a class data sharing archive for `{command}` "
+                                f"(-XX:ArchiveClassesAtExit needs JDK 13 or newer)")
+                    continue
+                os.replace(tmp_path, path)
+
+                # Both timed runs come after the archiving run, so neither pays for reading the jar from disk
+                without_archive = self._time_run(cli_cmd, args, [])
+                with_archive = self._time_run(cli_cmd, args, self.get_jvm_options(command))
+                if without_archive is None or with_archive is None:
+                    continue
+
+                timings[command] = (without_archive, with_archive)
+                log.info(f"`{command}`: startup {without_archive * 1000:.0f}ms -> {with_archive * 1000:.0f}ms "
+                         f"with class data sharing ({(without_archive - with_archive) * 1000:.0f}ms saved per call)")
+
+        return timings
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="cse140l warmup",
+        description="Create class data sharing archives that speed up starting Digital"
+    )
+
+    parser.add_argument(
+        "jar",
+        type=Path,
+        nargs="?",
+        default=Path("/usr/local/bin/Digital.jar"),
+        help="Digital.jar to create the archives for."
+    )
+
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Recreate archives that already exist."
+    )
+
+    args = parser.parse_args(argv)
+
+    setup_logger()
+
+    from cse140l.digital.wrapper import Digital
+    Digital(args.jar).warm_up(force=args.force)
+
+
+if __name__ == '__main__':
+    main()
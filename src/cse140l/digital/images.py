@@ -1,12 +1,268 @@
-from typing import List
+import re
+import string
+import xml.etree.ElementTree as et
+from collections import Counter, defaultdict
+from typing import List, Dict, Tuple
 from pathlib import Path
+from urllib.parse import quote
 
+from cse140l.digital.cds import ClassDataArchive
 from cse140l.digital.util import DigitalModule
+from cse140l.log import log
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+et.register_namespace("", SVG_NS)
+et.register_namespace("xlink", XLINK_NS)
+
+_NUMBER = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_PATH_TOKEN = re.compile(r'[A-Za-z]|-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+# Attributes holding coordinates or sizes, their numbers are rounded
+_GEOMETRY_ATTRIBUTES = {
+    "x", "y", "x1", "y1", "x2", "y2", "cx", "cy", "r", "rx", "ry", "width", "height", "d", "points",
+    "stroke-width", "font-size",
+}
+# Elements whose whitespace is rendered, it is kept as is
+_TEXT_TAGS = {"text", "tspan", "textPath"}
+_TRANSFORM_FUNCTION = re.compile(r'(\w+)\s*\(([^)]*)\)')
+_ARC_COMMAND = re.compile(r'[Aa]')
+# Presentation attributes that are moved into shared CSS classes
+_STYLE_ATTRIBUTES = {
+    "fill", "fill-opacity", "fill-rule", "stroke", "stroke-width", "stroke-opacity", "stroke-linecap",
+    "stroke-linejoin", "stroke-dasharray", "font-family", "font-size", "font-style", "font-weight", "text-anchor",
+    "dominant-baseline", "opacity",
+}
+# In CSS these need a unit, while the attributes take plain user units
+_LENGTH_PROPERTIES = {"stroke-width", "font-size", "stroke-dasharray"}
+_METADATA_TAGS = {"metadata", "title", "desc"}
+# Absolute path commands whose arguments are all (x, y) pairs, only such paths can be moved with x/y on a <use>
+_TRANSLATABLE_COMMANDS = set("MLCQSTZ")
+# Shapes shorter than this are cheaper to repeat than to reference
+_MIN_REUSE_LENGTH = 40
+
+# Characters that do not need escaping in a data: URI inside a double quoted HTML attribute
+_DATA_URI_SAFE = "".join(c for c in string.printable if c not in '"%#&\t\n\r\x0b\x0c')
+
+
+def _format_number(value: float, precision: int) -> str:
+    text = f"{value:.{precision}f}".rstrip("0").rstrip(".") if precision > 0 else str(round(value))
+    return "0" if text in ("-0", "") else text
+
+
+def _round_numbers(value: str, precision: int) -> str:
+    return _NUMBER.sub(lambda match: _format_number(float(match.group()), precision), value)
+
+
+def _round_transform(value: str, precision: int) -> str:
+    """
+    Rounds only the translate() offsets of a transform. Scale, rotation and matrix factors are kept exactly,
+    rounding them would move and resize everything the transform applies to.
+    """
+    return _TRANSFORM_FUNCTION.sub(
+        lambda match: f"translate({_round_numbers(match.group(2), precision)})" if match.group(1) == "translate"
+        else match.group(0),
+        value,
+    )
+
+
+def _is_translation(value: str) -> bool:
+    """Whether a transform only moves its content, so user units inside it are still screen sized."""
+    return all(match.group(1) == "translate" for match in _TRANSFORM_FUNCTION.finditer(value))
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _css_value(name: str, value: str) -> str:
+    if name in _LENGTH_PROPERTIES:
+        return re.sub(r'(?<![\w.])(-?(?:\d+\.?\d*|\.\d+))(?![\w.%])', r'\1px', value)
+    return value
+
+
+def _translate_geometry(tag: str, geometry: str, precision: int) -> Tuple[str, float, float] | None:
+    """
+    Splits a path or polygon into its first point and the shape moved to the origin, or returns None if the shape
+    cannot simply be moved (relative commands, arcs, ...).
+    """
+    tokens = _PATH_TOKEN.findall(geometry)
+    if tag == "path":
+        if not tokens or any(token.isalpha() and token not in _TRANSLATABLE_COMMANDS for token in tokens):
+            return None
+    elif any(token.isalpha() for token in tokens):
+        return None
+
+    numbers = [float(token) for token in tokens if not token.isalpha()]
+    if len(numbers) < 2 or len(numbers) % 2:
+        return None
+    offset_x, offset_y = numbers[0], numbers[1]
+
+    parts: List[str] = []
+    is_x = True
+    pair: List[str] = []
+    for token in tokens:
+        if token.isalpha():
+            parts.append(token)
+            continue
+        value = float(token) - (offset_x if is_x else offset_y)
+        pair.append(_format_number(value, precision))
+        is_x = not is_x
+        if len(pair) == 2:
+            parts.append(",".join(pair))
+            pair = []
+    return " ".join(parts), offset_x, offset_y
+
+
+def optimize_svg(svg: str, precision: int = 1) -> str:
+    """
+    Shrinks an SVG exported by Digital without visible changes:
+    numbers are rounded to `precision` decimals (user units, far below a pixel), comments and metadata are removed,
+    style attributes shared by several elements become CSS classes, and paths or polygons drawn more than once
+    (the same gate in several places) are defined once and placed with <use>.
+    Returns the input unchanged if it cannot be parsed.
+    """
+    try:
+        root = et.fromstring(svg.encode("utf-8"))
+    except et.ParseError as e:
+        log.debug(f"Not optimizing unparseable SVG: {e}")
+        return svg
+
+    # Metadata, elements from other namespaces and whitespace between elements. Whitespace inside text is
+    # rendered (<tspan>A</tspan> <tspan>B</tspan> reads "A B"), so it stays.
+    for parent in list(root.iter()):
+        in_text = _local_name(parent.tag) in _TEXT_TAGS
+        for child in list(parent):
+            if not isinstance(child.tag, str) or _local_name(child.tag) in _METADATA_TAGS or (
+                    child.tag.startswith("{") and not child.tag.startswith(f"{{{SVG_NS}}}")):
+                parent.remove(child)
+            elif not in_text and child.tail is not None and not child.tail.strip():
+                child.tail = None
+        if not in_text and parent.text is not None and not parent.text.strip():
+            parent.text = None
+        for name in list(parent.attrib):
+            if name.startswith("{") and not name.startswith(f"{{{XLINK_NS}}}"):
+                del parent.attrib[name]
+
+    # The document's physical size (width and height in mm) is left as is, only the drawing is rounded
+    if "viewBox" in root.attrib:
+        root.set("viewBox", _round_numbers(root.get("viewBox"), precision))
+    # Inside a scaled, rotated or skewed group a user unit is not a screen unit, so nothing there is rounded
+    elements: List[et.Element] = []
+    unrounded: set[int] = set()
+
+    def collect(parent: et.Element, scaled: bool) -> None:
+        for child in parent:
+            elements.append(child)
+            child_scaled = scaled or not _is_translation(child.get("transform", ""))
+            if child_scaled:
+                unrounded.add(id(child))
+            collect(child, child_scaled)
+
+    collect(root, not _is_translation(root.get("transform", "")))
+    for element in elements:
+        if id(element) in unrounded:
+            continue
+        for name in _GEOMETRY_ATTRIBUTES & element.attrib.keys():
+            # Arc flags may be written without separators ("0110" is two flags and 10), which numbers cannot express
+            if name == "d" and _ARC_COMMAND.search(element.get(name)):
+                continue
+            element.set(name, _round_numbers(element.get(name), precision))
+        if "transform" in element.attrib:
+            element.set("transform", _round_transform(element.get("transform"), precision))
+
+    # Collect every element's presentation styles, style="" declarations win over attributes like in the browser
+    styles: Dict[int, Tuple[Tuple[str, str], ...]] = {}
+    for element in elements:
+        declarations = {name: element.get(name) for name in _STYLE_ATTRIBUTES if name in element.attrib}
+        for declaration in (element.get("style") or "").split(";"):
+            if ":" in declaration:
+                name, value = declaration.split(":", 1)
+                declarations[name.strip()] = value.strip()
+        if declarations:
+            styles[id(element)] = tuple(sorted(declarations.items()))
+
+    style_counts = Counter(styles.values())
+    class_names: Dict[Tuple[Tuple[str, str], ...], str] = {}
+    for element in elements:
+        style = styles.get(id(element))
+        if style is None or style_counts[style] < 2:
+            continue
+        if style not in class_names:
+            class_names[style] = f"s{len(class_names)}"
+        for name in list(element.attrib):
+            if name in _STYLE_ATTRIBUTES or name == "style":
+                del element.attrib[name]
+        existing_class = element.get("class")
+        element.set("class", f"{existing_class} {class_names[style]}" if existing_class else class_names[style])
+
+    # Shapes that only differ in position are drawn by reference to a single definition
+    shapes: Dict[Tuple[str, str], List[Tuple[et.Element, float, float]]] = defaultdict(list)
+    for element in elements:
+        tag = _local_name(element.tag)
+        geometry_attribute = {"path": "d", "polygon": "points", "polyline": "points"}.get(tag)
+        # Shapes in scaled groups were not rounded, reusing them would round their coordinates after all
+        if (geometry_attribute is None or "transform" in element.attrib or "id" in element.attrib
+                or id(element) in unrounded):
+            continue
+        geometry = element.get(geometry_attribute, "")
+        if len(geometry) < _MIN_REUSE_LENGTH:
+            continue
+        translated = _translate_geometry(tag, geometry, precision)
+        if translated is not None:
+            shapes[(tag, translated[0])].append((element, translated[1], translated[2]))
+
+    parents = {child: parent for parent in root.iter() for child in parent}
+    definitions: List[et.Element] = []
+    for (tag, geometry), instances in shapes.items():
+        if len(instances) < 2:
+            continue
+        shape_id = f"p{len(definitions)}"
+        definition = et.Element(f"{{{SVG_NS}}}{tag}", {"id": shape_id, "d" if tag == "path" else "points": geometry})
+        definitions.append(definition)
+
+        for element, offset_x, offset_y in instances:
+            use = et.Element(f"{{{SVG_NS}}}use", {"href": f"#{shape_id}"})
+            if offset_x:
+                use.set("x", _format_number(offset_x, precision))
+            if offset_y:
+                use.set("y", _format_number(offset_y, precision))
+            for name, value in element.attrib.items():
+                if name not in ("d", "points"):
+                    use.set(name, value)
+            use.tail = element.tail
+            parent = parents[element]
+            parent[list(parent).index(element)] = use
+
+    header: List[et.Element] = []
+    if class_names:
+        style_element = et.Element(f"{{{SVG_NS}}}style")
+        style_element.text = "".join(
+            f".{class_name}{{{';'.join(f'{name}:{_css_value(name, value)}' for name, value in style)}}}"
+            for style, class_name in class_names.items()
+        )
+        header.append(style_element)
+    if definitions:
+        defs = et.Element(f"{{{SVG_NS}}}defs")
+        defs.extend(definitions)
+        header.append(defs)
+    for i, element in enumerate(header):
+        root.insert(i, element)
+
+    return et.tostring(root, encoding="unicode")
+
+
+def svg_to_data_uri(svg: str) -> str:
+    """
+    Embeds an SVG in a data: URI. Only the few characters that need it are percent-encoded, which keeps the URI
+    far smaller than base64 and leaves the text compressible.
+    """
+    return "data:image/svg+xml," + quote(svg, safe=_DATA_URI_SAFE)
 
 
 class ImageExport(DigitalModule):
-    def __init__(self, cmd: List[str]):
-        super().__init__(cmd)
+    def __init__(self, cmd: List[str], archive: ClassDataArchive = None):
+        super().__init__(cmd, archive=archive)
 
     def export_svg(self, schematic_path: Path, svg_path: Path = None) -> str:
         args = ["svg", "-ieee", "-dig", str(schematic_path)]
@@ -15,4 +271,4 @@ class ImageExport(DigitalModule):
             args += ["-svg", str(svg_path)]
 
         result = super()._run(args)
-        return result.stdout.decode("utf-8")
\ No newline at end of file
+        return result.stdout.decode("utf-8", "replace")
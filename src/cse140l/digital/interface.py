@@ -0,0 +1,119 @@
+import re
+import difflib
+import xml.etree.ElementTree as et
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import List, Dict, Set
+
+from cse140l.log import log
+
+# Elements that are ports of a circuit, by direction
+INPUT_ELEMENTS = {"In", "Clock"}
+OUTPUT_ELEMENTS = {"Out"}
+
+# Keywords of Digital's test data language that can appear in place of a signal name
+_TEST_KEYWORDS = {"repeat", "loop", "end", "let", "declare", "program", "memory", "while", "if", "else", "bits"}
+
+
+@dataclass
+class CircuitInterface:
+    """Labels of a circuit's ports, plus every other label in it (a testbench may refer to probes and the like)."""
+    inputs: Set[str] = field(default_factory=set)
+    outputs: Set[str] = field(default_factory=set)
+    labels: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class PortCheck:
+    """Outcome of comparing the signals a testbench uses with the ports of a circuit."""
+    # Signals the testbench uses that the circuit does not have, these make Digital fail
+    missing: List[str] = field(default_factory=list)
+    # Ports of the circuit no test case uses, usually the misnamed counterpart of a missing signal
+    unused: List[str] = field(default_factory=list)
+    # Labels of the test cases that use a missing signal, only these can fail because of it
+    testcases: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing
+
+    def message(self, circuit_name: str) -> str:
+        lines = [f"Your circuit `{circuit_name}` is missing the port(s) the tests need: {', '.join(self.missing)}."]
+        for signal in self.missing:
+            suggestions = difflib.get_close_matches(signal, self.unused, n=1, cutoff=0.5)
+            if not suggestions:
+                suggestions = [port for port in self.unused if port.lower() == signal.lower()]
+            if suggestions:
+                lines.append(f"Did you mean to name `{suggestions[0]}` as `{signal}`? Port names are case sensitive.")
+        if self.unused:
+            lines.append(f"Ports in your circuit that no test uses: {', '.join(self.unused)}.")
+        lines.append("Please check the labels of your inputs and outputs.")
+        return "\n".join(lines)
+
+
+def _get_label(element: et.Element) -> str | None:
+    for entry in element.iterfind('elementAttributes/entry'):
+        children = list(entry)
+        if len(children) > 1 and children[0].text == 'Label' and children[1].tag == 'string':
+            return children[1].text
+    return None
+
+
+def get_circuit_interface(schematic_path: Path) -> CircuitInterface:
+    """Reads the labelled elements on the top level of a circuit. Subcircuit ports are not part of its interface."""
+    interface = CircuitInterface()
+    root = et.parse(schematic_path).getroot()
+    for element in root.iterfind('visualElements/visualElement'):
+        label = _get_label(element)
+        if not label:
+            continue
+        name = element.findtext('elementName')
+        interface.labels.add(label)
+        if name in INPUT_ELEMENTS:
+            interface.inputs.add(label)
+        elif name in OUTPUT_ELEMENTS:
+            interface.outputs.add(label)
+    return interface
+
+
+def get_testbench_signals(test_path: Path) -> Dict[str, List[str]]:
+    """Returns the signal names in the header of each test case's test data, by test case label."""
+    signals: Dict[str, List[str]] = {}
+    root = et.parse(test_path).getroot()
+    for element in root.iterfind('.//visualElement'):
+        if element.findtext('elementName') != 'Testcase':
+            continue
+        label = _get_label(element) or "unnamed"
+        data = element.findtext('elementAttributes/entry/testData/dataString') or ""
+
+        # The header is the first line that is not empty once comments are removed
+        for line in data.splitlines():
+            header = re.sub(r'#.*', '', line).split()
+            if header:
+                signals[label] = [name for name in header if name.lower() not in _TEST_KEYWORDS]
+                break
+    return signals
+
+
+def check_ports(schematic_path: Path, test_path: Path) -> PortCheck | None:
+    """
+    Compares the signals a testbench uses with the ports of the circuit under test, without starting Digital.
+    Returns None if either file cannot be read, in which case Digital is left to report the problem.
+    """
+    try:
+        interface = get_circuit_interface(schematic_path)
+        testbench_signals = get_testbench_signals(test_path)
+    except (OSError, et.ParseError) as e:
+        log.debug(f"Skipping the port check of {schematic_path} against {test_path}: {e}")
+        return None
+
+    used: List[str] = []
+    for names in testbench_signals.values():
+        used.extend(name for name in names if name not in used)
+
+    return PortCheck(
+        missing=[name for name in used if name not in interface.labels],
+        unused=sorted((interface.inputs | interface.outputs) - set(used)),
+        testcases=[label for label, names in testbench_signals.items()
+                   if any(name not in interface.labels for name in names)],
+    )
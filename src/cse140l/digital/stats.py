@@ -1,11 +1,12 @@
 import csv
 
 from io import StringIO
-from typing import List, overload
+from typing import List, Dict, Tuple, overload
 from pathlib import Path
 
 from pydantic import PositiveInt, BaseModel
 
+from cse140l.digital.cds import ClassDataArchive
 from cse140l.digital.util import DigitalModule
 from cse140l.lab.config import GateConfig
 
@@ -24,10 +25,26 @@ class GateStat(BaseModel):
             return super().__eq__(other)
 
 
+# Key used to look up gates, mirrors the fields GateStat is compared on
+GateKey = Tuple[str, int | None, int | None]
+
+
+class GateIndex:
+    """Gate counts of a single circuit indexed by (name, inputs, bit_width) for constant time lookups."""
+
+    def __init__(self, gate_list: List[GateStat]):
+        self._counts: Dict[GateKey, int] = {}
+        for gate in gate_list:
+            # Keep the first match, the same gate get_gate_count would have returned
+            self._counts.setdefault((gate.name, gate.inputs, gate.bit_width), gate.count)
+
+    def count(self, gate_config: GateConfig) -> int:
+        return self._counts.get((gate_config.name.upper(), gate_config.inputs, gate_config.bit_width), 0)
+
 
 class CircuitStats(DigitalModule):
-    def __init__(self, cmd: List[str]):
-        super().__init__(cmd)
+    def __init__(self, cmd: List[str], archive: ClassDataArchive = None):
+        super().__init__(cmd, archive=archive)
 
     def get_stats(self, schematic_path: Path, csv_path: Path = None) -> List[GateStat]:
         args = ["stats", "-dig", str(schematic_path)]
@@ -41,7 +58,7 @@ class CircuitStats(DigitalModule):
             return []
             # raise RuntimeError(result.stderr.decode("utf-8"))
 
-        csv_reader = csv.reader(StringIO(result.stdout.decode("utf-8")))
+        csv_reader = csv.reader(StringIO(result.stdout.decode("utf-8", "replace")))
         _ = next(csv_reader)
 
         result_list: List[GateStat] = []
@@ -1,20 +1,29 @@
 import re
-from typing import List
+import os
+import tempfile
+from typing import List, Tuple
 from pathlib import Path
 import xml.etree.ElementTree as et
 import io
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 
-from cse140l.digital.util import DigitalModule
+from cse140l.digital.cds import ClassDataArchive
+from cse140l.digital.interface import check_ports
+from cse140l.digital.util import DigitalModule, ProcessLimits
 from cse140l.gradescope.test_result import TestStatus
-from cse140l.log import log, is_logging_to_file
+from cse140l.log import log, log_artifact
 
 class TestOutput:
-    def __init__(self, name: str, outcome: TestStatus, output: str, err: bool):
+    def __init__(self, name: str, outcome: TestStatus, output: str, err: bool, truncated: bool = False,
+                 diagnostic: str = None):
         self.name = name
         self.outcome = outcome
         self.error = err
         self.output = output
+        self.truncated = truncated
+        # Why a test case failed when it is not a wrong value, e.g. a port the circuit is missing
+        self.diagnostic = diagnostic
         self.signals: List[str] = []
         self.steps: List[dict] = []
 
@@ -41,13 +50,66 @@ class TestOutput:
         return self.name
 
 
-def parse_test_output(output: str, testcase_names: List[str]) -> List[TestOutput]:
+class FailedVectorFilter:
+    """
+    Line filter for Digital's verbose test output that keeps at most max_failed_vectors failing rows
+    of each test case's table. Rows after the limit are dropped before they are ever stored.
+    """
+    _FAILED_LINE = re.compile(rb'^(\S+): failed')
+
+    def __init__(self, max_failed_vectors: int):
+        self.max_failed_vectors = max_failed_vectors
+        self.truncated_testcases: List[str] = []
+        self._testcase: str | None = None
+        self._header_pending = False
+        self._failed_vectors = 0
+
+    def __call__(self, line: bytes) -> bool:
+        stripped = line.strip()
+        if match := self._FAILED_LINE.match(stripped):
+            self._testcase = match.group(1).decode("utf-8", errors="replace")
+            self._header_pending = True
+            self._failed_vectors = 0
+            return True
+
+        if self._testcase is None:
+            return True
+
+        # A blank line ends the table of the current test case
+        if not stripped:
+            self._testcase = None
+            return True
+
+        if self._header_pending:
+            self._header_pending = False
+            return True
+
+        if self._failed_vectors >= self.max_failed_vectors:
+            if self._testcase not in self.truncated_testcases:
+                self.truncated_testcases.append(self._testcase)
+            return False
+
+        if b"E:" in stripped:
+            self._failed_vectors += 1
+        return True
+
+
+def parse_test_output(output: str, testcase_names: List[str], truncated_testcases: List[str] = None,
+                      output_truncated: bool = False) -> List[TestOutput]:
+    """
+    Parses Digital's verbose test output. If the output was cut short, test cases missing from it
+    are reported as failed rather than silently dropped.
+    """
     result: List[TestOutput] = []
-    if is_logging_to_file():
-        log.info(f"Test Output:\n{output}")
+    truncated_testcases = truncated_testcases or []
+    log_artifact("Test Output", output, name="test_output")
     for t in testcase_names:
         test_case = re.search(rf'({t}): (.*)', output)
         if not test_case:
+            if output_truncated:
+                log.warning(f"Test case '{t}' is missing from the truncated output.")
+                result.append(TestOutput(t, TestStatus.FAILED, "Digital produced too much output, so this test case could not be checked.", False, truncated=True))
+                continue
             log.warning(f"Could not find test case '{t}' in output.")
             continue
         test_name = test_case.group(1)
@@ -61,7 +123,7 @@ def parse_test_output(output: str, testcase_names: List[str]) -> List[TestOutput
             status = "error"
             log.error(f"Error running testcase '{test_name}' (reason: {raw_status.strip()})")
         error = status == "error"
-        test_output = TestOutput(test_name, status, raw_status if error else output, error)
+        test_output = TestOutput(test_name, status, raw_status if error else output, error, truncated=test_name in truncated_testcases)
         result.append(test_output)
 
     if len(result) == 0:
@@ -72,6 +134,36 @@ def parse_test_output(output: str, testcase_names: List[str]) -> List[TestOutput
 def get_num_tests_from_output(output: str) -> int:
    return len(re.findall(r'(\w+):', output))
 
+def _get_testcase_label(element: et.Element) -> str | None:
+    """Returns the label of a <visualElement> if it is a "Testcase", otherwise None."""
+    # 1. Filter: Check if <elementName> is "Testcase"
+    element_name_tag = element.find('elementName')
+    if element_name_tag is None or element_name_tag.text != 'Testcase':
+        return None
+
+    # 2. Extract: Look for the corresponding "Label" entry
+    attributes = element.find('elementAttributes')
+    if attributes is None:
+        return None
+
+    for entry in attributes.findall('entry'):
+        children = list(entry)
+
+        # Check if the first child is <string>Label</string>
+        if (len(children) >= 1 and
+                children[0].tag == 'string' and
+                children[0].text == 'Label'):
+
+            # The desired value is the text of the second child <string> element.
+            if len(children) > 1 and children[1].tag == 'string':
+                return children[1].text
+
+            # Once the label entry is found for this Testcase, we can stop
+            # looking at other entries for this element and move to the next visualElement.
+            break
+
+    return None
+
 def extract_all_testcase_labels(xml_path: Path) -> List[str]:
     """
     Reads an XML file and extracts the label string for all <visualElement>
@@ -87,39 +179,69 @@ def extract_all_testcase_labels(xml_path: Path) -> List[str]:
 
     # Iterate over all <visualElement> tags
     for element in root.findall('.//visualElement'):
-        # 1. Filter: Check if <elementName> is "Testcase"
-        element_name_tag = element.find('elementName')
-        if element_name_tag is None or element_name_tag.text != 'Testcase':
-            continue
+        label = _get_testcase_label(element)
+        if label is not None:
+            labels.append(label)
 
-        # 2. Extract: Look for the corresponding "Label" entry
-        attributes = element.find('elementAttributes')
-        if attributes is None:
-            continue
+    return labels
+
+def write_testbench_shards(test_path: Path, shards: int) -> List[Tuple[Path, List[str]]]:
+    """
+    Splits a testbench into at most `shards` copies that each keep a contiguous subset of its
+    labelled Testcase elements, and returns each shard file with the labels it contains.
 
-        for entry in attributes.findall('entry'):
-            children = list(entry)
+    Shards are written next to the original testbench so that any subcircuits it embeds still
+    resolve. The caller is responsible for deleting the returned files. Raises ValueError if a
+    Testcase has no label: it would stay in (and run in) every shard, and its outputs could not be
+    told apart when they are merged.
+    """
+    tree = et.parse(test_path)
+    parents = {child: parent for parent in tree.iter() for child in parent}
+    testcases = [
+        (element, _get_testcase_label(element)) for element in tree.getroot().iterfind('.//visualElement')
+        if element.findtext('elementName') == 'Testcase'
+    ]
+    if any(label is None for _, label in testcases):
+        raise ValueError("it has Testcase elements without a label")
 
-            # Check if the first child is <string>Label</string>
-            if (len(children) >= 1 and
-                    children[0].tag == 'string' and
-                    children[0].text == 'Label'):
+    shards = min(shards, len(testcases))
+    for element, _ in testcases:
+        parents[element].remove(element)
 
-                # The desired value is the text of the second child <string> element.
-                if len(children) > 1 and children[1].tag == 'string':
-                    labels.append(children[1].text)
+    shard_files: List[Tuple[Path, List[str]]] = []
+    try:
+        for i in range(shards):
+            shard = testcases[i * len(testcases) // shards:(i + 1) * len(testcases) // shards]
+            for element, _ in shard:
+                parents[element].append(element)
 
-                # Once the label entry is found for this Testcase, we can stop
-                # looking at other entries for this element and move to the next visualElement.
-                break
+            fd, shard_path = tempfile.mkstemp(prefix=f".{test_path.stem}.shard{i}-", suffix=".dig", dir=test_path.parent)
+            with os.fdopen(fd, "wb") as f:
+                tree.write(f, encoding="utf-8", xml_declaration=True)
+            shard_files.append((Path(shard_path), [label for _, label in shard]))
 
-    return labels
+            for element, _ in shard:
+                parents[element].remove(element)
+    except OSError:
+        for shard_path, _ in shard_files:
+            shard_path.unlink(missing_ok=True)
+        raise
+
+    return shard_files
 
 class Tests(DigitalModule):
-    def __init__(self, cmd: List[str]):
-        super().__init__(cmd)
+    def __init__(self, cmd: List[str], archive: ClassDataArchive = None):
+        super().__init__(cmd, archive=archive)
 
-    def run_test(self, schematic_path: Path, test_path: Path) -> List[TestOutput]:
+    def run_test(self, schematic_path: Path, test_path: Path, shards: int = 1,
+                 limits: ProcessLimits = None, preflight: bool = True) -> List[TestOutput]:
+        """
+        Runs a testbench against a circuit. With shards > 1 the testbench's Testcase elements are split
+        across that many Digital processes which run concurrently, and their outputs are merged back in
+        testbench order. limits bounds the output kept from each process. With preflight, the circuit's
+        ports are checked against the testbench first: test cases that use a missing port fail with an
+        explanation, the others are still run and scored. Digital is not started if every test case is affected.
+        """
         if not test_path.exists():
             return [TestOutput(
                 f"{test_path} not found!",
@@ -136,20 +258,108 @@ class Tests(DigitalModule):
                 True
             )]
 
+        labels = extract_all_testcase_labels(test_path)
+        port_errors: List[TestOutput] = []
+        if preflight:
+            port_check = check_ports(schematic_path, test_path)
+            if port_check is not None and not port_check.ok:
+                log.info(f"{schematic_path.name} is missing ports {port_check.missing} needed by "
+                         f"{port_check.testcases} of {test_path.name}")
+                message = port_check.message(schematic_path.stem)
+                port_errors = [TestOutput(label, TestStatus.FAILED, message, False, diagnostic=message)
+                               for label in port_check.testcases]
+                if set(labels) <= set(port_check.testcases):
+                    return port_errors
+
+        outputs = self._run_all(schematic_path, test_path, labels, shards, limits)
+        if not port_errors or (len(outputs) == 1 and outputs[0].error and outputs[0].name not in labels):
+            return outputs
+
+        # Digital reports the affected test cases as errors, the port check explains what is wrong instead
+        replacements = {output.name: output for output in port_errors}
+        merged = [replacements.pop(output.name, output) for output in outputs]
+        merged.extend(replacements.values())
+        order = {label: i for i, label in reversed(list(enumerate(labels)))}
+        return sorted(merged, key=lambda output: order.get(output.name, len(order)))
+
+    def _run_all(self, schematic_path: Path, test_path: Path, labels: List[str], shards: int = 1,
+                 limits: ProcessLimits = None) -> List[TestOutput]:
+        """Runs every test case of a testbench, in shards if asked to."""
+        if shards > 1 and len(labels) > 1:
+            try:
+                shard_files = write_testbench_shards(test_path, shards)
+            except (OSError, ValueError, et.ParseError) as e:
+                log.warning(f"Could not shard {test_path}, running it as a single test: {e}")
+            else:
+                return self._run_shards(schematic_path, test_path, labels, shard_files, limits)
+
+        outputs, _ = self._run_testbench(schematic_path, test_path, test_path, labels, limits)
+        return outputs
+
+    def _run_shards(self, schematic_path: Path, test_path: Path, labels: List[str],
+                    shard_files: List[Tuple[Path, List[str]]], limits: ProcessLimits = None) -> List[TestOutput]:
+        """Runs every shard of a testbench concurrently and merges the outputs back into testbench order."""
+        log.debug(f"Running {test_path} as {len(shard_files)} shards")
+        try:
+            with ThreadPoolExecutor(max_workers=len(shard_files)) as executor:
+                shard_results = list(executor.map(
+                    lambda shard: self._run_testbench(schematic_path, shard[0], test_path, shard[1], limits),
+                    shard_files
+                ))
+        finally:
+            for shard_path, _ in shard_files:
+                shard_path.unlink(missing_ok=True)
+
+        merged: List[TestOutput] = []
+        for outputs, ran in shard_results:
+            # If Digital could not run a shard at all, the whole testbench is reported as an error like an unsharded run
+            if not ran:
+                return outputs
+            merged.extend(outputs)
+
+        order = {label: i for i, label in reversed(list(enumerate(labels)))}
+        return sorted(merged, key=lambda output: order.get(output.name, len(order)))
+
+    def _run_testbench(self, schematic_path: Path, test_path: Path, display_path: Path,
+                       labels: List[str], limits: ProcessLimits = None) -> Tuple[List[TestOutput], bool]:
+        """Runs a single Digital test process, returning its outputs and whether Digital was able to run it."""
         args = ["test", "-circ", str(schematic_path), "-tests", str(test_path), "-verbose"]
 
-        result = super()._run(args)
+        limits = limits if limits is not None else self.limits
+        vector_filter = FailedVectorFilter(limits.max_failed_vectors) if limits.max_failed_vectors is not None else None
+        result = super()._run(args, limits=limits, line_filter=vector_filter)
+        if result.truncated:
+            log.warning(f"Output of {display_path} exceeded {limits.max_output_bytes} bytes, Digital was stopped early")
+
+        limit_message = None
+        if result.timed_out:
+            limit_message = (f"Your circuit did not finish simulating within {limits.timeout:g} seconds. "
+                             f"This usually means it contains a combinational loop or oscillates.")
+        elif result.cpu_time_exceeded:
+            limit_message = f"Your circuit used more than {limits.cpu_time} seconds of CPU time while simulating."
+        elif result.out_of_memory:
+            limit_message = "Your circuit ran out of memory while simulating."
+        elif result.returncode < 0 and not result.truncated:
+            # Killed by a signal we did not send for truncation: the RLIMIT_CPU hard limit, a crash under
+            # RLIMIT_AS or the OOM killer. Testcases after the kill never ran, so they must not go missing silently.
+            limit_message = (f"Digital was stopped by signal {-result.returncode} while simulating your circuit, "
+                             f"most likely because it exceeded a CPU time or memory limit.")
+
+        if limit_message is not None:
+            log.warning(f"Stopped running {display_path}: {limit_message}")
+            return [TestOutput(f"{display_path}", TestStatus.FAILED, limit_message, True)], False
 
         # Digital by default returns error codes > 100 for things like file not found etc.
         if result.returncode > 100:
             error_result = TestOutput(
-                f"{test_path}",
+                f"{display_path}",
                 TestStatus.FAILED,
-                f"STDOUT: {result.stdout.decode('utf-8')}\nSTDERR: {result.stderr.decode('utf-8')}\nERR:{result.returncode}",
+                f"STDOUT: {result.stdout.decode('utf-8', 'replace')}\nSTDERR: {result.stderr.decode('utf-8', 'replace')}\nERR:{result.returncode}",
                 True
             )
-            log.debug(f"Error running {test_path}")
-            return [error_result]
+            log.debug(f"Error running {display_path}")
+            return [error_result], False
 
-        result_text = result.stdout.decode("utf-8").strip()
-        return parse_test_output(result_text, extract_all_testcase_labels(test_path))
+        result_text = result.stdout.decode("utf-8", "replace").strip()
+        truncated_testcases = vector_filter.truncated_testcases if vector_filter is not None else []
+        return parse_test_output(result_text, labels, truncated_testcases, result.truncated), True
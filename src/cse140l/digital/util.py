@@ -1,11 +1,193 @@
+import os
+import signal
+import threading
 import subprocess
-from typing import List
+from pathlib import Path
+from dataclasses import dataclass
+from typing import List, Callable, IO, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from cse140l.digital.cds import ClassDataArchive
+    from cse140l.lab.config import TestConfig
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, resource limits are skipped there
+    resource = None
+
+# Largest amount of a single Digital process's stdout kept in memory before it is killed
+DEFAULT_MAX_OUTPUT_BYTES = 16 * 1024 * 1024
+
+# Wall-clock seconds a single Digital process may run before it is killed
+DEFAULT_TIMEOUT = 300.
+
+# Size of the chunks output is read in, this also bounds how long a single line can be
+_READ_SIZE = 64 * 1024
+
+
+@dataclass
+class ProcessLimits:
+    """Bounds on the time, resources and output a single Digital invocation may use."""
+    max_output_bytes: int | None = DEFAULT_MAX_OUTPUT_BYTES
+    max_failed_vectors: int | None = None
+    timeout: float | None = DEFAULT_TIMEOUT
+    # RLIMIT_CPU in seconds
+    cpu_time: int | None = None
+    # RLIMIT_AS in bytes, the JVM reserves a lot of address space up front so prefer java_heap where possible
+    max_memory: int | None = None
+    # Passed to the JVM as -Xmx, e.g. "512m"
+    java_heap: str | None = None
+
+
+def get_process_limits(test: "TestConfig") -> ProcessLimits:
+    """Builds the limits Digital runs under for a test from its config."""
+    return ProcessLimits(
+        max_output_bytes=test.max_output_bytes or DEFAULT_MAX_OUTPUT_BYTES,
+        max_failed_vectors=test.max_failed_vectors,
+        timeout=test.timeout or DEFAULT_TIMEOUT,
+        cpu_time=test.cpu_time_limit,
+        max_memory=test.memory_limit_mb * 1024 * 1024 if test.memory_limit_mb else None,
+        java_heap=test.java_heap,
+    )
+
+
+class DigitalResult(subprocess.CompletedProcess):
+    """
+    A completed Digital process. truncated is set if it was killed for producing too much output,
+    timed_out if it was killed for running longer than its timeout.
+    """
+
+    def __init__(self, args: List[str], returncode: int, stdout: bytes, stderr: bytes, truncated: bool = False,
+                 timed_out: bool = False):
+        super().__init__(args, returncode, stdout, stderr)
+        self.truncated = truncated
+        self.timed_out = timed_out
+
+    @property
+    def cpu_time_exceeded(self) -> bool:
+        return self.returncode == -signal.SIGXCPU if hasattr(signal, "SIGXCPU") else False
+
+    @property
+    def out_of_memory(self) -> bool:
+        return b"OutOfMemoryError" in self.stderr
+
+
+def _drain(stream: IO[bytes], chunks: List[bytes], max_bytes: int | None) -> None:
+    """
+    Reads a stream to the end, keeping at most max_bytes of it. Chunks are raw bytes and the cut at max_bytes may
+    split a character, so the joined output has to be decoded with errors="replace".
+    """
+    kept = 0
+    for chunk in iter(lambda: stream.read(_READ_SIZE), b""):
+        if max_bytes is None or kept < max_bytes:
+            chunks.append(chunk if max_bytes is None else chunk[:max_bytes - kept])
+            kept += len(chunks[-1])
+
+
+def kill_process_tree(process: subprocess.Popen) -> None:
+    """Kills a process started in its own session along with anything it spawned."""
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _apply_resource_limits(process: subprocess.Popen, limits: ProcessLimits) -> None:
+    """
+    Applies the CPU and memory rlimits to a freshly started process. prlimit is used instead of a
+    preexec_fn because Digital is launched from several threads at once.
+    """
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+
+    try:
+        if limits.cpu_time is not None:
+            # The soft limit sends SIGXCPU, the hard limit a second later guarantees a SIGKILL
+            resource.prlimit(process.pid, resource.RLIMIT_CPU, (limits.cpu_time, limits.cpu_time + 1))
+        if limits.max_memory is not None:
+            resource.prlimit(process.pid, resource.RLIMIT_AS, (limits.max_memory, limits.max_memory))
+    except (OSError, ValueError):
+        # The process may already have exited
+        pass
 
 
 class DigitalModule:
-    def __init__(self, cmd: List[str]):
+    def __init__(self, cmd: List[str], limits: ProcessLimits = None, archive: "ClassDataArchive" = None):
         self.cmd = cmd
+        self.limits = limits if limits is not None else ProcessLimits()
+        self.archive = archive
+
+    def _build_command(self, command: List[str], limits: ProcessLimits) -> List[str]:
+        """Adds the JVM options required by the limits and class data sharing to the Digital command line."""
+        if not self.cmd or Path(self.cmd[0]).stem != "java":
+            return self.cmd + command
+
+        jvm_options: List[str] = []
+        if limits.java_heap is not None:
+            jvm_options.append(f"-Xmx{limits.java_heap}")
+        if self.archive is not None and command:
+            jvm_options.extend(self.archive.get_jvm_options(command[0]))
+        return [self.cmd[0], *jvm_options] + self.cmd[1:] + command
+
+    def _run(self, command: List[str], limits: ProcessLimits = None,
+             line_filter: Callable[[bytes], bool] = None) -> DigitalResult:
+        """
+        Runs a Digital CLI command, reading its stdout line by line as it is produced.
+
+        Lines rejected by line_filter are dropped without being stored. If the kept output grows past
+        limits.max_output_bytes, the process is killed and the result is marked as truncated. If it
+        runs longer than limits.timeout, it is killed and the result is marked as timed out.
+        """
+        limits = limits if limits is not None else self.limits
+        args = self._build_command(command, limits)
+        # A new session lets the whole process tree be killed, so no child can keep the pipes open
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        _apply_resource_limits(process, limits)
+
+        timed_out = threading.Event()
+
+        def on_timeout() -> None:
+            timed_out.set()
+            kill_process_tree(process)
+
+        watchdog = threading.Timer(limits.timeout, on_timeout) if limits.timeout is not None else None
+        if watchdog is not None:
+            watchdog.daemon = True
+            watchdog.start()
+
+        stderr_chunks: List[bytes] = []
+        stderr_reader = threading.Thread(target=_drain, args=(process.stderr, stderr_chunks, limits.max_output_bytes), daemon=True)
+        stderr_reader.start()
+
+        stdout_chunks: List[bytes] = []
+        kept = 0
+        truncated = False
+        with process:
+            try:
+                for line in iter(lambda: process.stdout.readline(_READ_SIZE), b""):
+                    if line_filter is not None and not line_filter(line):
+                        continue
+
+                    stdout_chunks.append(line)
+                    kept += len(line)
+                    if limits.max_output_bytes is not None and kept > limits.max_output_bytes:
+                        truncated = True
+                        kill_process_tree(process)
+                        break
+            except BaseException:
+                # The child is in its own session, so it would not see a Ctrl-C meant for us
+                kill_process_tree(process)
+                raise
+            finally:
+                # The watchdog stays armed until the process has actually exited
+                returncode = process.wait()
+                if watchdog is not None:
+                    watchdog.cancel()
+
+            stderr_reader.join()
 
-    def _run(self, command: List[str]) -> subprocess.CompletedProcess:
-        process = subprocess.run(self.cmd + command, capture_output=True)
-        return process
\ No newline at end of file
+        return DigitalResult(args, returncode, b"".join(stdout_chunks), b"".join(stderr_chunks), truncated,
+                             timed_out.is_set())
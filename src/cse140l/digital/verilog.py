@@ -1,24 +1,80 @@
+import os
+import json
+import time
+import hashlib
 import subprocess
+import xml.etree.ElementTree as et
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Set
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from cse140l.digital.cds import ClassDataArchive
+from cse140l.digital.util import DigitalModule, DigitalResult, ProcessLimits
+from cse140l.log import log
 
-class VerilogExport:
-    def __init__(self, jar_file: Path) -> None:
-        self.jar_file = jar_file
-        self.cmd = ["java", "-cp", str(self.jar_file), "CLI"]
+# Name of the file in the Verilog output directory recording which schematic closure produced each .v file
+EXPORT_MANIFEST = ".export_manifest.json"
+
+
+def get_schematic_closure(schematic_path: Path) -> List[Path]:
+    """
+    Returns the schematic together with every .dig file it (transitively) uses as a subcircuit.
+    Subcircuits that cannot be found next to the schematic are skipped, Digital reports those itself.
+    """
+    closure: Set[Path] = set()
+    pending: List[Path] = [schematic_path.absolute()]
+
+    while pending:
+        circuit = pending.pop()
+        if circuit in closure or not circuit.is_file():
+            continue
+        closure.add(circuit)
+
+        try:
+            root = et.parse(circuit).getroot()
+        except Exception as e:
+            log.debug(f"Could not parse {circuit} while collecting subcircuits: {e}")
+            continue
 
-    def _run(self, command: List[str]) -> subprocess.CompletedProcess:
-        process = subprocess.run(self.cmd + command, capture_output=True)
-        return process
+        for element_name in root.iterfind('.//visualElement/elementName'):
+            if element_name.text and element_name.text.endswith(".dig"):
+                pending.append(Path(circuit.parent, element_name.text))
 
-    def export_schematic(self, schematic_path: Path, verilog_path: Path) -> subprocess.CompletedProcess:
+    return sorted(closure)
+
+
+def hash_schematic_closure(schematic_path: Path) -> str:
+    """Hashes the contents of a schematic and all of its subcircuits."""
+    digest = hashlib.sha256()
+    for circuit in get_schematic_closure(schematic_path):
+        digest.update(circuit.name.encode("utf-8"))
+        digest.update(circuit.read_bytes())
+    return digest.hexdigest()
+
+
+class VerilogExport(DigitalModule):
+    def __init__(self, jar_file: Path, max_workers: int | None = None, limits: ProcessLimits = None,
+                 use_cds: bool = True) -> None:
+        super().__init__(["java", "-cp", str(jar_file), "CLI"], limits, ClassDataArchive(jar_file) if use_cds else None)
+        self.jar_file = jar_file
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def export_schematic(self, schematic_path: Path, verilog_path: Path) -> DigitalResult:
         args = ["verilog", "-dig", str(schematic_path), "-verilog", str(verilog_path)]
-        result = self._run(args)
+        result = super()._run(args)
+        if result.timed_out:
+            log.error(f"Exporting {schematic_path} timed out after {self.limits.timeout:g}s")
         return result
 
     def export_schematics(self, schematic_dir: Path, verilog_dir: Path, top_level: Path = None,
-                          gradescope_results: Path = None) -> List[Tuple[Path, subprocess.CompletedProcess]]:
+                          gradescope_results: Path = None, force: bool = False) -> List[Tuple[Path, subprocess.CompletedProcess]]:
+        """
+        Exports every schematic in a directory to Verilog, running up to max_workers exports at once.
+
+        A schematic is skipped if its .v file is newer than the last export and the hash of the
+        schematic and its subcircuits is unchanged, unless force is set. Results are returned in
+        directory order, while the status of each export is logged as soon as it finishes.
+        """
 
         def get_verilog_path(circuit: Path) -> Path:
             return Path(verilog_dir, circuit.stem + ".v")
@@ -37,19 +93,75 @@ class VerilogExport:
         else:
             schematics_to_export = [schematic for schematic in schematic_dir.iterdir() if schematic.is_file()]
 
-        schematics_to_export = list(filter(lambda p: str(p).endswith(".dig"), schematics_to_export))
+        schematics_to_export = sorted(filter(lambda p: str(p).endswith(".dig"), schematics_to_export))
+
+        manifest_path = Path(verilog_dir, EXPORT_MANIFEST)
+        manifest: Dict[str, Dict] = {}
+        if manifest_path.exists() and not force:
+            try:
+                with open(manifest_path, 'r') as f:
+                    manifest = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                log.warning(f"Ignoring unreadable export manifest {manifest_path}: {e}")
+
+        exported: Dict[Path, Tuple[subprocess.CompletedProcess, float]] = {}
+        pending: Dict[Path, str] = {}
+        for schematic_path in schematics_to_export:
+            closure_hash = hash_schematic_closure(schematic_path)
+            verilog_path = get_verilog_path(schematic_path)
+            entry = manifest.get(schematic_path.name)
+            if (entry is not None and entry.get("hash") == closure_hash and verilog_path.exists()
+                    and verilog_path.stat().st_mtime >= entry.get("exported_at", float("inf"))):
+                log.info(f"`{schematic_path.name}`: Up to date, skipping export")
+                exported[schematic_path] = (subprocess.CompletedProcess([], 0, b"", b""), 0.)
+            else:
+                pending[schematic_path] = closure_hash
+
+        def timed_export(circuit: Path) -> Tuple[subprocess.CompletedProcess, float]:
+            start = time.perf_counter()
+            result = self.export_schematic(circuit, get_verilog_path(circuit))
+            return result, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(timed_export, circuit): circuit for circuit in pending}
+            for future in as_completed(futures):
+                schematic_path = futures[future]
+                result, elapsed = future.result()
+                exported[schematic_path] = (result, elapsed)
+
+                verilog_path = get_verilog_path(schematic_path)
+                if result.returncode == 0 and verilog_path.exists():
+                    log.info(f"`{schematic_path.name}`: Exported in {elapsed:.2f}s")
+                    manifest[schematic_path.name] = {
+                        "hash": pending[schematic_path],
+                        "exported_at": verilog_path.stat().st_mtime,
+                    }
+                else:
+                    log.error(f"`{schematic_path.name}`: Failed after {elapsed:.2f}s\n{result.stderr.decode('utf-8', 'replace')}")
+                    manifest.pop(schematic_path.name, None)
+
+        try:
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=4)
+        except OSError as e:
+            log.warning(f"Could not write export manifest {manifest_path}: {e}")
 
-        exported_results = [(schematic_path, self.export_schematic(schematic_path, get_verilog_path(schematic_path)))
-                            for schematic_path in schematics_to_export]
+        exported_results = [(schematic_path, exported[schematic_path][0]) for schematic_path in schematics_to_export]
 
         if gradescope_results is not None:
             outputs = []
             status = "passed"
-            for schematic, result in exported_results:
+            for schematic in schematics_to_export:
+                result, elapsed = exported[schematic]
                 line = f"`{schematic}`: "
                 if result.returncode != 0:
                     status = "failed"
-                line += status.capitalize()
+                    line += "Failed"
+                elif schematic in pending:
+                    line += "Passed"
+                else:
+                    line += "Up to date"
+                line += f" ({elapsed:.2f}s)"
                 outputs.append(line)
 
             res = {
@@ -65,7 +177,7 @@ class VerilogExport:
                 ]
             }
 
-            # with open(gradescope_results, "w") as gradescope_results_file:
-            #     json.dump(res, gradescope_results_file, indent=4)
+            with open(gradescope_results, "w") as gradescope_results_file:
+                json.dump(res, gradescope_results_file, indent=4)
 
         return exported_results
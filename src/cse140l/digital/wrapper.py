@@ -1,22 +1,35 @@
 import subprocess
 from pathlib import Path
 from subprocess import Popen
+from typing import Dict, Tuple
 
+from cse140l.digital.cds import ClassDataArchive
 from cse140l.digital.stats import CircuitStats
 from cse140l.digital.images import ImageExport
 from cse140l.digital.tests import Tests
 
 
 class Digital:
-    def __init__(self, jar_file: Path) -> None:
+    def __init__(self, jar_file: Path, use_cds: bool = True) -> None:
         self.jar_file = jar_file
         self.cmd = ["java", "-jar", str(self.jar_file)]
         self.cli_cmd = ["java", "-cp", str(self.jar_file), "CLI"]
+        # Class data sharing archives are only used once warm_up() has created them
+        self.archive = ClassDataArchive(self.jar_file) if use_cds else None
 
-        self.img = ImageExport(self.cli_cmd)
-        self.test = Tests(self.cli_cmd)
-        self.stats = CircuitStats(self.cli_cmd)
+        self.img = ImageExport(self.cli_cmd, archive=self.archive)
+        self.test = Tests(self.cli_cmd, archive=self.archive)
+        self.stats = CircuitStats(self.cli_cmd, archive=self.archive)
 
+    def warm_up(self, force: bool = False) -> Dict[str, Tuple[float, float]]:
+        """
+        One-time step that creates class data sharing archives for the jar, which every later Digital call
+        (from any module) picks up to start faster. Returns the measured startup time of each archived
+        command without and with its archive.
+        """
+        if self.archive is None:
+            return {}
+        return self.archive.warm_up(self.cli_cmd, force=force)
 
     def launch(self, circuit: Path = None) -> Popen[bytes]:
         process = subprocess.Popen(self.cmd + [str(circuit)])
@@ -0,0 +1,242 @@
+import os
+import csv
+import json
+import argparse
+from pathlib import Path
+from dataclasses import dataclass, field, fields
+from typing import List, Dict, Set, Tuple, Iterable, Iterator, Callable, TypeVar
+from concurrent.futures import ProcessPoolExecutor, Executor, Future, FIRST_COMPLETED, wait
+
+from cse140l.gradescope.test_result import TestResult, TestStatus
+from cse140l.log import log, setup_logger
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# (name, score, max_score, status) of a single test in a results file
+TestSummary = Tuple[str, float, float, str]
+
+_TEST_RESULT_FIELDS = {f.name for f in fields(TestResult)}
+
+
+def _summarize_results(results_file: Path) -> List[TestSummary] | None:
+    """
+    Parses a results.json in a worker process. Only the few fields the statistics need are sent back,
+    so the parent never holds a whole results file. Returns None if the file cannot be read, malformed
+    test records (e.g. a missing or non-numeric score) are skipped.
+    """
+    try:
+        with open(results_file, 'r') as f:
+            results_json = json.load(f)
+        tests = results_json.get("tests", [])
+        if not isinstance(tests, list):
+            raise TypeError(f"\"tests\" is a {type(tests).__name__}, not a list")
+    except (OSError, json.JSONDecodeError, TypeError, AttributeError) as e:
+        log.warning(f"Skipping unreadable results file {results_file}: {e}")
+        return None
+
+    summaries: List[TestSummary] = []
+    for i, t in enumerate(tests):
+        try:
+            test_result = TestResult(**{key: value for key, value in t.items() if key in _TEST_RESULT_FIELDS})
+            summaries.append((test_result.name, float(test_result.score), float(test_result.max_score),
+                              str(test_result.status)))
+        except (TypeError, ValueError, AttributeError) as e:
+            log.warning(f"Skipping malformed test {i} in {results_file}: {e}")
+    return summaries
+
+
+def _bounded_map(executor: Executor, function: Callable[[T], R], items: Iterable[T], window: int) -> Iterator[R]:
+    """
+    Like executor.map, but keeps at most `window` items in flight and yields results as they finish.
+    executor.map would submit (and so hold) every item up front.
+    """
+    in_flight: Set[Future] = set()
+    for item in items:
+        if len(in_flight) >= window:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        in_flight.add(executor.submit(function, item))
+
+    for future in in_flight:
+        yield future.result()
+
+
+def find_results_files(paths: List[Path], file_name: str = "results.json") -> Iterator[Path]:
+    """Lazily walks the given files and directories, yielding every results file found."""
+    for path in paths:
+        if path.is_file():
+            yield path
+            continue
+        for directory, _, files in os.walk(path):
+            if file_name in files:
+                yield Path(directory, file_name)
+
+
+class ScoreHistogram:
+    """Fixed size histogram of score fractions between 0 and 1."""
+
+    def __init__(self, bins: int):
+        self.counts: List[int] = [0] * bins
+
+    def add(self, score: float, max_score: float) -> None:
+        fraction = score / max_score if max_score > 0 else 1.
+        index = int(min(max(fraction, 0.), 1.) * len(self.counts))
+        self.counts[min(index, len(self.counts) - 1)] += 1
+
+    def rows(self) -> Iterator[Tuple[str, str, int]]:
+        for i, count in enumerate(self.counts):
+            yield f"{i / len(self.counts):.2f}", f"{(i + 1) / len(self.counts):.2f}", count
+
+
+@dataclass
+class TestStats:
+    """Running statistics of a single test across all submissions."""
+    histogram: ScoreHistogram
+    submissions: int = 0
+    passed: int = 0
+    failed: int = 0
+    score_total: float = 0.
+    max_score: float = 0.
+
+    def add(self, score: float, max_score: float, status: str) -> None:
+        self.submissions += 1
+        self.score_total += score
+        self.max_score = max(self.max_score, max_score)
+        if status == TestStatus.PASSED:
+            self.passed += 1
+        else:
+            self.failed += 1
+        self.histogram.add(score, max_score)
+
+
+@dataclass
+class ResultsAggregator:
+    """Accumulates statistics over results files one at a time, its size only depends on the number of tests."""
+    bins: int = 10
+    submissions: int = 0
+    skipped: int = 0
+    tests: Dict[str, TestStats] = field(default_factory=dict)
+    total_histogram: ScoreHistogram = None
+
+    def __post_init__(self):
+        if self.total_histogram is None:
+            self.total_histogram = ScoreHistogram(self.bins)
+
+    def add(self, summary: List[TestSummary] | None) -> None:
+        if summary is None:
+            self.skipped += 1
+            return
+
+        self.submissions += 1
+        total_score = 0.
+        total_max_score = 0.
+        for name, score, max_score, status in summary:
+            if name not in self.tests:
+                self.tests[name] = TestStats(ScoreHistogram(self.bins))
+            self.tests[name].add(score, max_score, status)
+            total_score += score
+            total_max_score += max_score
+        self.total_histogram.add(total_score, total_max_score)
+
+    def write_csv(self, output_dir: Path) -> None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(Path(output_dir, "test_stats.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["test", "submissions", "passed", "failed", "pass_rate", "mean_score", "max_score"])
+            for name, stats in sorted(self.tests.items()):
+                writer.writerow([
+                    name,
+                    stats.submissions,
+                    stats.passed,
+                    stats.failed,
+                    f"{stats.passed / stats.submissions:.4f}",
+                    f"{stats.score_total / stats.submissions:.4f}",
+                    stats.max_score,
+                ])
+
+        with open(Path(output_dir, "test_score_histogram.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["test", "bin_start", "bin_end", "count"])
+            for name, stats in sorted(self.tests.items()):
+                for row in stats.histogram.rows():
+                    writer.writerow([name, *row])
+
+        with open(Path(output_dir, "total_score_histogram.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["bin_start", "bin_end", "count"])
+            for row in self.total_histogram.rows():
+                writer.writerow(row)
+
+
+def aggregate_results(paths: List[Path], bins: int = 10, workers: int | None = None,
+                      file_name: str = "results.json") -> ResultsAggregator:
+    """Parses every results file under the given paths in parallel and aggregates them."""
+    workers = workers or os.cpu_count() or 1
+    aggregator = ResultsAggregator(bins=bins)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results_files = find_results_files(paths, file_name)
+        for summary in _bounded_map(executor, _summarize_results, results_files, window=workers * 4):
+            aggregator.add(summary)
+
+    return aggregator
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="cse140l aggregate",
+        description="Aggregate Gradescope results.json files into per-test statistics"
+    )
+
+    parser.add_argument(
+        "paths",
+        type=Path,
+        nargs="+",
+        help="results.json files or directories to search for them (e.g. a Gradescope submissions export)."
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=Path,
+        default=Path("."),
+        help="Directory to write the CSV files to."
+    )
+
+    parser.add_argument(
+        "--bins",
+        type=int,
+        default=10,
+        help="Number of bins in the score histograms."
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of parser processes (defaults to the CPU count)."
+    )
+
+    parser.add_argument(
+        "--file-name",
+        type=str,
+        default="results.json",
+        help="Name of the results files to look for inside directories."
+    )
+
+    args = parser.parse_args(argv)
+
+    setup_logger()
+
+    aggregator = aggregate_results(args.paths, bins=args.bins, workers=args.workers, file_name=args.file_name)
+    aggregator.write_csv(args.output_dir)
+
+    log.info(f"Aggregated {aggregator.submissions} results files ({aggregator.skipped} skipped) "
+             f"covering {len(aggregator.tests)} tests into {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,6 @@ from typing import List
 from cse140l.gradescope.test_result import TestResult, TextFormat
 from json import dumps, load
 from pathlib import Path
-from minify_html import minify
 
 class AutograderWriter:
     def __init__(self, existing_tests: List[Path] = None):
@@ -20,6 +19,7 @@ class AutograderWriter:
         self.output = output
         self.output_format = output_format
         if self.output_format == TextFormat.HTML or self.output_format == TextFormat.SIMPLE_FORMAT:
+            from minify_html import minify
             self.output = minify(
                 self.output.replace('"', "'"),
                 minify_css=True,
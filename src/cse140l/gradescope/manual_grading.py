@@ -1,23 +1,66 @@
 import argparse
 import os
-from typing import Dict
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Dict, List
 
 import questionary
-import csv
 import yaml
 from pathlib import Path
 
+from cse140l.digital.stats import GateStat
+from cse140l.digital.tests import TestOutput
+from cse140l.digital.util import get_process_limits
 from cse140l.digital.wrapper import Digital
+from cse140l.gradescope.test_result import TestStatus
 from cse140l.lab.config import get_config_from_toml
+from cse140l.log import log, setup_logger
+
+
+@dataclass
+class Submission:
+    """A single submission of a Gradescope export."""
+    submission_id: str
+    directory: Path
+    submitters: List[str]
+    score: float | None = None
+
+
+@dataclass
+class ReviewData:
+    """Everything shown while reviewing a submission, produced by the (slow) Digital calls."""
+    svgs: Dict[str, str] = field(default_factory=dict)
+    stats: Dict[str, List[GateStat]] = field(default_factory=dict)
+    test_outputs: Dict[str, List[TestOutput]] = field(default_factory=dict)
+    missing_files: List[str] = field(default_factory=list)
 
 
 class ManualGrader:
-    def __init__(self, config_file: Path, exported_submissions: Path, jar_file: Path = None) -> None:
+    """
+    Walks the submissions of a Gradescope export for manual review. While one submission is being reviewed,
+    the next `prefetch` ones are prepared by background workers. Prepared submissions are kept in an LRU cache
+    of `cache_size` entries, so going back to a recent submission is instant.
+    """
+
+    def __init__(self, config_file: Path, exported_submissions: Path, jar_file: Path = None, prefetch: int = 3,
+                 workers: int = 2, cache_size: int = 16) -> None:
         self.config = get_config_from_toml(config_file.absolute())
         if jar_file:
             self.config.digital_jar = jar_file.absolute()
-        self.digital: Digital = Digital(jar_file)
+        self.digital: Digital = Digital(self.config.digital_jar)
         self.exported_submissions: Path = exported_submissions.absolute()
+        self.top_level = sorted(set(test.top_level for test in self.config.tests))
+
+        self.prefetch = prefetch
+        # The cache always has room for the previous and current submission and the prefetch window
+        self.cache_size = max(cache_size, prefetch + 2)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._cache: OrderedDict[str, Future[ReviewData]] = OrderedDict()
+        self._svg_dir = Path(tempfile.mkdtemp(prefix="cse140l_review_"))
+
         self._generate_metadata()
 
     def _generate_metadata(self) -> None:
@@ -25,15 +68,156 @@ class ManualGrader:
         with open(submission_metadata_file, "r") as f:
             submission_metadata: Dict = yaml.safe_load(f.read())
 
+        # Gradescope writes Ruby style keys (":submitters"), accept plain ones as well
+        def get(meta: Dict, key: str):
+            return meta.get(f":{key}", meta.get(key))
+
         self.meta_data: Dict[str, Dict] = {}
-        for submission in submission_metadata.keys():
-            pass
-            # self.meta_data[submission["submi["name"]] = "Hello"
+        self.submissions: List[Submission] = []
+        for submission_id, meta in sorted(submission_metadata.items()):
+            meta = meta or {}
+            directory = Path(self.exported_submissions, submission_id)
+            if not directory.is_dir():
+                log.warning(f"Submission {submission_id} is in the metadata but not in the export, skipping it")
+                continue
+
+            submitters = [
+                f"{get(submitter, 'name')} ({get(submitter, 'sid')})" for submitter in get(meta, "submitters") or []
+            ]
+            score = get(meta, "score")
+            self.meta_data[submission_id] = meta
+            self.submissions.append(Submission(submission_id, directory, submitters,
+                                               float(score) if score is not None else None))
+
+        log.info(f"Found {len(self.submissions)} submissions in {self.exported_submissions}")
+
+    def _find_schematic(self, submission: Submission, top_level: str) -> Path | None:
+        """Finds a top level schematic anywhere in a submission, students do not always upload to the root."""
+        direct = Path(submission.directory, f"{top_level}.dig")
+        if direct.is_file():
+            return direct
+        return next(submission.directory.rglob(f"{top_level}.dig"), None)
+
+    def _load_review_data(self, submission: Submission) -> ReviewData:
+        """Runs every Digital call needed to review a submission. Called from the prefetch workers."""
+        data = ReviewData()
+        schematics: Dict[str, Path] = {}
+        for top_level in self.top_level:
+            schematic = self._find_schematic(submission, top_level)
+            if schematic is None:
+                data.missing_files.append(top_level)
+                continue
+            schematics[top_level] = schematic
+            data.svgs[top_level] = self.digital.img.export_svg(schematic)
+            data.stats[top_level] = self.digital.stats.get_stats(schematic)
+
+        for test in self.config.tests:
+            if test.top_level not in schematics:
+                continue
+            data.test_outputs[test.name] = self.digital.test.run_test(
+                schematics[test.top_level], test.test_file, shards=test.shards,
+                limits=get_process_limits(test), preflight=test.preflight
+            )
+        return data
+
+    def _schedule(self, index: int) -> Future[ReviewData]:
+        """Returns the (possibly still running) preparation of a submission, starting it if needed."""
+        submission = self.submissions[index]
+        future = self._cache.get(submission.submission_id)
+        # Failed preparations are retried when the submission is asked for again
+        if future is None or future.cancelled() or (future.done() and future.exception() is not None):
+            future = self._executor.submit(self._load_review_data, submission)
+            self._cache[submission.submission_id] = future
+        self._cache.move_to_end(submission.submission_id)
+        return future
+
+    def _evict(self, keep: List[str]) -> None:
+        """Drops the least recently used entries beyond the cache size, cancelling those that have not started."""
+        for submission_id in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if submission_id in keep:
+                continue
+            self._cache.pop(submission_id).cancel()
 
-        print(self.meta_data)
+    def get_review_data(self, index: int) -> ReviewData:
+        """Returns the review data of a submission, waiting for it if needed, and prefetches the ones after it."""
+        future = self._schedule(index)
+
+        window = range(index + 1, min(index + 1 + self.prefetch, len(self.submissions)))
+        for next_index in window:
+            self._schedule(next_index)
+        # The submission being looked at is the most recently used entry again
+        self._cache.move_to_end(self.submissions[index].submission_id)
+        self._evict([self.submissions[i].submission_id for i in [index, *window]])
+
+        return future.result()
+
+    def show(self, index: int) -> None:
+        submission = self.submissions[index]
+        try:
+            data = self.get_review_data(index)
+        except Exception as e:
+            log.error(f"Could not prepare submission {submission.submission_id}: {e}")
+            return
+
+        log.info(f"[{index + 1}/{len(self.submissions)}] {submission.submission_id}: "
+                 f"{', '.join(submission.submitters) or 'unknown submitter'}, score {submission.score}")
+        for missing in data.missing_files:
+            log.info(f"  Missing file: {missing}.dig")
+
+        for top_level, svg in data.svgs.items():
+            svg_path = Path(self._svg_dir, f"{submission.submission_id}_{top_level}.svg")
+            if not svg_path.exists():
+                svg_path.write_text(svg)
+            gates = ", ".join(f"{gate.name}x{gate.count}" for gate in data.stats.get(top_level, []))
+            log.info(f"  {top_level}: {svg_path} ({gates or 'no gate stats'})")
+
+        for test_name, outputs in data.test_outputs.items():
+            if outputs and outputs[0].error:
+                log.info(f"  {test_name}: error: {outputs[0].output or outputs[0].name}")
+                continue
+            failed = [output.name for output in outputs if output.outcome == TestStatus.FAILED]
+            log.info(f"  {test_name}: {len(outputs) - len(failed)}/{len(outputs)} passed"
+                     + (f", failed: {', '.join(failed)}" if failed else ""))
+
+    def review(self, start: int = 0) -> None:
+        """Interactive review loop over all submissions."""
+        if not self.submissions:
+            return
+
+        index = min(max(start, 0), len(self.submissions) - 1)
+        try:
+            while True:
+                self.show(index)
+                choice = questionary.select(
+                    "What do you want to do?",
+                    choices=["Next", "Previous", "Open in Digital", "Jump to submission", "Quit"]
+                ).ask()
+
+                if choice == "Next":
+                    index = min(index + 1, len(self.submissions) - 1)
+                elif choice == "Previous":
+                    index = max(index - 1, 0)
+                elif choice == "Open in Digital":
+                    for top_level in self.top_level:
+                        schematic = self._find_schematic(self.submissions[index], top_level)
+                        if schematic is not None:
+                            self.digital.launch(schematic)
+                elif choice == "Jump to submission":
+                    ids = [submission.submission_id for submission in self.submissions]
+                    submission_id = questionary.autocomplete("Submission ID:", choices=ids).ask()
+                    if submission_id in ids:
+                        index = ids.index(submission_id)
+                else:
+                    break
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self._svg_dir, ignore_errors=True)
 
-    def menu(self) -> None:
-        questionary.select("What do you want to do?", choices=["Grade", "Test"]).ask()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Manually review submissions and adjust grades if necessary")
@@ -54,9 +238,24 @@ if __name__ == '__main__':
         type=Path,
         help="Path to the digital jar file in case you want to overwrite it"
     )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=3,
+        help="Number of upcoming submissions to prepare in the background"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="Number of background workers preparing submissions"
+    )
 
     args = parser.parse_args()
 
-    grader = ManualGrader(args.config_file, args.submissions_dir, args.digital_jar_file)
+    setup_logger()
+
+    grader = ManualGrader(args.config_file, args.submissions_dir, args.digital_jar_file, prefetch=args.prefetch,
+                          workers=args.workers)
 
-    # grader.menu()
\ No newline at end of file
+    grader.review()
@@ -3,8 +3,6 @@ from enum import StrEnum
 from typing import List
 from json import dumps
 
-from minify_html import minify
-
 
 class TestStatus(StrEnum):
     PASSED = "passed"
@@ -67,6 +65,7 @@ class TestResult:
         if self.output:
             result["output_format"] = self.output_format
             if self.output_format == TextFormat.HTML or self.output_format == TextFormat.SIMPLE_FORMAT:
+                from minify_html import minify
                 result["output"] = minify(self.output)
             else:
                 result["output"] = self.output
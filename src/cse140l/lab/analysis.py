@@ -0,0 +1,96 @@
+import os
+from pathlib import Path
+from collections import defaultdict
+from typing import List, Dict, Iterable
+from concurrent.futures import ThreadPoolExecutor
+
+from cse140l.digital.stats import CircuitStats, GateIndex
+from cse140l.lab.config import AnalyzeConfig, GateConfig
+from cse140l.log import log
+
+
+def describe_gates(gate: GateConfig, gate_count: int) -> str:
+    """Formats a gate count the way it is shown to students."""
+    if gate.inputs:
+        return f"{gate_count}x {gate.inputs}-input {gate.bit_width}-wide {gate.name.upper()} gates"
+    return f"{gate_count}x {gate.bit_width} wide {gate.name.upper()} gates"
+
+
+class CircuitAnalyzer:
+    """
+    Checks the gate budgets of a submission. Stats for every referenced top level are collected once,
+    concurrently, and indexed so that all [[analyze]] rules can be evaluated in a single pass.
+    """
+
+    def __init__(self, stats: CircuitStats, submission_dir: Path, max_workers: int | None = None):
+        self.stats = stats
+        self.submission_dir = submission_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._indexes: Dict[str, GateIndex] = {}
+
+    def get_schematic_path(self, top_level: str) -> Path:
+        return Path(self.submission_dir, f"{top_level}.dig")
+
+    def collect(self, top_levels: Iterable[str]) -> Dict[str, GateIndex]:
+        """Collects stats for the given top levels that exist and have not been collected yet."""
+        missing = sorted({
+            top_level for top_level in top_levels
+            if top_level not in self._indexes and self.get_schematic_path(top_level).exists()
+        })
+
+        if missing:
+            log.debug(f"Collecting gate stats for {', '.join(missing)}")
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                stats = executor.map(lambda t: self.stats.get_stats(self.get_schematic_path(t)), missing)
+                for top_level, gate_list in zip(missing, stats):
+                    self._indexes[top_level] = GateIndex(gate_list)
+
+        return self._indexes
+
+    def analyze(self, rules: List[AnalyzeConfig]) -> Dict[str, List[str]]:
+        """Evaluates every rule and returns the failures found for each top level."""
+        indexes = self.collect(top_level for rule in rules for top_level in rule.top_levels)
+        analysis_failures: Dict[str, List[str]] = defaultdict(list)
+
+        for rule in rules:
+            present: List[str] = []
+            for top_level in rule.top_levels:
+                if top_level in indexes:
+                    present.append(top_level)
+                else:
+                    analysis_failures[top_level].append(f"{top_level} not found!")
+
+            if rule.aggregate:
+                self._check_aggregate(rule, present, indexes, analysis_failures)
+                continue
+
+            for top_level in present:
+                for gate in rule.gates:
+                    gate_count = indexes[top_level].count(gate)
+                    if gate.max_amount is not None and gate.max_amount < gate_count:
+                        analysis_failures[top_level].append(f"Circuit has {describe_gates(gate, gate_count)} (Maximum of {gate.max_amount} allowed for this lab)")
+
+                    if gate.min_amount is not None and gate.min_amount > gate_count:
+                        analysis_failures[top_level].append(f"Circuit has {describe_gates(gate, gate_count)} (Minimum of {gate.min_amount} allowed for this lab)")
+
+        return analysis_failures
+
+    @staticmethod
+    def _check_aggregate(rule: AnalyzeConfig, present: List[str], indexes: Dict[str, GateIndex],
+                         analysis_failures: Dict[str, List[str]]) -> None:
+        """Checks gate limits against the total over a group of top levels, reporting failures on each of them."""
+        if not present:
+            return
+
+        group = ", ".join(present)
+        for gate in rule.gates:
+            gate_count = sum(indexes[top_level].count(gate) for top_level in present)
+            failures: List[str] = []
+            if gate.max_amount is not None and gate.max_amount < gate_count:
+                failures.append(f"Circuits {group} have {describe_gates(gate, gate_count)} in total (Maximum of {gate.max_amount} allowed across these circuits for this lab)")
+
+            if gate.min_amount is not None and gate.min_amount > gate_count:
+                failures.append(f"Circuits {group} have {describe_gates(gate, gate_count)} in total (Minimum of {gate.min_amount} allowed across these circuits for this lab)")
+
+            for top_level in present:
+                analysis_failures[top_level].extend(failures)
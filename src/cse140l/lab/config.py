@@ -1,12 +1,17 @@
+import os
+import re
+import json
+import hashlib
 import logging
 from pathlib import Path
 from typing import List
 
-import toml
-from pydantic import BaseModel, PositiveFloat, field_validator, PositiveInt, NonNegativeInt, model_validator
+from pydantic import (BaseModel, PositiveFloat, field_validator, PositiveInt, NonNegativeInt, model_validator,
+                      ValidationError)
 
 from cse140l.gradescope.test_result import Visibility
 from cse140l.log import log
+from cse140l.cache import get_cache_dir
 
 class GateConfig(BaseModel):
     name: str
@@ -18,6 +23,8 @@ class GateConfig(BaseModel):
 class AnalyzeConfig(BaseModel):
     top_levels: List[str]
     gates: List[GateConfig]
+    # When set, gate limits apply to the total across all top levels instead of to each one
+    aggregate: bool = False
 
 class TestConfig(BaseModel):
     name: str
@@ -26,6 +33,26 @@ class TestConfig(BaseModel):
     top_level: str
     visibility_on_success: str | Visibility
     visibility_on_failure: str | Visibility
+    # Number of concurrent Digital processes the testbench's test cases are split across
+    shards: PositiveInt = 1
+    # Check the circuit's ports against the testbench before starting Digital. Test cases that use a missing
+    # port fail with an explanation, the others are still run and scored as usual.
+    preflight: bool = True
+    # Output bounds for Digital, None uses the defaults in cse140l.digital.util
+    max_output_bytes: PositiveInt | None = None
+    max_failed_vectors: PositiveInt | None = None
+    # Per Digital process limits, None uses the defaults in cse140l.digital.util
+    timeout: PositiveFloat | None = None
+    cpu_time_limit: PositiveInt | None = None
+    memory_limit_mb: PositiveInt | None = None
+    java_heap: str | None = None
+
+    @field_validator("java_heap")
+    @classmethod
+    def validate_java_heap(cls, value: str | None):
+        if value is not None and not re.fullmatch(r"\d+[kKmMgG]?", value):
+            raise ValueError(f"Invalid java_heap size: {value} (expected something like '512m')")
+        return value
 
     @field_validator("visibility_on_success", "visibility_on_failure")
     @classmethod
@@ -41,6 +68,10 @@ class LabConfig(BaseModel):
     submission_directory: Path | None
     tests: List[TestConfig]
     analyze: List[AnalyzeConfig] | None = None
+    max_workers: PositiveInt | None = None
+    # Testbenches run at the same time. Each one starts `shards` Digital processes, so up to
+    # test_workers * shards JVMs can run at once. Raise it only on machines with cores and memory to spare.
+    test_workers: PositiveInt = 1
 
     @field_validator("submission_directory")
     @classmethod
@@ -55,16 +86,90 @@ class LabConfig(BaseModel):
             if not test.test_file.exists():
                 # Critical, TA staff forgot to submit a file
                 raise ValueError(f"Test file does not exist: {test.test_file}")
-
-            top_level = Path(self.submission_directory, f"{test.top_level}.dig")
-            if not top_level.exists():
-                # Non-critical, student chose not to submit to the file, but we need to grade the other parts.
-                log.error(f"Top level does not exist: {top_level}")
-                continue
+        _log_missing_top_levels(self)
         return self
 
-def get_config_from_toml(config_file: Path, submission_dir: Path = None, gradescope_mode: bool = False) -> LabConfig:
-    raw_config = toml.load(config_file)
+
+def _log_missing_top_levels(config: LabConfig) -> None:
+    for test in config.tests:
+        top_level = Path(config.submission_directory, f"{test.top_level}.dig")
+        if not top_level.exists():
+            # Non-critical, student chose not to submit to the file, but we need to grade the other parts.
+            log.error(f"Top level does not exist: {top_level}")
+
+
+def _get_schema_hash() -> str:
+    """Hashes the config models' JSON schema, so changing a field or default invalidates every snapshot."""
+    schema = json.dumps(LabConfig.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+def _get_snapshot_path(raw_config: bytes, submission_dir: Path | None, gradescope_mode: bool) -> Path | None:
+    """
+    Returns where the validated snapshot of a config would be stored. The key covers the TOML contents, the
+    config models' schema, every override applied on top of it and the working directory relative paths resolve
+    against.
+    """
+    snapshot_dir = get_cache_dir("config")
+    if snapshot_dir is None:
+        return None
+
+    key = hashlib.sha256(raw_config)
+    key.update(repr((_get_schema_hash(), str(submission_dir), gradescope_mode, os.getcwd())).encode("utf-8"))
+    return Path(snapshot_dir, f"{key.hexdigest()}.json")
+
+
+def _load_snapshot(snapshot_path: Path) -> LabConfig | None:
+    """
+    Loads a previously validated config, returning None if it is missing, unreadable or no longer valid.
+    The snapshot is plain JSON validated like any config, so it can run no code, and the checks against the
+    filesystem are repeated in case a test file or the submission directory was deleted after it was taken.
+    """
+    try:
+        raw_snapshot = snapshot_path.read_bytes()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        log.debug(f"Ignoring unreadable config snapshot {snapshot_path}: {e}")
+        return None
+
+    try:
+        return LabConfig.model_validate_json(raw_snapshot)
+    except ValidationError as e:
+        log.debug(f"Ignoring invalid config snapshot {snapshot_path}: {e}")
+        return None
+
+
+def _store_snapshot(snapshot_path: Path, config: LabConfig) -> None:
+    """Atomically writes a validated config snapshot so concurrent runs never read a partial file."""
+    tmp_path = snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        tmp_path.write_text(config.model_dump_json(), encoding="utf-8")
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        log.debug(f"Could not write config snapshot {snapshot_path}: {e}")
+
+
+def get_config_from_toml(config_file: Path, submission_dir: Path = None, gradescope_mode: bool = False,
+                         use_snapshot: bool = True) -> LabConfig:
+    """
+    Loads and validates a lab config. When use_snapshot is set, a config that was already validated
+    with identical contents and overrides is loaded from the local cache instead of being re-validated.
+    """
+    with open(config_file, "rb") as f:
+        raw_bytes = f.read()
+
+    snapshot_path = _get_snapshot_path(raw_bytes, submission_dir, gradescope_mode) if use_snapshot else None
+    if snapshot_path is not None:
+        config = _load_snapshot(snapshot_path)
+        # Otherwise full validation below reports what is missing, exactly like without a snapshot
+        if config is not None:
+            log.debug(f"Loaded validated config snapshot {snapshot_path}")
+            return config
+
+    import toml
+
+    raw_config = toml.loads(raw_bytes.decode("utf-8"))
 
     if gradescope_mode:
         raw_config["digital_jar"] = Path("/usr/local/bin/Digital.jar")
@@ -73,4 +178,9 @@ def get_config_from_toml(config_file: Path, submission_dir: Path = None, gradesc
     if submission_dir is not None:
         raw_config["submission_directory"] = submission_dir
 
-    return LabConfig(**raw_config)
\ No newline at end of file
+    config = LabConfig(**raw_config)
+
+    if snapshot_path is not None:
+        _store_snapshot(snapshot_path, config)
+
+    return config
@@ -0,0 +1,469 @@
+import argparse
+import hmac
+import itertools
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from cse140l.digital.wrapper import Digital
+from cse140l.lab.config import get_config_from_toml, LabConfig
+from cse140l.lab.durations import DurationStore, duration_key, predict_makespan
+from cse140l.lab.runner import LabRunner
+from cse140l.log import log, setup_logger
+
+DEFAULT_PORT = 1408
+# Finished jobs kept around for their results to be fetched
+DEFAULT_MAX_FINISHED_JOBS = 1000
+
+
+@dataclass
+class GradingJob:
+    """A submission to grade against one of the daemon's labs."""
+    job_id: str
+    lab: str
+    submission: Path
+    student_id: str | None = None
+    json_files: List[Path] = field(default_factory=list)
+    # Also write the results.json here, like the CLI does
+    output_file: Path | None = None
+    # Jobs with a higher priority run first, among equal ones the longest expected run goes first
+    priority: int = 0
+    predicted_seconds: float | None = None
+
+    status: str = "queued"
+    result: Dict | None = None
+    error: str | None = None
+    queued_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.job_id,
+            "lab": self.lab,
+            "submission": str(self.submission),
+            "student_id": self.student_id,
+            "status": self.status,
+            "priority": self.priority,
+            "predicted_seconds": self.predicted_seconds,
+            "result": self.result,
+            "error": self.error,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def load_lab_config(config_file: Path, use_snapshot: bool = True) -> LabConfig:
+    """
+    Loads a lab config once for the lifetime of the daemon. Paths in it are relative to the config file, which the
+    CLI handles by changing into its directory. Jobs run side by side in one process, so they are resolved here.
+    """
+    config_file = config_file.absolute()
+    cwd = os.getcwd()
+    os.chdir(config_file.parent)
+    try:
+        try:
+            config = get_config_from_toml(config_file, use_snapshot=use_snapshot)
+        except ValidationError:
+            # Every job brings its own submission directory, the one in the config may not exist on this machine
+            config = get_config_from_toml(config_file, submission_dir=config_file.parent, use_snapshot=use_snapshot)
+        return config.model_copy(update={
+            "digital_jar": config.digital_jar.absolute(),
+            "tests": [test.model_copy(update={"test_file": test.test_file.absolute()}) for test in config.tests],
+        })
+    finally:
+        os.chdir(cwd)
+
+
+class GradingDaemon:
+    """
+    Keeps lab configs and their Digital instances loaded and grades submissions on a fixed pool of worker threads.
+    Jobs wait in a bounded queue, so a burst of submissions is rejected instead of piling up without limit.
+    Queued jobs are started longest first, by the test durations of earlier runs, so a large regrade is not held
+    up by one slow lab that happened to be queued last. Every path a job reads or writes must lie under root.
+    """
+
+    def __init__(self, configs: Dict[str, LabConfig], workers: int = 2, max_queue: int = 1000,
+                 report_server_url: str = None, auth_token: str = None, publish_progress: bool = True,
+                 max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS, test_workers: int = None, root: Path = None):
+        self.configs = configs
+        self.root = Path(os.path.realpath(root if root is not None else os.getcwd()))
+        self.test_workers = test_workers
+        self.durations = DurationStore()
+        self.report_server_url = report_server_url
+        self.auth_token = auth_token
+        self.publish_progress = publish_progress
+        self.max_finished_jobs = max_finished_jobs
+
+        # One Digital instance per jar, shared by every job that uses it
+        digitals: Dict[Path, Digital] = {}
+        self.digital: Dict[str, Digital] = {}
+        for name, config in configs.items():
+            if config.digital_jar not in digitals:
+                digitals[config.digital_jar] = Digital(config.digital_jar)
+            self.digital[name] = digitals[config.digital_jar]
+
+        self._queue: queue.PriorityQueue[Tuple[int, float, int, GradingJob]] = queue.PriorityQueue(maxsize=max_queue)
+        self._sequence = itertools.count()
+        self._jobs: OrderedDict[str, GradingJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"grader-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def warm_up(self) -> None:
+        """Creates the class data sharing archives of every jar, so the first jobs already start Digital fast."""
+        for digital in {id(digital): digital for digital in self.digital.values()}.values():
+            digital.warm_up()
+
+    def predict(self, lab: str) -> float:
+        """Expected run time of a job of a lab, from the durations of its tests in earlier runs."""
+        tests = self.configs[lab].tests
+        predictions = self.durations.predict_all([duration_key(test.test_file, test.top_level) for test in tests])
+        return predict_makespan(sorted(predictions, reverse=True), self.test_workers or self.configs[lab].test_workers)
+
+    def _resolve(self, path: Path, what: str) -> Path:
+        """Resolves a path from a request, raising ValueError if it points outside of root (symlinks included)."""
+        resolved = Path(os.path.realpath(path))
+        if not resolved.is_relative_to(self.root):
+            raise ValueError(f"The {what} {path} is outside of {self.root}")
+        return resolved
+
+    def submit(self, lab: str | None, submission: Path, student_id: str = None, json_files: List[Path] = None,
+               output_file: Path = None, priority: int = 0) -> GradingJob:
+        """Queues a job. Raises KeyError for an unknown lab, ValueError for a bad submission, queue.Full if busy."""
+        if lab is None:
+            if len(self.configs) != 1:
+                raise KeyError(f"A lab is required, this daemon grades {', '.join(sorted(self.configs))}")
+            lab = next(iter(self.configs))
+        if lab not in self.configs:
+            raise KeyError(f"Unknown lab {lab}, this daemon grades {', '.join(sorted(self.configs))}")
+        submission = self._resolve(submission, "submission directory")
+        if not submission.is_dir():
+            raise ValueError(f"Submission directory does not exist: {submission}")
+        json_files = [self._resolve(path, "results file") for path in json_files or []]
+        if output_file is not None:
+            output_file = self._resolve(output_file, "output file")
+
+        job = GradingJob(uuid.uuid4().hex, lab, submission, student_id, json_files, output_file, priority,
+                         self.predict(lab))
+        with self._lock:
+            self._queue.put_nowait((-priority, -job.predicted_seconds, next(self._sequence), job))
+            self._jobs[job.job_id] = job
+            self._forget_finished()
+        log.info(f"Queued job {job.job_id}: {lab} for {submission} (predicted {job.predicted_seconds:.2f}s)")
+        return job
+
+    def get(self, job_id: str) -> GradingJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "labs": sorted(self.configs),
+            "workers": len(self._workers),
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "done": statuses.count("done"),
+            "failed": statuses.count("failed"),
+        }
+
+    def _forget_finished(self) -> None:
+        """Drops the oldest finished jobs beyond the retention limit. Called with the lock held."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            *_, job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = self._grade(job)
+                job.status = "done"
+            except Exception as e:
+                log.exception(f"Job {job.job_id} failed")
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            job.finished_at = time.time()
+            job.done.set()
+            self._queue.task_done()
+            log.info(f"Job {job.job_id} {job.status} in {job.finished_at - job.started_at:.2f}s "
+                     f"(predicted {job.predicted_seconds:.2f}s, waited {job.started_at - job.queued_at:.2f}s)")
+
+    def _grade(self, job: GradingJob) -> Dict:
+        """Grades a submission the way the CLI does and returns the content of its results.json."""
+        config = self.configs[job.lab].model_copy(update={"submission_directory": job.submission})
+        runner = LabRunner(
+            None,
+            existing_tests=job.json_files,
+            report_server_url=self.report_server_url,
+            student_id=job.student_id,
+            auth_token=self.auth_token,
+            publish_progress=self.publish_progress,
+            config=config,
+            digital=self.digital[job.lab],
+            durations=self.durations,
+            test_workers=self.test_workers,
+        )
+        try:
+            runner.run_tests()
+            if self.report_server_url and job.student_id:
+                runner.post_report(self.report_server_url, job.student_id, self.auth_token)
+        finally:
+            runner.close()
+        runner.finalize_results()
+
+        results = str(runner.autograder_writer)
+        if job.output_file is not None:
+            job.output_file.write_text(results)
+        return json.loads(results)
+
+
+class GradingRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the daemon:
+    GET /health, POST /jobs ({"lab", "submission", "student_id", "json_files", "output_file", "priority", "wait"}),
+    GET /jobs/<id> (the job and its results) and GET /jobs/<id>/results (only the results.json content).
+    With an api_token, every request needs it as a bearer token.
+    """
+    daemon: GradingDaemon = None
+    api_token: str | None = None
+
+    def _send_json(self, status: HTTPStatus, body: Dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        self._send_json(status, {"status": "error", "message": message})
+
+    def log_message(self, format: str, *args) -> None:
+        # Unix socket clients have no address, which the default implementation expects
+        log.debug(f"{self.command} {self.path}: {format % args}")
+
+    def _authorized(self) -> bool:
+        """Sends an error and returns False unless the request carries the API token (if there is one)."""
+        if self.api_token is None:
+            return True
+        auth_header = self.headers.get("Authorization") or ""
+        if not auth_header.startswith("Bearer "):
+            self._send_error(HTTPStatus.UNAUTHORIZED, "Authorization header is missing or invalid.")
+            return False
+        if not hmac.compare_digest(auth_header[len("Bearer "):].encode("utf-8"), self.api_token.encode("utf-8")):
+            log.warning(f"Invalid API token for {self.command} {self.path}")
+            self._send_error(HTTPStatus.FORBIDDEN, "Invalid authorization token.")
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        if not self._authorized():
+            return
+        parts = self.path.strip("/").split("/")
+        if parts == ["health"]:
+            self._send_json(HTTPStatus.OK, {"status": "ok", **self.daemon.stats()})
+            return
+        if len(parts) in (2, 3) and parts[0] == "jobs" and parts[2:] in ([], ["results"]):
+            job = self.daemon.get(parts[1])
+            if job is None:
+                self._send_error(HTTPStatus.NOT_FOUND, f"No job {parts[1]}.")
+            elif len(parts) == 2:
+                self._send_json(HTTPStatus.OK, job.to_dict())
+            elif job.status == "done":
+                self._send_json(HTTPStatus.OK, job.result)
+            elif job.status == "failed":
+                self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, job.error)
+            else:
+                self._send_json(HTTPStatus.ACCEPTED, {"id": job.job_id, "status": job.status})
+            return
+        self._send_error(HTTPStatus.NOT_FOUND, f"Unknown path {self.path}.")
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+        if self.path.strip("/") != "jobs":
+            self._send_error(HTTPStatus.NOT_FOUND, f"Unknown path {self.path}.")
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if not isinstance(body, dict) or "submission" not in body:
+                raise ValueError("A job needs a \"submission\" directory.")
+            job = self.daemon.submit(
+                body.get("lab"),
+                Path(body["submission"]),
+                student_id=body.get("student_id"),
+                json_files=[Path(path) for path in body.get("json_files") or []],
+                output_file=Path(body["output_file"]) if body.get("output_file") else None,
+                priority=int(body.get("priority") or 0),
+            )
+        except KeyError as e:
+            self._send_error(HTTPStatus.NOT_FOUND, str(e.args[0]))
+            return
+        except (ValueError, TypeError) as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        except queue.Full:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, "The job queue is full, try again later.")
+            return
+
+        if body.get("wait"):
+            job.done.wait()
+            self._send_json(HTTPStatus.OK, job.to_dict())
+        else:
+            self._send_json(HTTPStatus.ACCEPTED, {"id": job.job_id, "status": job.status, "url": f"/jobs/{job.job_id}"})
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _parse_config_argument(value: str) -> Tuple[str | None, Path]:
+    name, separator, path = value.partition("=")
+    return (name, Path(path)) if separator else (None, Path(value))
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="cse140l serve",
+        description="Keep lab configs loaded and grade submissions pushed to a local HTTP or Unix socket API"
+    )
+    parser.add_argument(
+        "configs",
+        nargs="+",
+        help="Lab config files, optionally named as NAME=PATH (the default name is lab<lab_number>)."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        help="Listen on this Unix socket instead of a TCP port, only its owner can connect."
+    )
+    parser.add_argument(
+        "--api-token",
+        type=str,
+        default=os.environ.get("CSE140L_DAEMON_TOKEN"),
+        help="Bearer token every request must carry, required when listening on a TCP port."
+    )
+    parser.add_argument(
+        "--root",
+        type=Path,
+        default=Path.cwd(),
+        help="Submissions, results files and output files of jobs must be under this directory."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Submissions graded at the same time."
+    )
+    parser.add_argument(
+        "--test-workers",
+        type=int,
+        default=None,
+        help="Testbenches of one submission run at the same time, overriding each lab's test_workers "
+             "(the daemon already grades --workers at once)."
+    )
+    parser.add_argument("--max-queue", type=int, default=1000, help="Jobs that may wait before new ones are rejected.")
+    parser.add_argument("--warm-up", action="store_true", help="Create class data sharing archives at startup.")
+    parser.add_argument(
+        "--report-server-url",
+        type=str,
+        default=os.environ.get("REPORT_SERVER_URL"),
+        help="URL of the report server, reports are posted for jobs with a student_id."
+    )
+    parser.add_argument(
+        "--auth-token",
+        type=str,
+        default=os.environ.get("REPORT_SERVER_AUTH_TOKEN"),
+        help="Authentication token for the report server."
+    )
+    parser.add_argument(
+        "--no-progress-report",
+        action="store_true",
+        help="Only update web reports once all tests of a job have finished."
+    )
+    parser.add_argument("--log_file", type=str, default=None, help="Optional path to a file to write log output.")
+    parser.add_argument("--debug", action="store_true", help="Enable debug mode.")
+
+    args = parser.parse_args(argv)
+    if args.socket is None and not args.api_token:
+        # Any local user (or any host, with --host) could otherwise read and write files as the daemon's user
+        parser.error("Listening on a TCP port needs an --api-token (or CSE140L_DAEMON_TOKEN)")
+
+    setup_logger(log_file=args.log_file, level=logging.INFO if not args.debug else logging.DEBUG)
+
+    configs: Dict[str, LabConfig] = {}
+    for value in args.configs:
+        name, config_file = _parse_config_argument(value)
+        config = load_lab_config(config_file)
+        name = name or f"lab{config.lab_number}"
+        if name in configs:
+            parser.error(f"Two configs are named {name}, name them explicitly with NAME=PATH")
+        configs[name] = config
+        log.info(f"Loaded {name} from {config_file} ({len(config.tests)} tests)")
+
+    daemon = GradingDaemon(
+        configs,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        report_server_url=args.report_server_url,
+        auth_token=args.auth_token,
+        publish_progress=not args.no_progress_report,
+        test_workers=args.test_workers,
+        root=args.root,
+    )
+    if args.warm_up:
+        daemon.warm_up()
+
+    handler = type("Handler", (GradingRequestHandler,), {"daemon": daemon, "api_token": args.api_token or None})
+    if args.socket is not None:
+        args.socket.unlink(missing_ok=True)
+        # The socket is created with owner only permissions, so no other user can connect before a chmod
+        umask = os.umask(0o177)
+        try:
+            server = UnixHTTPServer(str(args.socket), handler)
+        finally:
+            os.umask(umask)
+        log.info(f"Grading daemon listening on {args.socket} with {args.workers} workers")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        log.info(f"Grading daemon listening on http://{args.host}:{args.port} with {args.workers} workers")
+    log.info(f"Jobs may only use paths under {daemon.root}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Shutting down")
+    finally:
+        server.server_close()
+        if args.socket is not None:
+            args.socket.unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import heapq
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, TypeVar
+
+from cse140l.cache import get_cache_dir
+from cse140l.log import log
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, concurrent saves there can still drop each other's entries
+    fcntl = None
+
+T = TypeVar("T")
+
+# Weight of the newest run in a job's running average, the rest is its history
+SMOOTHING = 0.3
+# Prediction for a job that has never run, when nothing else is known either
+DEFAULT_DURATION = 5.
+
+
+def duration_key(test_file: Path, top_level: str) -> str:
+    """Durations are kept per testbench and circuit, every submission of a lab shares them."""
+    return f"{Path(test_file).absolute()}::{top_level}"
+
+
+def predict_makespan(durations: Iterable[float], workers: int) -> float:
+    """
+    Time until the last job finishes when jobs are handed to `workers` workers in the given order,
+    each one to the worker that frees up first.
+    """
+    finish_times = [0.] * max(1, workers)
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+
+class DurationStore:
+    """
+    A small local store of how long jobs took in earlier runs, as an exponentially weighted average per key.
+    It lives in the autograder cache, so it is shared by every run on the machine. Safe to use from several
+    threads and processes: `save` merges with what other processes wrote in the meantime, under a file lock.
+    """
+
+    def __init__(self, path: Path = None):
+        if path is None:
+            cache_dir = get_cache_dir("durations")
+            path = Path(cache_dir, "durations.json") if cache_dir is not None else None
+        self.path = path
+        self._lock = threading.Lock()
+        self._durations: Dict[str, Dict[str, float]] = self._read()
+        self._updated: set[str] = set()
+
+    def _read(self) -> Dict[str, Dict[str, float]]:
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                log.debug(f"Ignoring unreadable duration store {self.path}: {e}")
+            return {}
+
+    def predict(self, key: str) -> float | None:
+        """Expected duration of a job in seconds, None if it never ran."""
+        with self._lock:
+            entry = self._durations.get(key)
+            return entry["seconds"] if entry else None
+
+    def predict_all(self, keys: Sequence[str]) -> List[float]:
+        """
+        Expected durations of several jobs. Jobs that never ran are assumed to take as long as the average of
+        the ones that did, so they are neither scheduled first nor last.
+        """
+        known = [self.predict(key) for key in keys]
+        seen = [seconds for seconds in known if seconds is not None]
+        fallback = sum(seen) / len(seen) if seen else DEFAULT_DURATION
+        return [seconds if seconds is not None else fallback for seconds in known]
+
+    def has_history(self, keys: Iterable[str]) -> bool:
+        with self._lock:
+            return any(key in self._durations for key in keys)
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._durations.get(key)
+            if entry is None:
+                self._durations[key] = {"seconds": seconds, "runs": 1}
+            else:
+                entry["seconds"] = SMOOTHING * seconds + (1 - SMOOTHING) * entry["seconds"]
+                entry["runs"] += 1
+            self._updated.add(key)
+
+    def save(self) -> None:
+        """Writes the durations recorded since the last save, keeping entries other processes added."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._updated:
+                return
+            try:
+                lock = open(self.path.with_suffix(".lock"), "w")
+            except OSError as e:
+                log.debug(f"Could not lock duration store {self.path}: {e}")
+                return
+            # Another process saving between the read and the replace would lose its entries
+            with lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                merged = {**self._read(), **{key: self._durations[key] for key in self._updated}}
+                tmp_path = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                try:
+                    with open(tmp_path, "w") as f:
+                        json.dump(merged, f)
+                    os.replace(tmp_path, self.path)
+                except OSError as e:
+                    log.debug(f"Could not write duration store {self.path}: {e}")
+                    return
+            self._durations.update(merged)
+            self._updated.clear()
+
+    def longest_first(self, jobs: Sequence[T], keys: Sequence[str]) -> List[Tuple[T, float]]:
+        """Orders jobs by their expected duration, longest first, paired with that duration."""
+        return sorted(zip(jobs, self.predict_all(keys)), key=lambda pair: -pair[1])
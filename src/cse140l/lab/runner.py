@@ -3,46 +3,73 @@ import os
 from collections import defaultdict
 from pathlib import Path
 import argparse
-from typing import List, Dict, Tuple
-import base64
-
-import requests
+from typing import List, Dict, Tuple, TYPE_CHECKING
+import gzip
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from cse140l.digital.stats import GateStat, get_gate_count
-from cse140l.digital.tests import TestOutput
-from cse140l.digital.wrapper import Digital
 from cse140l.gradescope.autograder_writer import AutograderWriter
 from cse140l.gradescope.test_result import TestResult, TestStatus, TextFormat
-from cse140l.lab.config import get_config_from_toml, LabConfig
+from cse140l.lab.durations import DurationStore, duration_key, predict_makespan
+from cse140l.lab.publisher import ReportPublisher
 from cse140l.log import log, setup_logger
 
+# Digital and the config models (pydantic) are imported where they are first needed, so importing this module
+# (and `cse140l --help`) stays cheap. tests/test_import_time.py keeps it that way.
+if TYPE_CHECKING:
+    from cse140l.digital.tests import TestOutput
+    from cse140l.digital.wrapper import Digital
+    from cse140l.lab.config import LabConfig, TestConfig
 
-
+# Version of the report format posted to the report server.
+# 2: failed step tables are sent as signal names plus one list of values per signal
+REPORT_SCHEMA_VERSION = 2
 
 
 class LabRunner:
-    def __init__(self, config_file: Path, gradescope_mode: bool = False, existing_tests: List[Path] = None, report_server_url: str = None, student_id: str = None):
-        self.config: LabConfig = get_config_from_toml(config_file, gradescope_mode=gradescope_mode)
+    def __init__(self, config_file: Path | None, gradescope_mode: bool = False, existing_tests: List[Path] = None, report_server_url: str = None, student_id: str = None, use_config_snapshot: bool = True, auth_token: str = None, publish_progress: bool = True, config: "LabConfig" = None, digital: "Digital" = None, durations: DurationStore = None, test_workers: int = None):
+        # A long running process (see cse140l.lab.daemon) passes an already loaded config and its Digital instance
+        if config is None:
+            from cse140l.lab.config import get_config_from_toml
+            config = get_config_from_toml(config_file, gradescope_mode=gradescope_mode, use_snapshot=use_config_snapshot)
+        self.config: "LabConfig" = config
         self.submission_dir = self.config.submission_directory
         self.top_level = sorted(set(test.top_level for test in self.config.tests))
         self.autograder_writer = AutograderWriter(existing_tests=existing_tests)
-        self.digital = Digital(self.config.digital_jar)
+        if digital is None:
+            from cse140l.digital.wrapper import Digital
+            digital = Digital(self.config.digital_jar)
+        self.digital = digital
+        # Testbenches run side by side only when the config or the caller asks for it, each one may start
+        # several Digital processes itself (see shards)
+        self.test_workers = test_workers or self.config.test_workers
+        self.durations = durations if durations is not None else DurationStore()
         self.report_server_url = report_server_url
         self.student_id = student_id
         self.report_uuid = None
+        self.auth_token = auth_token or os.environ.get("REPORT_SERVER_AUTH_TOKEN")
         self._init_report()
         self.all_failed_tests = []
         self.circuit_info = []
         self.missing_files = []
         self.test_errors = defaultdict(list)
 
+        # Finished tests are published to the report while the others still run
+        self.publisher: ReportPublisher | None = None
+        self._progress_missing_files: List[str] = []
+        if publish_progress and self.report_uuid and self.auth_token:
+            self.publisher = ReportPublisher(self.report_server_url, self.report_uuid, self.auth_token)
+
     def _init_report(self):
         """Initializes a report on the server to get a UUID."""
-        token = os.environ.get("REPORT_SERVER_AUTH_TOKEN")
+        token = self.auth_token
         if not self.report_server_url or not self.student_id or not token:
             return
 
+        # Only runs that talk to the report server pay for importing requests
+        import requests
+
         endpoint = f"{self.report_server_url.rstrip('/')}/report/{self.config.lab_number}/{self.student_id}"
         headers = {
             "Authorization": f"Bearer {token}",
@@ -50,8 +77,8 @@ class LabRunner:
         }
 
         try:
-            # Post empty data to create the report entry and get a UUID
-            response = requests.post(endpoint, headers=headers, data=json.dumps({}))
+            # Creates the report entry to get a UUID, an existing report keeps its last complete results
+            response = requests.post(endpoint, headers=headers, data=json.dumps({"init": True}))
             response.raise_for_status()
             response_json = response.json()
             self.report_uuid = response_json.get("uuid")
@@ -60,19 +87,71 @@ class LabRunner:
         except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
             log.warning(f"Could not initialize report on server to get UUID: {e}")
 
-    def _test_output_to_dict(self, test_output: TestOutput) -> Dict:
-        """Converts a TestOutput object to a serializable dictionary."""
-        return {
+    def _test_output_to_dict(self, test_output: "TestOutput") -> Dict:
+        """
+        Converts a TestOutput object to a serializable dictionary. The steps table is stored column wise,
+        so signal names are sent once instead of once per row. The raw output is only kept for errors,
+        where there is no table to show.
+        """
+        rows = [step for step in test_output.steps if step]
+        step_dict = {
             "name": test_output.name,
             "outcome": test_output.outcome,
-            "output": test_output.output,
             "error": test_output.error,
             "signals": test_output.signals,
-            "steps": test_output.steps,
+            "columns": [[row.get(signal, "") for row in rows] for signal in test_output.signals],
         }
+        if test_output.error or test_output.diagnostic:
+            step_dict["output"] = test_output.output
+        return step_dict
+
+    def _failed_test_to_dict(self, failed_test: Dict) -> Dict:
+        return {
+            "test_name": failed_test["test_name"],
+            "failed_steps": [self._test_output_to_dict(step) for step in failed_test["failed_steps"]]
+        }
+
+    def _publish_progress(self, completed_tests: int, failed_test: Dict = None) -> None:
+        """
+        Publishes how many tests have finished, and the failures of the one that just did (if any). Partial results
+        live next to the last complete report, which stays intact until the final report replaces both.
+        """
+        if self.publisher is None:
+            return
+
+        if completed_tests == 0:
+            self._progress_missing_files = [
+                top_level for top_level in self.top_level if not self.get_schematic_path(top_level).exists()
+            ]
+        patch: Dict = {"set": {"progress": {
+            "in_progress": True,
+            "schema_version": REPORT_SCHEMA_VERSION,
+            "completed_tests": completed_tests,
+            "total_tests": len(self.config.tests),
+            "missing_files": self._progress_missing_files,
+        }}}
+        if completed_tests == 0:
+            # Starts over, so failures of an earlier run are not mixed in
+            patch["set"]["progress_failed_tests"] = []
+        if failed_test is not None:
+            patch["append"] = {"progress_failed_tests": [self._failed_test_to_dict(failed_test)]}
+        self.publisher.publish(patch)
+
+    def close(self) -> None:
+        """
+        Stops publishing progress. If the final report was never posted, because grading crashed or was interrupted,
+        the report is marked as failed so it does not claim to be in progress (and keep reloading) forever.
+        """
+        if self.publisher is None:
+            return
+        self.publisher.publish({"set": {"progress": {"in_progress": False, "failed": True}}})
+        self.publisher.close()
+        self.publisher = None
 
     def prepare_report_data(self) -> Dict:
         """Gathers all data needed for the HTML report."""
+        from cse140l.digital.images import optimize_svg, svg_to_data_uri
+
         analysis_errors = self.analyze_circuit()
 
         all_errors = defaultdict(list)
@@ -88,21 +167,17 @@ class LabRunner:
             if schematic_path.exists():
                 self.circuit_info.append({
                     "top_level": top_level,
-                    "base64_png_data": "data:image/svg+xml;base64," + base64.b64encode(
-                        self.digital.img.export_svg(schematic_path).encode("utf-8")).decode("ascii"),
+                    # The key name is kept for stored reports, it holds a (much smaller) plain text data URI
+                    "base64_png_data": svg_to_data_uri(optimize_svg(self.digital.img.export_svg(schematic_path))),
                     "analysis_errors": all_errors.get(top_level)
                 })
             else:
                 self.missing_files.append(top_level)
 
-        serializable_failed_tests = [
-            {
-                "test_name": test["test_name"],
-                "failed_steps": [self._test_output_to_dict(step) for step in test["failed_steps"]]
-            } for test in self.all_failed_tests
-        ]
+        serializable_failed_tests = [self._failed_test_to_dict(test) for test in self.all_failed_tests]
 
         return {
+            "schema_version": REPORT_SCHEMA_VERSION,
             "lab_number": self.config.lab_number,
             "circuit_info": self.circuit_info,
             "missing_files": self.missing_files,
@@ -110,22 +185,36 @@ class LabRunner:
         }
 
     def post_report(self, url: str, student_id: str, token: str) -> None:
-        """Posts the report data to the report server and stores the report UUID."""
+        """
+        Posts the report data to the report server and stores the report UUID. The progress publisher is only
+        dropped once the report was posted, otherwise close() marks the report as failed.
+        """
+        # The final report has to arrive after every partial one
+        if self.publisher is not None:
+            self.publisher.flush()
+
         if not url or not student_id or not token:
             log.warning("Report server URL, student ID, or token not provided. Skipping report submission.")
             return
 
+        import requests
+
         report_data = self.prepare_report_data()
         endpoint = f"{url.rstrip('/')}/report/{self.config.lab_number}/{student_id}"
         headers = {
             "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip"
         }
+        body = gzip.compress(json.dumps(report_data, separators=(",", ":")).encode("utf-8"), compresslevel=6)
 
         try:
-            response = requests.post(endpoint, headers=headers, data=json.dumps(report_data))
+            response = requests.post(endpoint, headers=headers, data=body)
             response.raise_for_status()
             log.info(f"Successfully posted report for student {student_id} to {endpoint}")
+            if self.publisher is not None:
+                self.publisher.close()
+                self.publisher = None
             try:
                 response_json = response.json()
                 self.report_uuid = response_json.get("uuid")
@@ -149,80 +238,125 @@ class LabRunner:
         if self.config.analyze is None:
             return None
 
-        cached_circuits: Dict[str, List[GateStat]] = dict()
-        analysis_failures: Dict[str, List[str]] = defaultdict(list)
-        gate_info = lambda g: f"{gate_count}x {g.inputs}-input {g.bit_width}-wide {g.name.upper()} gates" if g.inputs else f"{gate_count}x {g.bit_width} wide {g.name.upper()} gates"
-        for analysis in self.config.analyze:
-            for top_level in analysis.top_levels:
-                if not self.get_schematic_path(top_level).exists():
-                    analysis_failures[top_level].append(f"{top_level} not found!")
-                    continue
-
-                if top_level not in cached_circuits:
-                    cached_circuits[top_level] = self.digital.stats.get_stats(self.get_schematic_path(top_level))
-
-                for gate in analysis.gates:
-                    gate_count = get_gate_count(cached_circuits[top_level], gate)
-                    if gate.max_amount is not None and gate.max_amount < gate_count:
-                        analysis_failures[top_level].append(f"Circuit has {gate_info(gate)} (Maximum of {gate.max_amount} allowed for this lab)")
-
-                    if gate.min_amount is not None and gate.min_amount > gate_count:
-                        analysis_failures[top_level].append(f"Circuit has {gate_info(gate)} (Minimum of {gate.min_amount} allowed for this lab)")
-
-        return analysis_failures
+        from cse140l.lab.analysis import CircuitAnalyzer
+
+        analyzer = CircuitAnalyzer(self.digital.stats, self.submission_dir, max_workers=self.config.max_workers)
+        return analyzer.analyze(self.config.analyze)
+
+    def _run_test(self, test: "TestConfig") -> Tuple[List["TestOutput"], float]:
+        """Runs a single testbench, returning its outputs and how long it took."""
+        from cse140l.digital.util import get_process_limits
+
+        start = time.perf_counter()
+        dut: Path = self.get_schematic_path(test.top_level)
+        outputs: List["TestOutput"] = self.digital.test.run_test(dut, test.test_file, shards=test.shards,
+                                                               limits=get_process_limits(test),
+                                                               preflight=test.preflight)
+        return outputs, time.perf_counter() - start
+
+    def _evaluate_test(self, test: "TestConfig", outputs: List["TestOutput"]) -> Tuple[TestResult, Dict | None, str | None]:
+        """Scores a testbench's outputs. Returns its result, its failures for the report and its error, if any."""
+        failed = []
+        score = 0.
+        status = TestStatus.FAILED
+        error = False
+        failed_test = None
+        error_message = None
+        if outputs is not None and len(outputs) > 0:
+            if outputs[0].error:
+                status = TestStatus.FAILED
+                score = 0
+                failed = []
+                error = True
+                error_message = outputs[0].output if outputs[0].output else outputs[0].name
+            else:
+                failed: List["TestOutput"] = list(filter(lambda t: t.outcome == TestStatus.FAILED, outputs))
+                score = (1. - (len(failed) / len(outputs))) * test.max_score
+                status = TestStatus.FAILED if len(failed) > 0 else TestStatus.PASSED
+                # Shown next to the circuit in the web report, like errors
+                diagnostics = list(dict.fromkeys(t.diagnostic for t in failed if t.diagnostic))
+                if diagnostics:
+                    error_message = "\n".join(diagnostics)
+
+
+        result = {
+            "name": test.name,
+            "status": status,
+            "score": score,
+            "max_score": test.max_score,
+            "visibility_on_success": test.visibility_on_success,
+            "visibility_on_failure": test.visibility_on_failure,
+        }
 
+        log.debug(f"Testcase result: {result}")
+
+        if error:
+            result["output"] = outputs[0].output
+            result["output_format"] = TextFormat.TEXT
+        elif status == TestStatus.FAILED and len(failed) > 0:
+            failed_test = {"test_name": test.name, "failed_steps": failed}
+            output_text = f"{len(failed)} out of {len(outputs)} test vectors failed."
+            if any(output.truncated for output in outputs):
+                output_text += " Some output was too large and has been truncated."
+            if error_message is not None:
+                output_text += f"\n{error_message}"
+            result["output"] = output_text
+            result["output_format"] = TextFormat.TEXT
+        elif len(outputs) == 0:
+            result["output"] = "We could not test your circuit. This could be due to misnamed ports or other circuit bugs."
+            result["output_format"] = TextFormat.TEXT
+
+        return TestResult(**result), failed_test, error_message
 
     def run_tests(self) -> None:
-        for test in self.config.tests:
-            dut: Path = self.get_schematic_path(test.top_level)
-            outputs: List[TestOutput] = self.digital.test.run_test(dut, test.test_file)
-
-            failed = []
-            score = 0.
-            status = TestStatus.FAILED
-            error = False
-            if outputs is not None and len(outputs) > 0:
-                if outputs[0].error:
-                    status = TestStatus.FAILED
-                    score = 0
-                    failed = []
-                    error = True
-                    error_message = outputs[0].output if outputs[0].output else outputs[0].name
-                    self.test_errors[test.top_level].append(f"Error running test '{test.name}': {error_message}")
-                else:
-                    failed: List[TestOutput] = list(filter(lambda t: t.outcome == TestStatus.FAILED, outputs))
-                    score = (1. - (len(failed) / len(outputs))) * test.max_score
-                    status = TestStatus.FAILED if len(failed) > 0 else TestStatus.PASSED
-
-
-            result = {
-                "name": test.name,
-                "status": status,
-                "score": score,
-                "max_score": test.max_score,
-                "visibility_on_success": test.visibility_on_success,
-                "visibility_on_failure": test.visibility_on_failure,
-            }
-
-            log.debug(f"Testcase result: {result}")
-
-            if error:
-                result["output"] = outputs[0].output
-                result["output_format"] = TextFormat.TEXT
-            elif status == TestStatus.FAILED and len(failed) > 0:
-                self.all_failed_tests.append({"test_name": test.name, "failed_steps": failed})
-                output_text = f"{len(failed)} out of {len(outputs)} test vectors failed."
-                result["output"] = output_text
-                result["output_format"] = TextFormat.TEXT
-            elif len(outputs) == 0:
-                result["output"] = "We could not test your circuit. This could be due to misnamed ports or other circuit bugs."
-                result["output_format"] = TextFormat.TEXT
-
-            test_result: TestResult = TestResult(**result)
+        """
+        Runs the testbenches concurrently, longest first by their durations in earlier runs, so the slowest one
+        does not start last. Results are still reported in the order of the config.
+        """
+        tests = self.config.tests
+        keys = [duration_key(test.test_file, test.top_level) for test in tests]
+        has_history = self.durations.has_history(keys)
+        schedule = self.durations.longest_first(list(range(len(tests))), keys)
+        workers = max(1, min(self.test_workers, len(tests)))
+        predicted_makespan = predict_makespan([seconds for _, seconds in schedule], workers)
+
+        self._publish_progress(0)
+        evaluated: Dict[int, Tuple[TestResult, Dict | None, str | None]] = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="test") as executor:
+            futures = {executor.submit(self._run_test, tests[index]): index for index, _ in schedule}
+            for completed_tests, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                outputs, seconds = future.result()
+                evaluated[index] = self._evaluate_test(tests[index], outputs)
+                # Errors end early (or time out), their duration says nothing about the testbench
+                if outputs and not outputs[0].error:
+                    self.durations.record(keys[index], seconds)
+                self._publish_progress(completed_tests, evaluated[index][1])
+        makespan = time.perf_counter() - start
+        self.durations.save()
+
+        if has_history:
+            log.info(f"Ran {len(tests)} tests on {workers} workers in {makespan:.2f}s "
+                     f"(predicted {predicted_makespan:.2f}s from earlier runs)")
+        else:
+            log.info(f"Ran {len(tests)} tests on {workers} workers in {makespan:.2f}s (no earlier runs to predict from)")
+
+        for index, test in enumerate(tests):
+            test_result, failed_test, error_message = evaluated[index]
+            if error_message is not None:
+                self.test_errors[test.top_level].append(f"Error running test '{test.name}': {error_message}")
+            if failed_test is not None:
+                self.all_failed_tests.append(failed_test)
             self.autograder_writer.add_test(test_result)
 
     def generate_results_json(self, report_path: Path) -> None:
         """Generates the final Gradescope results.json file."""
+        self.finalize_results()
+        self.autograder_writer.write_report(report_path)
+
+    def finalize_results(self) -> None:
+        """Adds the links to the web report to the results, once all tests have run and the report is posted."""
         if self.report_server_url and self.student_id:
             if self.report_uuid:
                 report_url = f"{self.report_server_url.rstrip('/')}/report/{self.report_uuid}"
@@ -241,13 +375,11 @@ class LabRunner:
                 # Handle error case where UUID was not obtained
                 output_text = "There was an error generating your web report. Please contact your TA for assistance."
                 self.autograder_writer.set_output(output_text, output_format=TextFormat.TEXT)
-        
-        self.autograder_writer.write_report(report_path)
 
     def report(self) -> None:
         self.autograder_writer.print_report()
 
-def main():
+def main(argv: List[str] = None):
     parser = argparse.ArgumentParser(description="Run the lab test benches as defined in the config file")
 
     parser.add_argument(
@@ -289,6 +421,12 @@ def main():
         help="Optional path to a file to write log output."
     )
 
+    parser.add_argument(
+        "--compress-log-artifacts",
+        action="store_true",
+        help="Gzip the large outputs (e.g. Digital test output) that are written next to the log file."
+    )
+
     parser.add_argument(
         "--report-server-url",
         type=str,
@@ -310,9 +448,22 @@ def main():
         help="Authentication token for the report server. Can also be set with REPORT_SERVER_AUTH_TOKEN environment variable."
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--no-config-cache",
+        action="store_true",
+        help="Always re-validate the config file instead of using a cached snapshot."
+    )
+
+    parser.add_argument(
+        "--no-progress-report",
+        action="store_true",
+        help="Only update the web report once all tests have finished, instead of after each test."
+    )
+
+    args = parser.parse_args(argv)
 
-    setup_logger(log_file=args.log_file, level=logging.INFO if not args.debug else logging.DEBUG)
+    setup_logger(log_file=args.log_file, level=logging.INFO if not args.debug else logging.DEBUG,
+                 compress_artifacts=args.compress_log_artifacts)
 
     if not args.config_file.exists():
         log.error("Configuration file does not exist!")
@@ -325,10 +476,16 @@ def main():
         gradescope_mode=args.gradescope,
         existing_tests=args.json_files,
         report_server_url=args.report_server_url,
-        student_id=args.student_id
+        student_id=args.student_id,
+        use_config_snapshot=not args.no_config_cache,
+        auth_token=args.auth_token,
+        publish_progress=not args.no_progress_report
     )
-    runner.run_tests()
-    runner.post_report(args.report_server_url, args.student_id, args.auth_token)
+    try:
+        runner.run_tests()
+        runner.post_report(args.report_server_url, args.student_id, args.auth_token)
+    finally:
+        runner.close()
     runner.generate_results_json(args.output_file)
     runner.report()
 
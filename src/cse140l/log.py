@@ -1,6 +1,12 @@
 import logging
+import logging.handlers
+import atexit
+import gzip
+import itertools
+import queue
 import sys
 import os
+from pathlib import Path
 
 # Create and export the main project logger instance for easy import
 # Note: It's best practice to call setup_logger once in the main entry point
@@ -8,15 +14,77 @@ import os
 log = logging.getLogger('cse140l')
 log.setLevel(logging.INFO)
 
-def setup_logger(log_file: str = None, level=logging.INFO):
+# Payloads larger than this are written to their own artifact file instead of into the log
+DEFAULT_ARTIFACT_THRESHOLD = 64 * 1024
+
+# Set by setup_logger, so checking it costs nothing on hot paths
+_logging_to_file = False
+_listener: logging.handlers.QueueListener | None = None
+_artifact_dir: Path | None = None
+_artifact_threshold = DEFAULT_ARTIFACT_THRESHOLD
+_compress_artifacts = False
+_artifact_counter = itertools.count(1)
+
+
+class ArtifactHandler(logging.Handler):
+    """
+    Runs on the queue listener's thread: writes the payload attached to a record (if any) to its artifact file,
+    then passes the record on to the real handler. The grading thread never waits on either write.
+    """
+
+    def __init__(self, target: logging.Handler):
+        super().__init__(target.level)
+        self.target = target
+
+    def emit(self, record: logging.LogRecord) -> None:
+        artifact = getattr(record, "artifact", None)
+        if artifact is not None:
+            path, content = artifact
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                data = content.encode("utf-8") if isinstance(content, str) else content
+                with (gzip.open(path, "wb") if path.suffix == ".gz" else open(path, "wb")) as f:
+                    f.write(data)
+            except OSError:
+                self.handleError(record)
+            record.artifact = None
+        self.target.handle(record)
+
+    def close(self) -> None:
+        self.target.close()
+        super().close()
+
+
+def _stop_listener() -> None:
+    """Writes out everything still queued and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
+
+def setup_logger(log_file: str = None, level=logging.INFO, compress_artifacts: bool = False,
+                 artifact_threshold: int = DEFAULT_ARTIFACT_THRESHOLD):
     """
     Sets up a project-wide logger, outputting to a file if provided,
     otherwise defaulting to stdout.
 
+    File output goes through a QueueHandler, the file itself is written by a QueueListener thread.
+    Large payloads logged with log_artifact are written next to the log file in "<log name>_artifacts".
+
     Args:
         log_file (str, optional): Path to the log file. If None, logs to stdout.
         level (int): The minimum logging level (e.g., logging.DEBUG, logging.INFO).
+        compress_artifacts (bool): Gzip artifact files.
+        artifact_threshold (int): Size in characters above which log_artifact writes a separate file.
     """
+    global _logging_to_file, _listener, _artifact_dir, _artifact_threshold, _compress_artifacts
+
     # Get the existing logger instance
     logger = logging.getLogger('cse140l')
     logger.setLevel(level)
@@ -24,6 +92,7 @@ def setup_logger(log_file: str = None, level=logging.INFO):
     # 1. Clear any existing handlers to prevent duplicates on re-configuration
     if logger.handlers:
         logger.handlers.clear()
+    _stop_listener()
 
     # 2. Define the Formatter
     formatter = logging.Formatter(
@@ -38,29 +107,55 @@ def setup_logger(log_file: str = None, level=logging.INFO):
         if log_dir and not os.path.exists(log_dir):
             os.makedirs(log_dir)
 
-        # Use FileHandler for disk output (appends to file)
-        handler = logging.FileHandler(log_file, mode='a')
+        # Use FileHandler for disk output (appends to file), it only ever runs on the listener's thread
+        file_handler = logging.FileHandler(log_file, mode='a')
+        file_handler.setLevel(level)
+        file_handler.setFormatter(formatter)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, ArtifactHandler(file_handler), respect_handler_level=True)
+        _listener.start()
+
+        handler = logging.handlers.QueueHandler(log_queue)
+        log_path = Path(log_file).absolute()
+        _artifact_dir = Path(log_path.parent, f"{log_path.stem}_artifacts")
     else:
         # Default to StreamHandler for stdout output
         handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(formatter)
+        _artifact_dir = None
 
     handler.setLevel(level)
-    handler.setFormatter(formatter)
+    _logging_to_file = bool(log_file)
+    _artifact_threshold = artifact_threshold
+    _compress_artifacts = compress_artifacts
 
     # 4. Add the handler to the logger
     logger.addHandler(handler)
 
 def is_logging_to_file() -> bool:
-    """Checks if the main project logger has an active FileHandler."""
-    logger = logging.getLogger('cse140l')
+    """Checks if the main project logger writes to a file (as configured by setup_logger)."""
+    return _logging_to_file
+
+def log_artifact(title: str, content: str | bytes, name: str = "artifact", level=logging.INFO) -> None:
+    """
+    Logs a potentially large payload. Small payloads are inlined under the title, larger ones are written to
+    their own (optionally gzipped) file in the artifact directory, and only the file's path is logged.
+    Payloads are only written when logging to a file.
+    """
+    if not _logging_to_file or not log.isEnabledFor(level):
+        return
+
+    if len(content) <= _artifact_threshold or _artifact_dir is None:
+        text = content.decode("utf-8", "replace") if isinstance(content, bytes) else content
+        log.log(level, f"{title}:\n{text}", stacklevel=2)
+        return
 
-    # Iterate through all handlers attached to the logger
-    for handler in logger.handlers:
-        # Check if the handler is a FileHandler
-        if isinstance(handler, logging.FileHandler):
-            return True
-    return False
+    suffix = ".txt.gz" if _compress_artifacts else ".txt"
+    path = Path(_artifact_dir, f"{next(_artifact_counter):05d}_{os.getpid()}_{name}{suffix}")
+    log.log(level, f"{title}: {len(content)} characters written to {path}", extra={"artifact": (path, content)},
+            stacklevel=2)
 
 # Initial setup to ensure a logger exists, even before CLI args are parsed
 if not log.handlers:
-    setup_logger()
\ No newline at end of file
+    setup_logger()
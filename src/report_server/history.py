@@ -0,0 +1,68 @@
+import json
+import zlib
+import difflib
+from typing import Any, Iterable, List, Tuple
+
+# Every Nth version is stored whole, so rebuilding a version never applies more than N - 1 deltas
+KEYFRAME_INTERVAL = 10
+
+
+def serialize(data: Any) -> List[str]:
+    """
+    Serializes report data into lines. Sorted keys and one value per line keep consecutive versions of a
+    report line-aligned, which is what makes the deltas small.
+    """
+    return json.dumps(data, indent=1, sort_keys=True).split("\n")
+
+
+def deserialize(lines: List[str]) -> Any:
+    return json.loads("\n".join(lines))
+
+
+def encode_keyframe(lines: List[str]) -> bytes:
+    return zlib.compress("\n".join(lines).encode("utf-8"))
+
+
+def decode_keyframe(blob: bytes) -> List[str]:
+    return zlib.decompress(blob).decode("utf-8").split("\n")
+
+
+def encode_delta(base: List[str], lines: List[str]) -> bytes:
+    """
+    Encodes `lines` as a list of operations on `base`: [start, end] copies a range of base lines,
+    a list of strings inserts new lines.
+    """
+    operations: List[Any] = []
+    matcher = difflib.SequenceMatcher(None, base, lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            operations.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            operations.append({"lines": lines[j1:j2]})
+    return zlib.compress(json.dumps(operations, separators=(",", ":")).encode("utf-8"))
+
+
+def apply_delta(base: List[str], blob: bytes) -> List[str]:
+    lines: List[str] = []
+    for operation in json.loads(zlib.decompress(blob)):
+        if isinstance(operation, list):
+            lines.extend(base[operation[0]:operation[1]])
+        else:
+            lines.extend(operation["lines"])
+    return lines
+
+
+def reconstruct(chain: Iterable[Tuple[bool, bytes]]) -> List[str]:
+    """Rebuilds a version from (is_keyframe, data) pairs, starting at a keyframe and ending at the version."""
+    lines: List[str] | None = None
+    for is_keyframe, blob in chain:
+        if is_keyframe:
+            lines = decode_keyframe(blob)
+        elif lines is None:
+            raise ValueError("Version chain does not start with a keyframe")
+        else:
+            lines = apply_delta(lines, blob)
+
+    if lines is None:
+        raise ValueError("Empty version chain")
+    return lines
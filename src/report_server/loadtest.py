@@ -0,0 +1,414 @@
+import os
+import sys
+import json
+import gzip
+import time
+import uuid
+import random
+import socket
+import tempfile
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+import logging
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# Signals and values the synthetic failed steps are made of
+_SIGNALS = ["A", "B", "C", "Cin", "S", "Cout", "clk", "rst", "Q0", "Q1", "Q2", "Q3"]
+_VALUES = ["0", "1", "X", "Z", "E: 1 / F: 0", "E: 0 / F: 1"]
+
+
+@dataclass
+class LoadTestConfig:
+    """What a load test runs: the request mix, how hard it is driven, and what the posted reports look like."""
+    # Fraction of requests that POST a report, the rest GET one
+    post_fraction: float = 0.2
+    concurrency: int = 16
+    duration: float = 30.
+    # Stops early after this many requests, if set
+    max_requests: int | None = None
+    students: int = 300
+    labs: List[int] = field(default_factory=lambda: [1])
+    # Shape of the synthetic reports
+    failed_tests: int = 3
+    steps_per_test: int = 20
+    schematic_bytes: int = 12 * 1024
+    # Fraction of GETs that revalidate with the ETag of an earlier response, like a student refreshing the page
+    revalidate_fraction: float = 0.
+    # Pre-render the seeded reports before the run, as is done for an unlocked lab
+    prerender: bool = False
+    # Gunicorn workers, 0 runs Flask's development server
+    workers: int = 0
+    seed: int = 140
+
+
+def synthesize_report_data(rng: random.Random, lab_number: int, config: LoadTestConfig) -> Dict:
+    """Builds report data shaped like what the lab runner posts (schema version 2)."""
+    def failed_step(index: int) -> Dict:
+        signals = rng.sample(_SIGNALS, rng.randint(3, 8))
+        return {
+            "name": f"test_{index}",
+            "outcome": "failed",
+            "error": False,
+            "signals": signals,
+            "columns": [[rng.choice(_VALUES) for _ in range(config.steps_per_test)] for _ in signals],
+        }
+
+    # A schematic is mostly a handful of repeated elements, padded to the requested size
+    svg_parts = ['<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1200 900">']
+    svg_length = len(svg_parts[0])
+    while svg_length < config.schematic_bytes:
+        x, y = rng.randint(0, 60) * 20, rng.randint(0, 45) * 20
+        part = f'<use href="#p0" x="{x}" y="{y}" class="s0"/><line x1="{x - 20}" y1="{y + 20}" x2="{x}" y2="{y + 20}"/>'
+        svg_parts.append(part)
+        svg_length += len(part)
+    svg_parts.append("</svg>")
+
+    return {
+        "schema_version": 2,
+        "lab_number": lab_number,
+        "circuit_info": [{
+            "top_level": "top",
+            "base64_png_data": "data:image/svg+xml," + quote("".join(svg_parts)),
+            "analysis_errors": None,
+        }],
+        "missing_files": [],
+        "all_failed_tests": [
+            {
+                "test_name": f"Test {test}",
+                "failed_steps": [failed_step(step) for step in range(rng.randint(1, 3))],
+            }
+            for test in range(rng.randint(0, config.failed_tests))
+        ],
+    }
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float | None:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], statuses: Counter, errors: int, elapsed: float) -> Dict:
+    """Throughput, latency percentiles (in milliseconds) and error rate of one kind of request."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def ms(value: float | None) -> float | None:
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "requests": count,
+        "throughput_rps": round(count / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": {
+            "mean": ms(sum(latencies) / count) if count else None,
+            "p50": ms(percentile(latencies, 0.50)),
+            "p95": ms(percentile(latencies, 0.95)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "max": ms(latencies[-1]) if count else None,
+        },
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else None,
+        "status_codes": {str(status): n for status, n in sorted(statuses.items(), key=lambda item: str(item[0]))},
+    }
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ReportServerProcess:
+    """
+    The report server running in a child process on a temporary database, static report directory and config,
+    so a load test never touches real reports.
+    """
+
+    def __init__(self, directory: Path, workers: int = 0):
+        self.directory = directory
+        self.workers = workers
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.token = uuid.uuid4().hex
+        self.log_path = Path(directory, "server.log")
+        self.env = {
+            **os.environ,
+            "DATABASE_PATH": str(Path(directory, "reports.db")),
+            "STATIC_REPORT_DIR": str(Path(directory, "static_reports")),
+            "REPORT_SERVER_METRICS_DIR": str(Path(directory, "metrics")),
+            "REPORT_SERVER_CONFIG_PATH": str(Path(directory, "server_config.toml")),
+            "REPORT_SERVER_AUTH_TOKEN": self.token,
+        }
+        Path(directory, "server_config.toml").write_text("")
+        self._process: subprocess.Popen | None = None
+        self._log_file = None
+
+    def start(self, timeout: float = 30.) -> None:
+        if self.workers > 0:
+            command = [sys.executable, "-m", "gunicorn", "--workers", str(self.workers),
+                       "--bind", f"127.0.0.1:{self.port}", "report_server.report_server:app"]
+        else:
+            command = [sys.executable, "-m", "report_server.report_server", "serve", "--port", str(self.port)]
+
+        self._log_file = open(self.log_path, "wb")
+        self._process = subprocess.Popen(command, env=self.env, stdout=self._log_file, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"Report server exited with code {self._process.returncode}, "
+                                   f"see {self.log_path}:\n{self.log_path.read_text(errors='replace')[-2000:]}")
+            try:
+                if requests.get(f"{self.url}/metrics", timeout=1).ok:
+                    log.info(f"Report server is up at {self.url} (pid {self._process.pid})")
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"Report server did not start within {timeout}s, see {self.log_path}")
+
+    def prerender(self, lab_number: int) -> None:
+        """Pre-renders a lab with the server's own command, against the same temporary database."""
+        subprocess.run([sys.executable, "-m", "report_server.report_server", "prerender", "--lab", str(lab_number)],
+                       env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    def stop(self) -> None:
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def __enter__(self) -> "ReportServerProcess":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class LoadTest:
+    """Drives a mix of concurrent report POSTs and GETs against a report server and records every request."""
+
+    def __init__(self, server_url: str, token: str, config: LoadTestConfig):
+        self.server_url = server_url.rstrip("/")
+        self.token = token
+        self.config = config
+
+        # Payloads are built up front, so the client spends the run sending requests and not generating JSON
+        rng = random.Random(config.seed)
+        self.students: List[Tuple[int, str]] = [
+            (rng.choice(config.labs), f"A{10000000 + i}") for i in range(config.students)
+        ]
+        self.payloads: List[bytes] = [
+            gzip.compress(json.dumps(synthesize_report_data(rng, lab, config), separators=(",", ":")).encode("utf-8"),
+                          compresslevel=6)
+            for lab, _ in self.students
+        ]
+        self.uuids: List[str] = []
+        self.etags: Dict[str, str] = {}
+
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+        self._statuses: Dict[str, Counter] = defaultdict(Counter)
+        self._errors: Counter = Counter()
+        self._issued = 0
+
+    def _post(self, session: requests.Session, index: int) -> requests.Response:
+        lab_number, student_id = self.students[index]
+        return session.post(
+            f"{self.server_url}/report/{lab_number}/{student_id}",
+            data=self.payloads[index],
+            headers={
+                "Authorization": f"Bearer {self.token}",
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+            },
+            timeout=60,
+        )
+
+    def seed(self) -> None:
+        """Posts one report per student, so GETs have something to fetch. Not part of the measurement."""
+        start = time.perf_counter()
+        with requests.Session() as session:
+            for index in range(len(self.students)):
+                response = self._post(session, index)
+                response.raise_for_status()
+                self.uuids.append(response.json()["uuid"])
+        log.info(f"Seeded {len(self.uuids)} reports in {time.perf_counter() - start:.2f}s")
+
+    def _record(self, kind: str, latency: float, status: int | str, ok: bool) -> None:
+        with self._lock:
+            self._latencies[kind].append(latency)
+            self._statuses[kind][status] += 1
+            if not ok:
+                self._errors[kind] += 1
+
+    def _take_ticket(self) -> bool:
+        with self._lock:
+            if self.config.max_requests is not None and self._issued >= self.config.max_requests:
+                return False
+            self._issued += 1
+            return True
+
+    def _worker(self, worker_id: int, deadline: float) -> None:
+        rng = random.Random(self.config.seed * 1000 + worker_id)
+        with requests.Session() as session:
+            while time.perf_counter() < deadline and self._take_ticket():
+                if rng.random() < self.config.post_fraction:
+                    kind = "post"
+                    index = rng.randrange(len(self.students))
+                    request = lambda: self._post(session, index)
+                else:
+                    report_uuid = rng.choice(self.uuids)
+                    headers = {"Accept-Encoding": "gzip"}
+                    etag = self.etags.get(report_uuid)
+                    if etag is not None and rng.random() < self.config.revalidate_fraction:
+                        kind = "revalidate"
+                        headers["If-None-Match"] = etag
+                    else:
+                        kind = "get"
+                    request = lambda: session.get(f"{self.server_url}/report/{report_uuid}", headers=headers,
+                                                  timeout=60)
+
+                start = time.perf_counter()
+                try:
+                    response = request()
+                    # Reading the whole body is part of what a browser waits for
+                    _ = response.content
+                except requests.exceptions.RequestException as e:
+                    self._record(kind, time.perf_counter() - start, type(e).__name__, False)
+                    continue
+                self._record(kind, time.perf_counter() - start, response.status_code,
+                             response.status_code < 400)
+
+                if kind != "post" and response.headers.get("ETag"):
+                    self.etags[report_uuid] = response.headers["ETag"]
+
+    def run(self) -> Dict:
+        """Runs the load and returns the results as a JSON serializable dict."""
+        if not self.uuids:
+            self.seed()
+
+        threads = []
+        start = time.perf_counter()
+        deadline = start + self.config.duration
+        for worker_id in range(self.config.concurrency):
+            thread = threading.Thread(target=self._worker, args=(worker_id, deadline), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        operations = {
+            kind: summarize(latencies, self._statuses[kind], self._errors[kind], elapsed)
+            for kind, latencies in sorted(self._latencies.items())
+        }
+        total = summarize(
+            [latency for latencies in self._latencies.values() for latency in latencies],
+            sum(self._statuses.values(), Counter()),
+            sum(self._errors.values()),
+            elapsed,
+        )
+        return {
+            "config": asdict(self.config),
+            "elapsed_seconds": round(elapsed, 3),
+            "total": total,
+            "operations": operations,
+        }
+
+
+def run_load_test(config: LoadTestConfig) -> Dict:
+    """Starts a throwaway report server, seeds it, drives the configured load against it and returns the results."""
+    with tempfile.TemporaryDirectory(prefix="report_server_loadtest_") as directory:
+        with ReportServerProcess(Path(directory), workers=config.workers) as server:
+            load_test = LoadTest(server.url, server.token, config)
+            load_test.seed()
+            if config.prerender:
+                for lab_number in sorted(set(config.labs)):
+                    server.prerender(lab_number)
+            results = load_test.run()
+            results["database_bytes"] = os.path.getsize(server.env["DATABASE_PATH"])
+            return results
+
+
+def main(argv: List[str] | None = None) -> None:
+    """
+    Command line entry point. It is separate from the report-server command so that nothing here imports the server
+    module, which would migrate the configured database and start its metrics on import.
+    """
+    parser = argparse.ArgumentParser(
+        description="Start a throwaway report server on a temporary database, drive a mix of report POSTs and GETs "
+                    "against it and print throughput, latency percentiles and error rates as JSON."
+    )
+    parser.add_argument("--post-fraction", type=float, default=0.2,
+                        help="Fraction of requests that post a report, the rest get one. "
+                             "Near 1 is a deadline burst, near 0 an unlock-time storm.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients.")
+    parser.add_argument("--duration", type=float, default=30., help="Length of the run in seconds.")
+    parser.add_argument("--requests", type=int, dest="max_requests",
+                        help="Stop after this many requests, even if the duration has not passed.")
+    parser.add_argument("--students", type=int, default=300, help="Number of distinct reports.")
+    parser.add_argument("--lab", type=int, action="append", dest="labs",
+                        help="Lab the reports belong to (can be repeated, default 1).")
+    parser.add_argument("--failed-tests", type=int, default=3, help="Maximum failed tests per report.")
+    parser.add_argument("--steps-per-test", type=int, default=20, help="Rows in each failed step's table.")
+    parser.add_argument("--schematic-kib", type=float, default=12.,
+                        help="Size of the schematic embedded in each report.")
+    parser.add_argument("--revalidate-fraction", type=float, default=0.,
+                        help="Fraction of GETs sent with the ETag of an earlier response.")
+    parser.add_argument("--prerender", action="store_true",
+                        help="Pre-render the reports before the run, as for an unlocked lab.")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Run the server under gunicorn with this many workers (0: development server).")
+    parser.add_argument("--seed", type=int, default=140, help="Seed for the synthetic reports and mix.")
+    parser.add_argument("--output", type=Path, help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    # Progress goes to stderr, stdout only gets the results
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    config = LoadTestConfig(
+        post_fraction=args.post_fraction,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        max_requests=args.max_requests,
+        students=args.students,
+        labs=args.labs or [1],
+        failed_tests=args.failed_tests,
+        steps_per_test=args.steps_per_test,
+        schematic_bytes=int(args.schematic_kib * 1024),
+        revalidate_fraction=args.revalidate_fraction,
+        prerender=args.prerender,
+        workers=args.workers,
+        seed=args.seed,
+    )
+    results = json.dumps(run_load_test(config), indent=2)
+    print(results)
+    if args.output is not None:
+        args.output.write_text(results + "\n")
+
+
+if __name__ == '__main__':
+    main()
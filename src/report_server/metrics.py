@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import atexit
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Every worker process writes its own metrics here, /metrics merges all the files it finds
+METRICS_DIR = Path(os.environ.get("REPORT_SERVER_METRICS_DIR", os.path.join(tempfile.gettempdir(), "report_server_metrics")))
+
+# Seconds between writes of a worker's metrics file
+FLUSH_INTERVAL = float(os.environ.get("REPORT_SERVER_METRICS_FLUSH_INTERVAL", "1.0"))
+
+# Metrics of workers that exited are folded into this file, so the directory does not grow with every restart
+AGGREGATE_FILE = "aggregate.json"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# name -> (type, help text, histogram buckets)
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "report_server_request_duration_seconds": ("histogram", "Time spent handling a request.", LATENCY_BUCKETS),
+    "report_server_db_query_duration_seconds": ("histogram", "Time spent executing a database query.", LATENCY_BUCKETS),
+    "report_server_template_render_duration_seconds": ("histogram", "Time spent rendering a template.", LATENCY_BUCKETS),
+    "report_server_request_size_bytes": ("histogram", "Size of request bodies.", SIZE_BUCKETS),
+    "report_server_response_size_bytes": ("histogram", "Size of response bodies.", SIZE_BUCKETS),
+    "report_server_responses_total": ("counter", "Responses sent, by route and status code.", ()),
+    "report_server_report_cache_total": ("counter", "Report requests by how they were answered (prerendered, not_modified or rendered).", ()),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in labels + extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _file_pid(path: Path) -> int | None:
+    """Pid of the worker that writes a metrics file, None for files that are not a worker's."""
+    pid = path.name.split("-", 1)[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshot(path: Path) -> Dict | None:
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return snapshot if isinstance(snapshot, dict) else None
+
+
+def _add_snapshot(snapshot: Dict, counters: Dict[Tuple[str, Labels], float],
+                  histograms: Dict[Tuple[str, Labels], List[float]]) -> None:
+    for name, labels, value in snapshot.get("counters", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0.) + value
+    for name, labels, values in snapshot.get("histograms", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if key in histograms and len(histograms[key]) == len(values):
+            histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+        else:
+            histograms[key] = list(values)
+
+
+class MetricsRegistry:
+    """
+    Per process counters and histograms that are written to a file in METRICS_DIR every FLUSH_INTERVAL seconds
+    by a background thread, once the process starts serving (see start). Rendering merges the files of every process, so numbers are aggregated across
+    gunicorn workers. Files of workers that exited are compacted into AGGREGATE_FILE, so their numbers survive
+    worker restarts without a file per worker that ever ran.
+    """
+
+    def __init__(self, directory: Path = METRICS_DIR):
+        self.directory = directory
+        self._reset()
+        # gunicorn --preload forks workers from a master that imported the app. A lock held by one of the
+        # master's threads during the fork would stay held in the worker forever, so each worker starts afresh.
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # A random suffix keeps a reused pid from overwriting a dead worker's numbers
+        self._path = Path(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # bucket counts followed by sum and count
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._last_flush = 0.
+        self._dirty = False
+        self._closed = False
+        self._started = False
+
+    def start(self) -> None:
+        """
+        Starts flushing this process's metrics periodically and at exit. The app calls it when it serves its first
+        request, so the other report-server commands that import it never start a thread or leave a file behind.
+        """
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True).start()
+        atexit.register(self.close)
+
+    def _flush_periodically(self) -> None:
+        # Writes metrics of workers that stop getting requests too, the after_request flush only runs on requests
+        while not self._closed:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1.) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.) + value
+            self._dirty = True
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            values = self._histograms.setdefault(key, [0.] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+            self._dirty = True
+
+    def flush(self, force: bool = False) -> None:
+        """Writes this process's metrics to its file if they changed and the flush interval has passed."""
+        with self._lock:
+            now = time.monotonic()
+            if self._closed or not self._dirty or (not force and now - self._last_flush < FLUSH_INTERVAL):
+                return
+            snapshot = {
+                "counters": [[name, labels, value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, labels, values] for (name, labels), values in self._histograms.items()],
+            }
+            self._last_flush = now
+            self._dirty = False
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._path)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+
+    def close(self) -> None:
+        """Writes this process's final metrics and folds them into the aggregate, called when the process exits."""
+        # Nothing to write for a process that never served, like another command or a worker forked before serving
+        if not self._started:
+            return
+        self.flush(force=True)
+        with self._lock:
+            self._closed = True
+        self.compact(exiting=True)
+
+    def compact(self, exiting: bool = False) -> None:
+        """
+        Folds the files of workers that exited (and this process's own file when exiting) into AGGREGATE_FILE and
+        deletes them. The aggregate lists the files it already contains, so a compaction interrupted before the
+        deletes never counts a file twice.
+        """
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            lock = open(Path(self.directory, ".compact.lock"), "w")
+        except OSError:
+            return
+
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            aggregate_path = Path(self.directory, AGGREGATE_FILE)
+            aggregate = _read_snapshot(aggregate_path) or {}
+            compacted = set(aggregate.get("compacted", []))
+
+            counters: Dict[Tuple[str, Labels], float] = {}
+            histograms: Dict[Tuple[str, Labels], List[float]] = {}
+            _add_snapshot(aggregate, counters, histograms)
+            finished: List[Path] = []
+            for path in self.directory.glob("*.json"):
+                pid = _file_pid(path)
+                if path.name in compacted or pid is None or (_is_alive(pid) and not (exiting and pid == self._pid)):
+                    continue
+                snapshot = _read_snapshot(path)
+                if snapshot is None:
+                    continue
+                _add_snapshot(snapshot, counters, histograms)
+                finished.append(path)
+
+            existing = [name for name in compacted if Path(self.directory, name).exists()]
+            if not finished and len(existing) == len(compacted):
+                return
+
+            try:
+                tmp_path = aggregate_path.with_suffix(".tmp")
+                with open(tmp_path, "w") as f:
+                    json.dump({
+                        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+                        "histograms": [[name, labels, values] for (name, labels), values in histograms.items()],
+                        "compacted": existing + [path.name for path in finished],
+                    }, f)
+                os.replace(tmp_path, aggregate_path)
+            except OSError:
+                return
+            for path in finished:
+                path.unlink(missing_ok=True)
+
+    def _merge_files(self) -> Tuple[Dict[Tuple[str, Labels], float], Dict[Tuple[str, Labels], List[float]]]:
+        counters: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        try:
+            lock = open(Path(self.directory, ".compact.lock"), "w")
+        except OSError:
+            return counters, histograms
+
+        # A compaction running at the same time would move files into the aggregate after it was read
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            aggregate = _read_snapshot(Path(self.directory, AGGREGATE_FILE)) or {}
+            compacted = set(aggregate.get("compacted", []))
+            _add_snapshot(aggregate, counters, histograms)
+            for path in self.directory.glob("*.json"):
+                if path.name == AGGREGATE_FILE or path.name in compacted:
+                    continue
+                snapshot = _read_snapshot(path)
+                if snapshot is not None:
+                    _add_snapshot(snapshot, counters, histograms)
+        return counters, histograms
+
+    def render(self) -> str:
+        """Renders the metrics of all processes in the Prometheus text exposition format."""
+        self.flush(force=True)
+        self.compact()
+        counters, histograms = self._merge_files()
+
+        lines: List[str] = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                for (key_name, labels), value in sorted(counters.items()):
+                    if key_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+
+            for (key_name, labels), values in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                for bound, count in zip(buckets, values):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {_format_value(count)}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {_format_value(values[-1])}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(values[-1])}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def instrument_engine(engine) -> None:
+    """Records the duration of every query executed through a SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start_time"].pop()
+        operation = statement.lstrip().split(" ", 1)[0].upper()
+        registry.observe("report_server_db_query_duration_seconds", {"operation": operation}, time.perf_counter() - start)
@@ -0,0 +1,113 @@
+import time
+from typing import Any, Dict, List
+
+# Newest report format the server understands.
+# 1: failed steps carry "steps", a list of {signal: value} dicts (reports without a schema_version)
+# 2: failed steps carry "columns", one list of values per signal
+LATEST_SCHEMA_VERSION = 2
+
+# A run that has not published anything for this long is assumed to have died without saying so
+PROGRESS_TIMEOUT_SECONDS = 15 * 60
+
+
+def _step_rows(failed_step: Dict[str, Any], schema_version: int) -> List[List[str]]:
+    if schema_version >= 2:
+        return [list(row) for row in zip(*failed_step.get("columns") or [])]
+    return [list(step.values()) for step in failed_step.get("steps") or [] if step]
+
+
+def _normalize_failed_tests(failed_tests: List[Dict[str, Any]], schema_version: int) -> List[Dict[str, Any]]:
+    if schema_version > LATEST_SCHEMA_VERSION:
+        raise ValueError(f"Unsupported report schema version {schema_version}")
+    return [
+        {
+            **test_run,
+            "failed_steps": [
+                {**failed_step, "rows": _step_rows(failed_step, schema_version)}
+                for failed_step in test_run.get("failed_steps", [])
+            ],
+        }
+        for test_run in failed_tests or []
+    ]
+
+
+def normalize_report_data(report_data: Dict[str, Any], now: float = None) -> Dict[str, Any]:
+    """
+    Converts report data of any schema version into what the report template expects: every failed step gets
+    "rows", a list of value lists in the order of its "signals". Reports are stored as they were received,
+    so this runs at render time.
+
+    While a run is in progress its partial results are shown instead of the last complete ones. A run that
+    failed, or went quiet for PROGRESS_TIMEOUT_SECONDS, is "interrupted" and the last complete results are shown.
+    """
+    progress = report_data.get("progress")
+    if isinstance(progress, dict):
+        progress = {**progress, "has_results": "circuit_info" in report_data}
+        if progress.get("in_progress"):
+            now = time.time() if now is None else now
+            if now - progress.get("updated_at", 0) > PROGRESS_TIMEOUT_SECONDS:
+                progress.update(in_progress=False, interrupted=True)
+            else:
+                return {
+                    **report_data,
+                    "progress": progress,
+                    "missing_files": progress.get("missing_files") or [],
+                    "circuit_info": [],
+                    "all_failed_tests": _normalize_failed_tests(
+                        report_data.get("progress_failed_tests"), progress.get("schema_version", 1)
+                    ),
+                }
+        elif progress.get("failed"):
+            progress["interrupted"] = True
+
+    all_failed_tests = _normalize_failed_tests(report_data.get("all_failed_tests"), report_data.get("schema_version", 1))
+    return {**report_data, "progress": progress, "all_failed_tests": all_failed_tests}
+
+
+def summarize_report_data(report_data: Dict[str, Any]) -> Dict[str, int]:
+    """Counts extracted from a report (of any schema version) into the indexed summary columns."""
+    if not isinstance(report_data, dict):
+        report_data = {}
+    return {
+        "failed_test_count": sum(
+            len(test_run.get("failed_steps") or []) for test_run in report_data.get("all_failed_tests") or []
+        ),
+        "missing_file_count": len(report_data.get("missing_files") or []),
+        "analysis_error_count": sum(
+            len(info.get("analysis_errors") or []) for info in report_data.get("circuit_info") or []
+        ),
+    }
+
+
+def apply_report_patch(report_data: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merges partial results sent while grading is still running into a report. "set" replaces top level keys,
+    "append" extends top level lists (each finished test adds its failures to "progress_failed_tests").
+    Returns the merged data as a new dict, raises ValueError for a malformed patch.
+    """
+    if not isinstance(patch, dict) or set(patch) - {"set", "append"}:
+        raise ValueError("A report patch is an object with only \"set\" and \"append\".")
+    set_values = patch.get("set") or {}
+    append_values = patch.get("append") or {}
+    if not isinstance(set_values, dict) or not isinstance(append_values, dict):
+        raise ValueError("\"set\" and \"append\" of a report patch must be objects.")
+
+    data = dict(report_data) if isinstance(report_data, dict) else {}
+    data.pop("init", None)
+    data.update(set_values)
+    for key, items in append_values.items():
+        existing = data.get(key) or []
+        if not isinstance(items, list) or not isinstance(existing, list):
+            raise ValueError(f"Cannot append to \"{key}\", only lists can be appended to.")
+        data[key] = [*existing, *items]
+
+    schema_version = data.get("schema_version", 1)
+    if not isinstance(schema_version, int) or schema_version > LATEST_SCHEMA_VERSION:
+        raise ValueError(f"Unsupported report schema version {schema_version}")
+    return data
+
+
+def is_in_progress(report_data: Dict[str, Any]) -> bool:
+    """Whether a report holds partial results of a run that has not finished yet."""
+    progress = report_data.get("progress") if isinstance(report_data, dict) else None
+    return isinstance(progress, dict) and bool(progress.get("in_progress"))
@@ -1,15 +1,24 @@
 import os
 import json
 import uuid
+import gzip
+import zlib
+import time
 import toml
-from datetime import datetime
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
 import pytz
-from flask import Flask, request, jsonify, abort, redirect, url_for
+from flask import Flask, request, jsonify, abort, redirect, url_for, Response, g, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, case, inspect, text, or_
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.dialects.sqlite import JSON
 import jinja2
 import logging
 
+from report_server import static_reports, metrics, history, report_schema
+
 app = Flask(__name__)
 
 # --- Database Configuration ---
@@ -46,20 +55,100 @@ class Report(db.Model):
     student_id = db.Column(db.String, nullable=False)
     report_data = db.Column(JSON, nullable=False)
 
-    __table_args__ = (db.UniqueConstraint('lab_number', 'student_id', name='_lab_student_uc'),)
+    # Summary of report_data extracted at ingest, so reports can be listed and triaged without loading their JSON
+    failed_test_count = db.Column(db.Integer, nullable=True)
+    missing_file_count = db.Column(db.Integer, nullable=True)
+    analysis_error_count = db.Column(db.Integer, nullable=True)
+    uploaded_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('lab_number', 'student_id', name='_lab_student_uc'),
+        db.Index('ix_report_lab_uploaded_at', 'lab_number', 'uploaded_at'),
+        db.Index('ix_report_lab_failed_test_count', 'lab_number', 'failed_test_count'),
+    )
+
+    def set_report_data(self, report_data):
+        """Stores new report data along with its summary columns."""
+        self.report_data = report_data
+        for column, value in report_schema.summarize_report_data(report_data).items():
+            setattr(self, column, value)
+        self.uploaded_at = datetime.now(pytz.utc)
 
     def __repr__(self):
         return f'<Report uuid={self.uuid} lab={self.lab_number} student={self.student_id}>'
 
 
+class ReportVersion(db.Model):
+    """
+    Every version of a report that was posted. Keyframes hold the whole (compressed) report, other versions a
+    delta against the version before them. The latest version is also kept whole in Report.report_data.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    report_uuid = db.Column(db.String, db.ForeignKey('report.uuid'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False)
+    is_keyframe = db.Column(db.Boolean, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(pytz.utc))
+
+    __table_args__ = (db.UniqueConstraint('report_uuid', 'version', name='_report_version_uc'),)
+
+    def __repr__(self):
+        return f'<ReportVersion report={self.report_uuid} version={self.version} keyframe={self.is_keyframe}>'
+
+
+def migrate_database():
+    """
+    Brings a database created by an older version of the server up to date: adds the summary columns and their
+    indexes, then fills the columns in for existing reports. Every step is idempotent, and several gunicorn
+    workers may run it at once.
+    """
+    existing_columns = {column['name'] for column in inspect(db.engine).get_columns(Report.__tablename__)}
+    for column in ('failed_test_count', 'missing_file_count', 'analysis_error_count', 'uploaded_at'):
+        if column in existing_columns:
+            continue
+        column_type = Report.__table__.columns[column].type.compile(dialect=db.engine.dialect)
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {Report.__tablename__} ADD COLUMN {column} {column_type}'))
+        except OperationalError:
+            # Another worker added it first
+            pass
+
+    for index in Report.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    backfilled = 0
+    while True:
+        reports = db.session.query(Report).filter(Report.failed_test_count.is_(None)).limit(500).all()
+        if not reports:
+            break
+        for report in reports:
+            for column, value in report_schema.summarize_report_data(report.report_data).items():
+                setattr(report, column, value)
+        db.session.commit()
+        backfilled += len(reports)
+
+    if backfilled:
+        app.logger.info(f"Filled in the summary columns of {backfilled} existing reports")
+
+
 with app.app_context():
+    if not inspect(db.engine).get_table_names():
+        # Only takes effect before the first table is created, lets maintenance return free pages in small steps
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
     db.create_all()
+    migrate_database()
+    metrics.instrument_engine(db.engine)
 
 # --- Flask App ---
 
 # This should be stored securely, e.g., in environment variables
 AUTH_TOKEN = os.environ.get("REPORT_SERVER_AUTH_TOKEN", "SUPER_SECRET_TOKEN")
 
+# Largest decompressed report body accepted, guards against gzip bombs
+MAX_REPORT_BYTES = int(os.environ.get("REPORT_SERVER_MAX_REPORT_BYTES", 64 * 1024 * 1024))
+
 templates_path = os.path.join(os.path.dirname(__file__), "templates")
 loader = jinja2.FileSystemLoader(templates_path)
 jinja_env = jinja2.Environment(loader=loader)
@@ -97,25 +186,109 @@ def get_template(name):
     return jinja_env.get_template(name)
 
 
+def render_template(name, *args, **kwargs):
+    """Renders a Jinja2 template by name, recording how long rendering took."""
+    start = time.perf_counter()
+    html = get_template(name).render(*args, **kwargs)
+    metrics.registry.observe("report_server_template_render_duration_seconds", {"template": name},
+                             time.perf_counter() - start)
+    return html
+
+
+# --- Request Metrics ---
+
+@app.before_request
+def start_request_timer():
+    metrics.registry.start()
+    g.request_start_time = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Records latency, sizes and status of every request, then flushes this worker's metrics if due."""
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    labels = {"route": route, "method": request.method}
+
+    start = g.get("request_start_time")
+    if start is not None:
+        metrics.registry.observe("report_server_request_duration_seconds", labels, time.perf_counter() - start)
+    metrics.registry.observe("report_server_request_size_bytes", labels, request.content_length or 0)
+    # Streamed responses have no known length
+    if response.content_length is not None:
+        metrics.registry.observe("report_server_response_size_bytes", labels, response.content_length)
+    metrics.registry.inc("report_server_responses_total", {**labels, "status": str(response.status_code)})
+
+    metrics.registry.flush()
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Exposes the metrics of all workers in the Prometheus text format."""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Handles 404 errors for unknown paths."""
-    template = get_template('404_generic.html.j2')
-    return template.render(), 404
+    return render_template('404_generic.html.j2'), 404
+
+
+def render_report(report):
+    """Renders the full HTML page of a report."""
+    report_data = report_schema.normalize_report_data(report.report_data)
+    return render_template('report.html.j2', student_id=report.student_id, **report_data)
+
+
+def send_prerendered_report(path):
+    """
+    Serves a pre-rendered report, passing the gzip data through untouched when the client accepts it.
+    The ETag comes from the file's stat, so a revalidation is answered without reading the file.
+    """
+    use_gzip = 'gzip' in request.accept_encodings
+    stat = os.stat(path)
+    etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}-{'gz' if use_gzip else 'id'}"
+
+    if request.if_none_match.contains(etag):
+        metrics.registry.inc("report_server_report_cache_total", {"result": "not_modified"})
+        response = Response(status=304)
+    else:
+        metrics.registry.inc("report_server_report_cache_total", {"result": "prerendered"})
+        with open(path, 'rb') as f:
+            compressed = f.read()
+
+        if use_gzip:
+            response = Response(compressed, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(gzip.decompress(compressed), mimetype='text/html')
+
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
 @app.route('/report/<uuid:report_uuid>', methods=['GET'])
 def report_by_uuid(report_uuid):
     """Gets a report by its UUID."""
+    server_config = get_server_config()
+
+    # Reports of unlocked labs may have been pre-rendered, in which case serving them is a single file read
+    unlocked_labs = [
+        lab_number for lab_number in static_reports.get_prerendered_labs()
+        if static_reports.is_lab_unlocked(server_config.get(f"lab{lab_number}", {}))
+    ]
+    prerendered_path = static_reports.find_report(str(report_uuid), unlocked_labs)
+    if prerendered_path is not None:
+        return send_prerendered_report(prerendered_path)
+
     report = db.session.get(Report, str(report_uuid))
 
     if report is None:
         app.logger.info(f"No report found for uuid {report_uuid}")
-        template = get_template('404.html.j2')
-        return template.render({"student_id": "Unknown", "lab_number": "Unknown"}), 404
+        return render_template('404.html.j2', {"student_id": "Unknown", "lab_number": "Unknown"}), 404
 
     # Check if the report is locked
-    server_config = get_server_config()
     lab_config = server_config.get(f"lab{report.lab_number}", {})
     locked_until_str = lab_config.get("locked_until")
 
@@ -126,8 +299,8 @@ def report_by_uuid(report_uuid):
 
             if now_utc < locked_until_dt:
                 app.logger.info(f"Access to report {report_uuid} denied (locked until {locked_until_dt})")
-                template = get_template('locked.html.j2')
-                return template.render(
+                return render_template(
+                    'locked.html.j2',
                     lab_number=report.lab_number,
                     locked_until_str=locked_until_dt.strftime("%B %d, %Y at %I:%M %p %Z"),
                     locked_until_iso=locked_until_str
@@ -136,38 +309,347 @@ def report_by_uuid(report_uuid):
             app.logger.error(f"Could not parse locked_until date '{locked_until_str}': {e}")
 
     app.logger.info(f"Serving report for lab {report.lab_number} student {report.student_id}")
-    template = get_template('report.html.j2')
-    return template.render(student_id=report.student_id, **report.report_data)
+    response = Response(render_report(report), mimetype='text/html')
+    # Rendering still has to happen, but an unchanged report is not sent again
+    response.add_etag()
+    response.make_conditional(request)
+    result = "not_modified" if response.status_code == 304 else "rendered"
+    metrics.registry.inc("report_server_report_cache_total", {"result": result})
+    return response
 
 
-@app.route('/report/<int:lab_number>/<student_id>', methods=['POST'])
-def report(lab_number, student_id):
-    """Handles storing student lab reports."""
+def require_auth(subject):
+    """Aborts the request unless it carries the server's bearer token. subject is only used for logging."""
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
-        app.logger.warning(f"Missing or invalid auth header for student {student_id}")
+        app.logger.warning(f"Missing or invalid auth header for {subject}")
         abort(401, description="Authorization header is missing or invalid.")
 
     token = auth_header.split(' ')[1]
     if token != AUTH_TOKEN:
-        app.logger.warning(f"Invalid auth token for student {student_id}")
+        app.logger.warning(f"Invalid auth token for {subject}")
         abort(403, description="Invalid authorization token.")
 
-    data = request.get_json()
+
+def load_version_lines(report_uuid, version):
+    """Rebuilds the serialized lines of a report version from its nearest keyframe. Returns None if it does not exist."""
+    keyframe_version = db.session.query(func.max(ReportVersion.version)).filter(
+        ReportVersion.report_uuid == report_uuid,
+        ReportVersion.is_keyframe.is_(True),
+        ReportVersion.version <= version,
+    ).scalar()
+    if keyframe_version is None:
+        return None
+
+    chain = db.session.query(ReportVersion.is_keyframe, ReportVersion.data).filter(
+        ReportVersion.report_uuid == report_uuid,
+        ReportVersion.version >= keyframe_version,
+        ReportVersion.version <= version,
+    ).order_by(ReportVersion.version).all()
+    if len(chain) != version - keyframe_version + 1:
+        return None
+    return history.reconstruct(chain)
+
+
+def add_report_version(report, data):
+    """Stores data as the next version of a report, as a delta against the previous version where possible."""
+    lines = history.serialize(data)
+    latest_version = db.session.query(func.max(ReportVersion.version)).filter_by(report_uuid=report.uuid).scalar()
+
+    is_keyframe = True
+    if latest_version is not None:
+        last_keyframe = db.session.query(func.max(ReportVersion.version)).filter_by(
+            report_uuid=report.uuid, is_keyframe=True
+        ).scalar()
+        is_keyframe = last_keyframe is None or latest_version + 1 - last_keyframe >= history.KEYFRAME_INTERVAL
+
+    base = None if is_keyframe else load_version_lines(report.uuid, latest_version)
+    if base is None:
+        blob = history.encode_keyframe(lines)
+        is_keyframe = True
+    else:
+        blob = history.encode_delta(base, lines)
+
+    version = (latest_version or 0) + 1
+    db.session.add(ReportVersion(report_uuid=report.uuid, version=version, is_keyframe=is_keyframe, data=blob))
+    return version
+
+
+@app.route('/report/<uuid:report_uuid>/versions', methods=['GET'])
+def report_versions(report_uuid):
+    """Lists the stored versions of a report."""
+    require_auth(f"versions of report {report_uuid}")
+
+    report = db.session.get(Report, str(report_uuid))
+    if report is None:
+        return jsonify({"status": "error", "message": f"No report with uuid {report_uuid}."}), 404
+
+    versions = db.session.query(
+        ReportVersion.version, ReportVersion.is_keyframe, ReportVersion.created_at, func.length(ReportVersion.data)
+    ).filter_by(report_uuid=report.uuid).order_by(ReportVersion.version).all()
+
+    return jsonify({
+        "uuid": report.uuid,
+        "lab_number": report.lab_number,
+        "student_id": report.student_id,
+        "versions": [
+            {
+                "version": version,
+                "keyframe": is_keyframe,
+                "created_at": created_at.isoformat(),
+                "stored_bytes": stored_bytes,
+            }
+            for version, is_keyframe, created_at, stored_bytes in versions
+        ],
+    })
+
+
+@app.route('/report/<uuid:report_uuid>/versions/<int:version>', methods=['GET'])
+def report_version(report_uuid, version):
+    """Gets the report data of a single version of a report."""
+    require_auth(f"version {version} of report {report_uuid}")
+
+    lines = load_version_lines(str(report_uuid), version)
+    if lines is None:
+        return jsonify({"status": "error", "message": f"Report {report_uuid} has no version {version}."}), 404
+
+    return jsonify({"uuid": str(report_uuid), "version": version, "report_data": history.deserialize(lines)})
+
+
+# Orderings offered by the report listing, each one is served by an index on (lab_number, column)
+REPORT_LIST_ORDERS = {
+    "uploaded_at": Report.uploaded_at,
+    "failed_test_count": Report.failed_test_count,
+}
+MAX_PAGE_SIZE = 500
+
+
+@app.route('/reports/<int:lab_number>', methods=['GET'])
+def list_reports(lab_number):
+    """
+    Lists the reports of a lab from their summary columns, newest first by default.
+    Query parameters: page (from 1), per_page, order_by (uploaded_at or failed_test_count) and ascending.
+    """
+    require_auth(f"report list of lab {lab_number}")
+
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    order_by = request.args.get('order_by', 'uploaded_at')
+    if page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE or order_by not in REPORT_LIST_ORDERS:
+        return jsonify({
+            "status": "error",
+            "message": f"page must be at least 1, per_page between 1 and {MAX_PAGE_SIZE} "
+                       f"and order_by one of {', '.join(REPORT_LIST_ORDERS)}."
+        }), 400
+
+    order_column = REPORT_LIST_ORDERS[order_by]
+    ascending = request.args.get('ascending', '0').lower() in ('1', 'true', 'yes')
+    total = db.session.query(func.count(Report.uuid)).filter(Report.lab_number == lab_number).scalar()
+    rows = db.session.query(Report).filter(Report.lab_number == lab_number).with_entities(
+        Report.uuid,
+        Report.student_id,
+        Report.failed_test_count,
+        Report.missing_file_count,
+        Report.analysis_error_count,
+        Report.uploaded_at,
+    ).order_by(
+        order_column.asc() if ascending else order_column.desc(), Report.uuid
+    ).limit(per_page).offset((page - 1) * per_page).all()
+
+    return jsonify({
+        "lab_number": lab_number,
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "reports": [
+            {
+                "uuid": row.uuid,
+                "student_id": row.student_id,
+                "failed_test_count": row.failed_test_count,
+                "missing_file_count": row.missing_file_count,
+                "analysis_error_count": row.analysis_error_count,
+                "uploaded_at": row.uploaded_at.isoformat() if row.uploaded_at else None,
+                "url": url_for('report_by_uuid', report_uuid=row.uuid, _external=True),
+            }
+            for row in rows
+        ],
+    })
+
+
+@app.route('/reports/<int:lab_number>/summary', methods=['GET'])
+def lab_summary(lab_number):
+    """Aggregate statistics of a lab's reports, computed from the summary columns only."""
+    require_auth(f"summary of lab {lab_number}")
+
+    totals = db.session.query(
+        func.count(Report.uuid),
+        func.sum(case((Report.failed_test_count > 0, 1), else_=0)),
+        func.sum(case((Report.missing_file_count > 0, 1), else_=0)),
+        func.sum(case((Report.analysis_error_count > 0, 1), else_=0)),
+        func.sum(Report.failed_test_count),
+        func.max(Report.uploaded_at),
+    ).filter(Report.lab_number == lab_number).one()
+    report_count, with_failed_tests, with_missing_files, with_analysis_errors, failed_tests, last_upload = totals
+
+    histogram = db.session.query(Report.failed_test_count, func.count(Report.uuid)).filter(
+        Report.lab_number == lab_number
+    ).group_by(Report.failed_test_count).order_by(Report.failed_test_count).all()
+
+    return jsonify({
+        "lab_number": lab_number,
+        "reports": report_count,
+        "with_failed_tests": with_failed_tests or 0,
+        "with_missing_files": with_missing_files or 0,
+        "with_analysis_errors": with_analysis_errors or 0,
+        "total_failed_tests": failed_tests or 0,
+        "last_upload": last_upload.isoformat() if last_upload else None,
+        # Number of reports by how many test cases they failed
+        "failed_test_histogram": {str(count): reports for count, reports in histogram if count is not None},
+    })
+
+
+# Reports read per query of an export, and how much output is collected before it is sent
+EXPORT_BATCH_SIZE = 200
+EXPORT_CHUNK_BYTES = 256 * 1024
+EXPORT_COLUMNS = (
+    Report.uuid,
+    Report.lab_number,
+    Report.student_id,
+    Report.failed_test_count,
+    Report.missing_file_count,
+    Report.analysis_error_count,
+    Report.uploaded_at,
+    Report.report_data,
+)
+
+
+def export_row_to_line(row):
+    """Serializes a row of EXPORT_COLUMNS into a line of NDJSON."""
+    return json.dumps({
+        "uuid": row.uuid,
+        "lab_number": row.lab_number,
+        "student_id": row.student_id,
+        "failed_test_count": row.failed_test_count,
+        "missing_file_count": row.missing_file_count,
+        "analysis_error_count": row.analysis_error_count,
+        "uploaded_at": row.uploaded_at.isoformat() if row.uploaded_at else None,
+        "report_data": row.report_data,
+    }, separators=(',', ':')) + "\n"
+
+
+def iter_export_lines(lab_number):
+    """
+    Yields every report of a lab as a line of JSON. Reports are read in batches by student id, each batch in its
+    own short transaction, so memory stays flat and SQLite's read lock is never held across the whole export
+    (which would stall report uploads).
+    """
+    last_student_id = None
+    while True:
+        query = db.session.query(Report).with_entities(*EXPORT_COLUMNS).filter(Report.lab_number == lab_number)
+        if last_student_id is not None:
+            query = query.filter(Report.student_id > last_student_id)
+        rows = query.order_by(Report.student_id).limit(EXPORT_BATCH_SIZE).all()
+        db.session.rollback()
+        if not rows:
+            return
+
+        for row in rows:
+            yield export_row_to_line(row)
+        last_student_id = rows[-1].student_id
+
+
+@app.route('/reports/<int:lab_number>/export.ndjson', methods=['GET'])
+def export_reports(lab_number):
+    """Streams every report of a lab as newline delimited JSON, gzip compressed with ?gzip=1."""
+    require_auth(f"export of lab {lab_number}")
+    use_gzip = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+
+    def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if use_gzip else None
+        chunk = []
+        chunk_size = 0
+        for line in iter_export_lines(lab_number):
+            data = line.encode('utf-8')
+            if compressor is not None:
+                data = compressor.compress(data)
+            chunk.append(data)
+            chunk_size += len(data)
+            if chunk_size >= EXPORT_CHUNK_BYTES:
+                yield b''.join(chunk)
+                chunk = []
+                chunk_size = 0
+        if compressor is not None:
+            chunk.append(compressor.flush())
+        yield b''.join(chunk)
+
+    app.logger.info(f"Exporting reports of lab {lab_number}")
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="lab{lab_number}_reports.ndjson{".gz" if use_gzip else ""}"'
+    )
+    if use_gzip:
+        # Sent as a .gz file, not a transfer encoding, so clients save it compressed
+        response.mimetype = 'application/gzip'
+    return response
+
+
+def get_request_json():
+    """Parses the JSON body of a request, which the runner sends gzip compressed. Returns None if it is missing."""
+    body = request.get_data()
+    encoding = request.headers.get('Content-Encoding', '').lower()
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_REPORT_BYTES)
+        except zlib.error:
+            abort(400, description="Request body is not valid gzip data.")
+        if decompressor.unconsumed_tail:
+            abort(413, description=f"Decompressed report is larger than {MAX_REPORT_BYTES} bytes.")
+    elif encoding not in ('', 'identity'):
+        abort(415, description=f"Unsupported Content-Encoding {encoding}.")
+
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        abort(400, description="Request body is not valid JSON.")
+
+
+@app.route('/report/<int:lab_number>/<student_id>', methods=['POST'])
+def report(lab_number, student_id):
+    """Handles storing student lab reports."""
+    require_auth(f"student {student_id}")
+
+    data = get_request_json()
     if data is None:
         app.logger.error(f"No data provided in POST request for student {student_id}")
         abort(400, description="No data provided in the request.")
 
+    schema_version = data.get("schema_version", 1) if isinstance(data, dict) else None
+    if not isinstance(schema_version, int) or schema_version > report_schema.LATEST_SCHEMA_VERSION:
+        app.logger.error(f"Unsupported report schema version {schema_version} for student {student_id}")
+        abort(400, description=f"Unsupported report schema version {schema_version}.")
+
     report = db.session.query(Report).filter_by(lab_number=lab_number, student_id=student_id).first()
+    is_init = data == {"init": True}
     if report:
         # Only update report_data if the new data is not just for initialization
-        if data != {"init": True}:
-            report.report_data = data
+        if not is_init:
+            report.set_report_data(data)
     else:
-        report = Report(lab_number=lab_number, student_id=student_id, report_data=data)
+        report = Report(lab_number=lab_number, student_id=student_id)
+        report.set_report_data(data)
         db.session.add(report)
+        # Assigns the uuid the version refers to
+        db.session.flush()
+
+    # Empty bodies only create the report to get its uuid, they are not a version worth keeping
+    if not is_init and data != {}:
+        add_report_version(report, data)
 
     db.session.commit()
+    static_reports.invalidate_report(lab_number, report.uuid)
     app.logger.info(f"Stored report for lab {lab_number} student {student_id}")
 
     report_url = url_for('report_by_uuid', report_uuid=report.uuid, _external=True)
@@ -178,7 +660,256 @@ def report(lab_number, student_id):
         "url": report_url
     }), 201
 
-def main():
+
+@app.route('/report/<uuid:report_uuid>', methods=['PATCH'])
+def patch_report(report_uuid):
+    """
+    Merges the partial results the runner publishes after each test into a report, so students see finished
+    tests while the rest are still running. Partial results are kept next to the last complete ones, which only
+    the runner's final POST replaces, so patches are never kept as versions.
+    """
+    require_auth(f"report {report_uuid}")
+
+    patch = get_request_json()
+    if patch is None:
+        abort(400, description="No data provided in the request.")
+
+    report = db.session.get(Report, str(report_uuid))
+    if report is None:
+        return jsonify({"status": "error", "message": f"No report with uuid {report_uuid}."}), 404
+
+    try:
+        data = report_schema.apply_report_patch(report.report_data, patch)
+    except ValueError as e:
+        app.logger.error(f"Invalid patch for report {report_uuid}: {e}")
+        abort(400, description=str(e))
+
+    # The server's clock decides when a silent run is considered dead, see report_schema.PROGRESS_TIMEOUT_SECONDS
+    if isinstance(data.get("progress"), dict):
+        data["progress"] = {**data["progress"], "updated_at": time.time()}
+    report.set_report_data(data)
+    in_progress = report_schema.is_in_progress(data)
+
+    db.session.commit()
+    static_reports.invalidate_report(report.lab_number, report.uuid)
+    app.logger.info(f"Patched report for lab {report.lab_number} student {report.student_id}")
+
+    return jsonify({"status": "success", "uuid": report.uuid, "in_progress": in_progress})
+
+
+def prerender_lab(lab_number):
+    """
+    Renders every report of a lab into compressed static files, returning how many were written.
+
+    Reports are read in batches by student id like iter_export_lines, and rendered outside of any transaction,
+    so uploads are never stalled by SQLite's read lock. A report that changed while its batch was rendered has
+    its file dropped again, otherwise its older render would be served over the new data. Reports that are still
+    in progress are left to live rendering, which stops reloading them once their run times out.
+    """
+    count = 0
+    total_size = 0
+    start = time.perf_counter()
+    with app.app_context():
+        last_student_id = None
+        while True:
+            query = db.session.query(Report).with_entities(
+                Report.uuid, Report.student_id, Report.report_data, Report.uploaded_at
+            ).filter(Report.lab_number == lab_number)
+            if last_student_id is not None:
+                query = query.filter(Report.student_id > last_student_id)
+            rows = query.order_by(Report.student_id).limit(EXPORT_BATCH_SIZE).all()
+            db.session.rollback()
+            if not rows:
+                break
+            last_student_id = rows[-1].student_id
+
+            written = {}
+            for row in rows:
+                if report_schema.is_in_progress(row.report_data):
+                    continue
+                total_size += static_reports.write_report(lab_number, row.uuid, render_report(row))
+                written[row.uuid] = row.uploaded_at
+
+            # An upload commits before it invalidates, so any upload this check misses removes the file itself
+            current = dict(db.session.query(Report).with_entities(Report.uuid, Report.uploaded_at).filter(
+                Report.uuid.in_(list(written))
+            ).all())
+            db.session.rollback()
+            for report_uuid, uploaded_at in written.items():
+                if current.get(report_uuid) != uploaded_at:
+                    static_reports.invalidate_report(lab_number, report_uuid)
+                else:
+                    count += 1
+
+    app.logger.info(f"Pre-rendered {count} reports for lab {lab_number} "
+                    f"({total_size / 1024:.1f} KiB) in {time.perf_counter() - start:.2f}s")
+    return count
+
+
+def prerender_scheduled(lead_time, poll_interval=30.):
+    """
+    Watches the lock table in the server config and pre-renders each lab once, when it is within
+    `lead_time` of its `locked_until` time. Runs until interrupted.
+    """
+    prerendered = set()
+    while True:
+        now_utc = datetime.now(pytz.utc)
+        for key, lab_config in get_server_config().items():
+            if not key.startswith("lab") or not key[3:].isdigit() or not isinstance(lab_config, dict):
+                continue
+
+            locked_until_str = lab_config.get("locked_until")
+            if not locked_until_str or (key, locked_until_str) in prerendered:
+                continue
+
+            try:
+                locked_until_dt = datetime.fromisoformat(locked_until_str)
+            except (ValueError, TypeError) as e:
+                app.logger.error(f"Could not parse locked_until date '{locked_until_str}': {e}")
+                continue
+
+            if locked_until_dt - lead_time <= now_utc <= locked_until_dt + lead_time:
+                prerender_lab(int(key[3:]))
+                prerendered.add((key, locked_until_str))
+
+        time.sleep(poll_interval)
+
+
+# Reports removed per transaction by maintenance, keeps each write lock short
+PURGE_BATCH_SIZE = 200
+
+
+def get_database_size():
+    """Returns the size of the database file and how much of it is free pages, in bytes."""
+    with db.engine.connect() as connection:
+        page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+        page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+        freelist_count = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return page_size * page_count, page_size * freelist_count
+
+
+def purge_reports(lab_numbers=None, older_than=None, archive_dir=None, dry_run=False):
+    """
+    Deletes the reports of the given labs and/or last uploaded more than older_than ago, along with their versions
+    and pre-rendered files. Reports uploaded before upload times were recorded count as old. With archive_dir,
+    each report is first appended to a gzip compressed NDJSON file per lab. Returns how many reports matched.
+    """
+    if not lab_numbers and older_than is None:
+        raise ValueError("Refusing to purge every report, give lab numbers and/or an age")
+
+    conditions = []
+    if lab_numbers:
+        conditions.append(Report.lab_number.in_(lab_numbers))
+    if older_than is not None:
+        cutoff = datetime.now(pytz.utc) - older_than
+        conditions.append(or_(Report.uploaded_at < cutoff, Report.uploaded_at.is_(None)))
+
+    if dry_run:
+        count = db.session.query(func.count(Report.uuid)).filter(*conditions).scalar()
+        db.session.rollback()
+        app.logger.info(f"Would remove {count} reports")
+        return count
+
+    archives = {}
+    if archive_dir is not None:
+        Path(archive_dir).mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    count = 0
+    try:
+        while True:
+            rows = db.session.query(Report).with_entities(*EXPORT_COLUMNS).filter(*conditions).order_by(
+                Report.lab_number, Report.student_id
+            ).limit(PURGE_BATCH_SIZE).all()
+            if not rows:
+                break
+
+            if archive_dir is not None:
+                for row in rows:
+                    if row.lab_number not in archives:
+                        archive_path = Path(archive_dir, f"lab{row.lab_number}_{timestamp}.ndjson.gz")
+                        archives[row.lab_number] = gzip.open(archive_path, 'at', encoding='utf-8')
+                        app.logger.info(f"Archiving lab {row.lab_number} reports to {archive_path}")
+                    archives[row.lab_number].write(export_row_to_line(row))
+                # Reports only leave the database once they are safely on disk
+                for archive in archives.values():
+                    archive.flush()
+
+            uuids = [row.uuid for row in rows]
+            db.session.query(ReportVersion).filter(ReportVersion.report_uuid.in_(uuids)).delete(synchronize_session=False)
+            db.session.query(Report).filter(Report.uuid.in_(uuids)).delete(synchronize_session=False)
+            db.session.commit()
+
+            for row in rows:
+                static_reports.invalidate_report(row.lab_number, row.uuid)
+            count += len(rows)
+    finally:
+        for archive in archives.values():
+            archive.close()
+
+    app.logger.info(f"Removed {count} reports")
+    return count
+
+
+def enable_incremental_vacuum():
+    """One-time switch of an existing database to auto_vacuum=INCREMENTAL. Needs a full VACUUM, which blocks writers."""
+    with db.engine.connect() as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return
+        app.logger.info("Enabling incremental vacuum, running a full VACUUM once")
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+
+
+def incremental_vacuum(pages_per_step=256, pause=0.05):
+    """
+    Returns free pages to the file system a few at a time. Each step is its own short write transaction and steps
+    are spaced out, so report uploads are never blocked for long. Returns the number of bytes reclaimed.
+    """
+    with db.engine.connect() as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            app.logger.warning("The database does not use incremental vacuum, free pages stay in the file. "
+                               "Run maintenance once with --enable-incremental-vacuum to switch it over.")
+            return 0
+
+    size_before, _ = get_database_size()
+    while True:
+        with db.engine.begin() as connection:
+            if not connection.exec_driver_sql("PRAGMA freelist_count").scalar():
+                break
+            # sqlite3 only steps a statement without result columns once, which frees a single page,
+            # fetching the (empty) rows steps it until the whole batch is freed
+            cursor = connection.connection.cursor()
+            cursor.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall()
+            cursor.close()
+        time.sleep(pause)
+
+    size_after, _ = get_database_size()
+    return size_before - size_after
+
+
+def run_maintenance(lab_numbers=None, older_than=None, archive_dir=None, dry_run=False, vacuum_pages=256,
+                    convert=False):
+    """Purges (or archives) old reports if asked to, then vacuums the database and logs the space reclaimed."""
+    with app.app_context():
+        size_before, free_before = get_database_size()
+        app.logger.info(f"Database is {size_before / 1024 / 1024:.1f} MiB, {free_before / 1024 / 1024:.1f} MiB of it free")
+
+        if lab_numbers or older_than is not None:
+            purge_reports(lab_numbers, older_than, archive_dir, dry_run)
+        if dry_run:
+            return
+
+        if convert:
+            enable_incremental_vacuum()
+        incremental_vacuum(vacuum_pages)
+
+        size_after, free_after = get_database_size()
+        app.logger.info(f"Reclaimed {(size_before - size_after) / 1024 / 1024:.1f} MiB, database is now "
+                        f"{size_after / 1024 / 1024:.1f} MiB ({free_after / 1024 / 1024:.1f} MiB free)")
+
+
+def serve(port=1407):
     """Starts the Flask server for development."""
     if not app.debug:
         app.logger.setLevel(logging.INFO)
@@ -190,7 +921,89 @@ def main():
     
     # app.run() is for development only.
     # Gunicorn is used for production in the Docker container.
-    app.run(host="0.0.0.0", port=1407)
+    app.run(host="0.0.0.0", port=port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSE 140L report server")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="Run the development server (default).")
+    serve_parser.add_argument("--port", type=int, default=1407, help="Port to listen on.")
+
+    prerender_parser = subparsers.add_parser("prerender", help="Pre-render reports into static files.")
+    prerender_group = prerender_parser.add_mutually_exclusive_group(required=True)
+    prerender_group.add_argument("--lab", type=int, help="Pre-render every report of this lab now.")
+    prerender_group.add_argument(
+        "--scheduled",
+        action="store_true",
+        help="Keep running and pre-render each lab shortly before its locked_until time."
+    )
+    prerender_parser.add_argument(
+        "--lead-minutes",
+        type=float,
+        default=5.,
+        help="How long before a lab unlocks to pre-render it when --scheduled is used."
+    )
+
+    maintenance_parser = subparsers.add_parser(
+        "maintenance",
+        help="Purge or archive old reports and return free space in the database to the file system."
+    )
+    maintenance_parser.add_argument(
+        "--lab",
+        type=int,
+        action="append",
+        dest="labs",
+        help="Remove the reports of this lab (can be repeated)."
+    )
+    maintenance_parser.add_argument(
+        "--older-than-days",
+        type=float,
+        help="Remove reports last uploaded more than this many days ago (combined with --lab if both are given)."
+    )
+    maintenance_parser.add_argument(
+        "--archive-dir",
+        type=Path,
+        help="Write removed reports to gzip compressed NDJSON files in this directory first."
+    )
+    maintenance_parser.add_argument("--dry-run", action="store_true", help="Only count the reports that would be removed.")
+    maintenance_parser.add_argument(
+        "--vacuum-pages",
+        type=int,
+        default=256,
+        help="Pages freed per incremental vacuum step."
+    )
+    maintenance_parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="Switch a database created by an older server to incremental vacuum (runs a blocking VACUUM once)."
+    )
+    maintenance_parser.add_argument(
+        "--every-hours",
+        type=float,
+        help="Keep running and repeat maintenance at this interval."
+    )
+
+    args = parser.parse_args()
+    app.logger.setLevel(logging.INFO)
+
+    if args.command == "maintenance":
+        older_than = timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+        convert = args.enable_incremental_vacuum
+        while True:
+            run_maintenance(args.labs, older_than, args.archive_dir, args.dry_run, args.vacuum_pages, convert)
+            if args.every_hours is None:
+                break
+            convert = False
+            time.sleep(args.every_hours * 3600)
+    elif args.command == "prerender":
+        if args.scheduled:
+            prerender_scheduled(timedelta(minutes=args.lead_minutes))
+        else:
+            prerender_lab(args.lab)
+    else:
+        serve(port=getattr(args, "port", 1407))
 
 if __name__ == '__main__':
     main()
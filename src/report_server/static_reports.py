@@ -0,0 +1,69 @@
+import os
+import gzip
+from pathlib import Path
+from datetime import datetime
+from typing import Iterable, List
+
+import pytz
+
+# Directory pre-rendered reports are written to, one sub directory per lab
+STATIC_REPORT_DIR = Path(os.environ.get("STATIC_REPORT_DIR", "static_reports"))
+
+
+def get_lab_dir(lab_number: int) -> Path:
+    return Path(STATIC_REPORT_DIR, f"lab{lab_number}")
+
+
+def get_report_path(lab_number: int, report_uuid: str) -> Path:
+    return Path(get_lab_dir(lab_number), f"{report_uuid}.html.gz")
+
+
+def write_report(lab_number: int, report_uuid: str, html: str) -> int:
+    """Atomically writes a gzip compressed pre-rendered report, returning the compressed size."""
+    path = get_report_path(lab_number, report_uuid)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    compressed = gzip.compress(html.encode("utf-8"), compresslevel=9, mtime=0)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp_path, path)
+    return len(compressed)
+
+
+def invalidate_report(lab_number: int, report_uuid: str) -> None:
+    """Removes a pre-rendered report so the next request renders the up to date one."""
+    get_report_path(lab_number, report_uuid).unlink(missing_ok=True)
+
+
+def get_prerendered_labs() -> List[int]:
+    """Returns the labs that have a directory of pre-rendered reports."""
+    try:
+        entries = os.listdir(STATIC_REPORT_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(int(entry[3:]) for entry in entries if entry.startswith("lab") and entry[3:].isdigit())
+
+
+def is_lab_unlocked(lab_config: dict) -> bool:
+    """Checks whether a lab's `locked_until` time (if any) has passed."""
+    locked_until_str = lab_config.get("locked_until")
+    if not locked_until_str:
+        return True
+    try:
+        return datetime.now(pytz.utc) >= datetime.fromisoformat(locked_until_str)
+    except (ValueError, TypeError):
+        # Unparseable lock times are handled (and logged) by the regular request path
+        return False
+
+
+def find_report(report_uuid: str, unlocked_labs: Iterable[int]) -> Path | None:
+    """
+    Looks for a pre-rendered report among the unlocked labs only, so a locked lab's reports can never
+    be served from disk.
+    """
+    for lab_number in unlocked_labs:
+        path = get_report_path(lab_number, report_uuid)
+        if path.is_file():
+            return path
+    return None
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import pytest
+from pydantic import ValidationError
+
+from cse140l.cache import CACHE_DIR_ENV
+from cse140l.lab import config as lab_config
+
+_CONFIG = """
+digital_jar = "Digital.jar"
+lab_number = 2
+submission_directory = "submission"
+
+[[tests]]
+name = "Adder"
+max_score = 2
+test_file = "adder_test.dig"
+top_level = "adder"
+visibility_on_success = "visible"
+visibility_on_failure = "hidden"
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    Path("submission").mkdir()
+    Path("adder_test.dig").touch()
+    Path("lab.toml").write_text(_CONFIG)
+    return Path("lab.toml")
+
+
+def _snapshots(tmp_path: Path):
+    return list(Path(tmp_path, "cache", "config").glob("*"))
+
+
+def test_snapshot_round_trips_as_json(config_file: Path, tmp_path: Path):
+    config = lab_config.get_config_from_toml(config_file)
+    snapshot, = _snapshots(tmp_path)
+    assert snapshot.suffix == ".json"
+    assert lab_config.get_config_from_toml(config_file) == config
+
+
+def test_snapshot_is_keyed_on_the_schema(config_file: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    lab_config.get_config_from_toml(config_file)
+    monkeypatch.setattr(lab_config, "_get_schema_hash", lambda: "changed")
+    lab_config.get_config_from_toml(config_file)
+    assert len(_snapshots(tmp_path)) == 2
+
+
+def test_snapshot_rechecks_files(config_file: Path):
+    lab_config.get_config_from_toml(config_file)
+    Path("adder_test.dig").unlink()
+    with pytest.raises(ValidationError, match="Test file does not exist"):
+        lab_config.get_config_from_toml(config_file)
+
+
+def test_unreadable_snapshot_is_ignored(config_file: Path, tmp_path: Path):
+    config = lab_config.get_config_from_toml(config_file)
+    snapshot, = _snapshots(tmp_path)
+    snapshot.write_bytes(b"\x80\x04not json")
+    assert lab_config.get_config_from_toml(config_file) == config
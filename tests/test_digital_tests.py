@@ -0,0 +1,155 @@
+import sys
+import xml.etree.ElementTree as et
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from cse140l.digital import tests as digital_tests
+from cse140l.gradescope import test_result
+
+# Stands in for Digital's test command: records which testbench it ran and reports every test case in it as passed
+_FAKE_DIGITAL = """
+import sys
+import xml.etree.ElementTree as et
+
+test_path = sys.argv[sys.argv.index("-tests") + 1]
+with open(sys.argv[1], "a") as f:
+    f.write(test_path + "\\n")
+for element in et.parse(test_path).getroot().iterfind(".//visualElement"):
+    if element.findtext("elementName") == "Testcase":
+        entry = element.find("elementAttributes/entry")
+        if entry[0].text == "Label":
+            print(f"{entry[1].text}: passed")
+"""
+
+
+def _port(element_name: str, label: str) -> str:
+    return (f"<visualElement><elementName>{element_name}</elementName><elementAttributes><entry>"
+            f"<string>Label</string><string>{label}</string></entry></elementAttributes><pos x=\"0\" y=\"0\"/>"
+            f"</visualElement>")
+
+
+def _testcase(label: str | None, signals: str = "A Y") -> str:
+    label_entry = f"<entry><string>Label</string><string>{label}</string></entry>" if label is not None else ""
+    return (f"<visualElement><elementName>Testcase</elementName><elementAttributes>{label_entry}"
+            f"<entry><string>Testdata</string><testData><dataString>{signals}\n0 0\n</dataString></testData>"
+            f"</entry></elementAttributes><pos x=\"0\" y=\"0\"/></visualElement>")
+
+
+def _write_circuit(path: Path, elements: str) -> Path:
+    path.write_text(f"<?xml version=\"1.0\" encoding=\"utf-8\"?><circuit><version>2</version><visualElements>"
+                    f"{elements}</visualElements><wires/></circuit>")
+    return path
+
+
+def _write_testbench(directory: Path, labels: List[str | None]) -> Path:
+    return _write_circuit(Path(directory, "tb.dig"), _port("In", "A") + "".join(_testcase(label) for label in labels))
+
+
+@pytest.fixture
+def digital(tmp_path: Path) -> digital_tests.Tests:
+    script = Path(tmp_path, "fake_digital.py")
+    script.write_text(_FAKE_DIGITAL)
+    return digital_tests.Tests([sys.executable, str(script), str(Path(tmp_path, "runs.log"))])
+
+
+def _runs(tmp_path: Path) -> List[str]:
+    return Path(tmp_path, "runs.log").read_text().split()
+
+
+@pytest.fixture
+def dut(tmp_path: Path) -> Path:
+    return _write_circuit(Path(tmp_path, "adder.dig"), _port("In", "A") + _port("Out", "Y"))
+
+
+def test_extract_all_testcase_labels(tmp_path: Path):
+    path = _write_testbench(tmp_path, ["first", "second"])
+    assert digital_tests.extract_all_testcase_labels(path) == ["first", "second"]
+
+
+def test_shards_split_testcases_in_order(tmp_path: Path):
+    path = _write_testbench(tmp_path, ["t0", "t1", "t2", "t3", "t4"])
+    shard_files = digital_tests.write_testbench_shards(path, 2)
+    try:
+        assert [labels for _, labels in shard_files] == [["t0", "t1"], ["t2", "t3", "t4"]]
+        for shard_path, labels in shard_files:
+            assert shard_path.parent == tmp_path
+            assert digital_tests.extract_all_testcase_labels(shard_path) == labels
+            # Everything but the test cases is kept in every shard
+            assert et.parse(shard_path).getroot().find(".//visualElement/elementName").text == "In"
+    finally:
+        for shard_path, _ in shard_files:
+            shard_path.unlink()
+
+
+def test_shards_at_most_one_per_testcase(tmp_path: Path):
+    path = _write_testbench(tmp_path, ["t0", "t1"])
+    shard_files = digital_tests.write_testbench_shards(path, 4)
+    for shard_path, _ in shard_files:
+        shard_path.unlink()
+    assert [labels for _, labels in shard_files] == [["t0"], ["t1"]]
+
+
+def test_unlabelled_testcase_is_not_sharded(tmp_path: Path):
+    path = _write_testbench(tmp_path, ["t0", None, "t1"])
+    with pytest.raises(ValueError):
+        digital_tests.write_testbench_shards(path, 2)
+    assert sorted(tmp_path.iterdir()) == [path]
+
+
+def test_parse_test_output():
+    output = "t1: passed\nt2: failed\nA Y\n0 E: 1 / F: 0\n1 E: 0 / F: 1\n\nt3: timeout"
+    t1, t2, t3 = digital_tests.parse_test_output(output, ["t1", "t2", "t3", "t4"])
+    assert (t1.name, t1.outcome, t1.error) == ("t1", test_result.TestStatus.PASSED, False)
+    assert (t2.outcome, t2.signals) == (test_result.TestStatus.FAILED, ["A", "Y"])
+    assert t2.steps[:2] == [{"A": "0", "Y": "1/0"}, {"A": "1", "Y": "0/1"}]
+    assert (t3.outcome, t3.error, t3.output) == ("error", True, "timeout")
+
+
+def test_parse_truncated_test_output():
+    t1, t2 = digital_tests.parse_test_output("t1: passed", ["t1", "t2"], output_truncated=True)
+    assert t1.outcome == test_result.TestStatus.PASSED
+    assert (t2.outcome, t2.truncated) == (test_result.TestStatus.FAILED, True)
+
+
+def test_failed_vector_filter():
+    vector_filter = digital_tests.FailedVectorFilter(1)
+    lines = [b"t1: failed\n", b"A Y\n", b"0 E: 1 / F: 0\n", b"1 1\n", b"1 E: 0 / F: 1\n", b"\n", b"t2: passed\n"]
+    assert [vector_filter(line) for line in lines] == [True, True, True, False, False, True, True]
+    assert vector_filter.truncated_testcases == ["t1"]
+
+
+def test_run_test_merges_shards_in_order(tmp_path: Path, digital: digital_tests.Tests, dut: Path):
+    test_path = _write_testbench(tmp_path, ["t0", "t1", "t2", "t3"])
+    outputs = digital.run_test(dut, test_path, shards=2)
+    assert [output.name for output in outputs] == ["t0", "t1", "t2", "t3"]
+    assert all(output.outcome == test_result.TestStatus.PASSED for output in outputs)
+    assert len(_runs(tmp_path)) == 2
+    assert not list(tmp_path.glob(".tb.shard*"))
+
+
+def test_run_test_with_unlabelled_testcase_runs_once(tmp_path: Path, digital: digital_tests.Tests, dut: Path):
+    test_path = _write_testbench(tmp_path, ["t0", None, "t1"])
+    outputs = digital.run_test(dut, test_path, shards=2)
+    assert [output.name for output in outputs] == ["t0", "t1"]
+    assert _runs(tmp_path) == [str(test_path)]
+
+
+def test_run_test_reports_missing_ports(tmp_path: Path, digital: digital_tests.Tests, dut: Path):
+    test_path = _write_circuit(Path(tmp_path, "tb.dig"), "".join([
+        _testcase("t0"), _testcase("carry", "A Cout"), _testcase("t2"),
+    ]))
+    t0, carry, t2 = digital.run_test(dut, test_path, shards=2)
+    assert (t0.name, t2.name) == ("t0", "t2")
+    assert t0.outcome == t2.outcome == test_result.TestStatus.PASSED
+    assert (carry.name, carry.outcome) == ("carry", test_result.TestStatus.FAILED)
+    assert "Cout" in carry.diagnostic
+
+
+def test_run_test_skips_digital_when_every_testcase_misses_a_port(tmp_path: Path, digital: digital_tests.Tests,
+                                                                  dut: Path):
+    test_path = _write_circuit(Path(tmp_path, "tb.dig"), _testcase("carry", "A Cout"))
+    carry, = digital.run_test(dut, test_path)
+    assert carry.outcome == test_result.TestStatus.FAILED
+    assert not Path(tmp_path, "runs.log").exists()
@@ -0,0 +1,64 @@
+import json
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+from cse140l.lab.durations import DEFAULT_DURATION, SMOOTHING, DurationStore, duration_key, predict_makespan
+
+
+def test_predict_makespan():
+    assert predict_makespan([], 2) == 0
+    assert predict_makespan([3., 3., 2., 2., 2.], 2) == 7.
+    assert predict_makespan([4., 1., 1.], 0) == 6.
+
+
+def test_duration_key_is_absolute(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.chdir(tmp_path)
+    assert duration_key(Path("adder_test.dig"), "adder") == f"{tmp_path / 'adder_test.dig'}::adder"
+
+
+def test_record_smooths_runs(tmp_path: Path):
+    store = DurationStore(Path(tmp_path, "durations.json"))
+    store.record("a", 10.)
+    store.record("a", 20.)
+    assert store.predict("a") == pytest.approx(SMOOTHING * 20. + (1 - SMOOTHING) * 10.)
+    assert store.predict("b") is None
+
+
+def test_predict_all_and_longest_first(tmp_path: Path):
+    store = DurationStore(Path(tmp_path, "durations.json"))
+    assert store.predict_all(["a", "b"]) == [DEFAULT_DURATION, DEFAULT_DURATION]
+    store.record("a", 2.)
+    store.record("b", 6.)
+    assert store.predict_all(["a", "b", "new"]) == [2., 6., 4.]
+    assert store.longest_first(["A", "B", "NEW"], ["a", "b", "new"]) == [("B", 6.), ("NEW", 4.), ("A", 2.)]
+
+
+def test_save_keeps_entries_of_other_stores(tmp_path: Path):
+    path = Path(tmp_path, "durations.json")
+    first, second = DurationStore(path), DurationStore(path)
+    first.record("a", 1.)
+    second.record("b", 2.)
+    first.save()
+    second.save()
+    assert set(json.loads(path.read_text())) == {"a", "b"}
+    assert DurationStore(path).predict("a") == 1.
+
+
+def _record_and_save(path: Path, index: int) -> None:
+    store = DurationStore(path)
+    for run in range(20):
+        store.record(f"job{index}-{run}", float(run))
+        store.save()
+
+
+def test_concurrent_saves_from_processes_keep_every_entry(tmp_path: Path):
+    path = Path(tmp_path, "durations.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_record_and_save, args=(path, index)) for index in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(json.loads(path.read_text())) == 4 * 20
@@ -0,0 +1,50 @@
+import pytest
+
+from report_server import history
+
+
+def _versions():
+    data = {"lab": 2, "all_failed_tests": [], "missing_files": ["adder"]}
+    versions = [data]
+    for i in range(5):
+        data = {**data, "all_failed_tests": [*data["all_failed_tests"], {"test_name": f"t{i}", "failed_steps": []}]}
+        versions.append(data)
+    versions.append({"lab": 2, "all_failed_tests": [], "missing_files": []})
+    return versions
+
+
+def test_serialize_round_trips():
+    data = {"b": [1, 2, {"c": None}], "a": "text\nwith lines"}
+    assert history.deserialize(history.serialize(data)) == data
+    assert history.decode_keyframe(history.encode_keyframe(history.serialize(data))) == history.serialize(data)
+
+
+def test_delta_rebuilds_version():
+    base, *changed = [history.serialize(data) for data in _versions()]
+    for lines in changed:
+        assert history.apply_delta(base, history.encode_delta(base, lines)) == lines
+
+
+def test_delta_of_similar_version_is_small():
+    versions = [history.serialize(data) for data in _versions()]
+    delta = history.encode_delta(versions[4], versions[5])
+    assert len(delta) < len(history.encode_keyframe(versions[5]))
+
+
+def test_reconstruct_chain():
+    versions = [history.serialize(data) for data in _versions()]
+    chain = [(True, history.encode_keyframe(versions[0]))]
+    chain += [(False, history.encode_delta(previous, lines)) for previous, lines in zip(versions, versions[1:])]
+    for i, lines in enumerate(versions):
+        assert history.reconstruct(chain[:i + 1]) == lines
+
+    # A keyframe in the middle of a chain replaces everything before it
+    assert history.reconstruct([*chain[:3], (True, history.encode_keyframe(versions[5]))]) == versions[5]
+
+
+def test_reconstruct_needs_keyframe():
+    lines = history.serialize({"a": 1})
+    with pytest.raises(ValueError):
+        history.reconstruct([(False, history.encode_delta(lines, lines))])
+    with pytest.raises(ValueError):
+        history.reconstruct([])
@@ -0,0 +1,80 @@
+import re
+import xml.etree.ElementTree as et
+from typing import List
+
+from cse140l.digital.images import SVG_NS, optimize_svg
+
+_NUMBER = re.compile(r'-?\d+\.?\d*')
+_GATE = "M {x}.04,{y}.06 L {x1}.01,{y}.06 L {x1}.01,{y1}.03 L {x}.04,{y1}.03 L {x}.04,{y}.06 Z"
+
+
+def _svg(body: str) -> str:
+    return f'<svg xmlns="{SVG_NS}" viewBox="0 0 400.123 300.456">{body}</svg>'
+
+
+def _find_all(svg: str, tag: str) -> List[et.Element]:
+    return et.fromstring(svg).findall(f".//{{{SVG_NS}}}{tag}")
+
+
+def _points(geometry: str) -> List[float]:
+    return [float(number) for number in _NUMBER.findall(geometry)]
+
+
+def test_rounds_coordinates_and_translations():
+    svg = optimize_svg(_svg('<g transform="translate(10.123,20.456)"><rect x="1.234" y="5.678" width="3.01"/></g>'))
+    group, = _find_all(svg, "g")
+    rect, = _find_all(svg, "rect")
+    assert group.get("transform") == "translate(10.1,20.5)"
+    assert (rect.get("x"), rect.get("y"), rect.get("width")) == ("1.2", "5.7", "3")
+
+
+def test_keeps_geometry_inside_scaled_group():
+    svg = optimize_svg(_svg('<g transform="scale(0.0123)"><rect x="1234.567" y="98.765" width="11.11"/></g>'))
+    group, = _find_all(svg, "g")
+    rect, = _find_all(svg, "rect")
+    assert group.get("transform") == "scale(0.0123)"
+    assert (rect.get("x"), rect.get("y"), rect.get("width")) == ("1234.567", "98.765", "11.11")
+
+
+def test_does_not_reuse_shapes_inside_scaled_group():
+    paths = "".join(f'<path d="{_GATE.format(x=x, y=7, x1=x + 30, y1=47)}"/>' for x in (10, 110))
+    svg = optimize_svg(_svg(f'<g transform="scale(2)">{paths}</g>'))
+    assert not _find_all(svg, "use")
+    assert [path.get("d") for path in _find_all(svg, "path")] == [
+        _GATE.format(x=x, y=7, x1=x + 30, y1=47) for x in (10, 110)]
+
+
+def test_keeps_whitespace_inside_text():
+    svg = optimize_svg(_svg('<text x="1"> <tspan>A</tspan> <tspan>B</tspan></text>'))
+    text, = _find_all(svg, "text")
+    assert "".join(text.itertext()) == " A B"
+
+
+def test_leaves_arc_paths_untouched():
+    arc = "M 10.04 10.06 A 5 5 0 0110 10.02"
+    svg = optimize_svg(_svg(f'<path d="{arc}"/>'))
+    path, = _find_all(svg, "path")
+    assert path.get("d") == arc
+
+
+def test_use_places_shapes_where_they_were():
+    origins = [(10, 7), (110, 7), (10, 157)]
+    paths = "".join(f'<path d="{_GATE.format(x=x, y=y, x1=x + 30, y1=y + 40)}" stroke="black"/>'
+                    for x, y in origins)
+    svg = optimize_svg(_svg(paths))
+
+    definition, = _find_all(svg, "defs")
+    shapes = {shape.get("id"): shape for shape in definition}
+    uses = _find_all(svg, "use")
+    assert len(uses) == len(origins)
+    for use, (x, y) in zip(uses, origins):
+        original = _points(_GATE.format(x=x, y=y, x1=x + 30, y1=y + 40))
+        shape = _points(shapes[use.get("href").lstrip("#")].get("d"))
+        offset = (float(use.get("x", 0)), float(use.get("y", 0)))
+        placed = [value + offset[i % 2] for i, value in enumerate(shape)]
+        assert all(abs(a - b) <= 0.05 for a, b in zip(placed, original))
+        assert use.get("class") is not None
+
+
+def test_returns_unparseable_input_unchanged():
+    assert optimize_svg("<svg><g>") == "<svg><g>"
@@ -0,0 +1,65 @@
+"""
+Checks that importing the autograder's entry points stays cheap, with `python -X importtime`.
+
+Every module is imported in a fresh interpreter. A module fails if its cumulative import time exceeds its budget,
+or if it pulls in a dependency that is meant to be imported lazily (pydantic, Digital, requests, ...), which is
+what usually makes the budget blow up later. Set CSE140L_IMPORT_BUDGET_SCALE to multiply every budget on a slow
+machine.
+"""
+import os
+import re
+import sys
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+BUDGET_SCALE = float(os.environ.get("CSE140L_IMPORT_BUDGET_SCALE", "1"))
+# Imports are timed a few times and the fastest is kept, a single run is easily slowed down by the machine
+RUNS = 3
+
+# module -> (budget in milliseconds, modules it must not import)
+BUDGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    "cse140l.cli": (25., ("pydantic", "toml", "requests", "cse140l.digital", "cse140l.lab")),
+    "cse140l.lab.runner": (100., ("pydantic", "toml", "requests", "cse140l.digital", "cse140l.lab.config")),
+    "cse140l.gradescope.aggregate": (100., ("pydantic", "requests", "cse140l.digital", "cse140l.lab")),
+}
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def measure(module: str) -> Tuple[float, List[str]]:
+    """Imports a module in a new interpreter, returns its cumulative import time in ms and every module it imported."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(SRC_DIR), os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env, check=True)
+
+    cumulative_us = 0
+    imported: List[str] = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        imported.append(match.group(4))
+        if match.group(4) == module and not match.group(3):
+            cumulative_us = int(match.group(2))
+    return cumulative_us / 1000, imported
+
+
+@pytest.mark.parametrize("module", BUDGETS)
+def test_import_stays_lazy(module: str):
+    _, forbidden = BUDGETS[module]
+    _, imported = measure(module)
+    leaked = [prefix for prefix in forbidden
+              if any(name == prefix or name.startswith(f"{prefix}.") for name in imported)]
+    assert not leaked, f"{module} imports {', '.join(leaked)} eagerly"
+
+
+@pytest.mark.parametrize("module", BUDGETS)
+def test_import_time_within_budget(module: str):
+    budget_ms, _ = BUDGETS[module]
+    elapsed_ms = min(measure(module)[0] for _ in range(RUNS))
+    assert elapsed_ms <= budget_ms * BUDGET_SCALE, \
+        f"importing {module} took {elapsed_ms:.1f}ms (budget {budget_ms * BUDGET_SCALE:.0f}ms)"
@@ -0,0 +1,110 @@
+import pytest
+
+from report_server import report_schema
+
+
+def _failed_step_v1():
+    return {"signals": ["A", "Y"], "steps": [{"A": "0", "Y": "E: 1 / F: 0"}, {"A": "1", "Y": "1"}]}
+
+
+def _failed_step_v2():
+    return {"signals": ["A", "Y"], "columns": [["0", "1"], ["E: 1 / F: 0", "1"]]}
+
+
+@pytest.mark.parametrize("schema_version, failed_step", [(1, _failed_step_v1()), (2, _failed_step_v2())])
+def test_normalize_failed_steps(schema_version, failed_step):
+    report_data = {"schema_version": schema_version,
+                   "all_failed_tests": [{"test_name": "t", "failed_steps": [failed_step]}]}
+    normalized = report_schema.normalize_report_data(report_data)
+    step, = normalized["all_failed_tests"][0]["failed_steps"]
+    assert step["rows"] == [["0", "E: 1 / F: 0"], ["1", "1"]]
+    assert normalized["progress"] is None
+
+
+def test_normalize_rejects_newer_schema():
+    with pytest.raises(ValueError):
+        report_schema.normalize_report_data({"schema_version": report_schema.LATEST_SCHEMA_VERSION + 1,
+                                             "all_failed_tests": []})
+
+
+def _in_progress_report(updated_at: float):
+    return {
+        "schema_version": 2,
+        "circuit_info": [{"name": "adder"}],
+        "all_failed_tests": [{"test_name": "old", "failed_steps": []}],
+        "progress": {"in_progress": True, "schema_version": 2, "updated_at": updated_at, "missing_files": ["mux"]},
+        "progress_failed_tests": [{"test_name": "new", "failed_steps": [_failed_step_v2()]}],
+    }
+
+
+def test_normalize_shows_partial_results_while_in_progress():
+    normalized = report_schema.normalize_report_data(_in_progress_report(updated_at=1000.), now=1010.)
+    assert [test["test_name"] for test in normalized["all_failed_tests"]] == ["new"]
+    assert normalized["circuit_info"] == []
+    assert normalized["missing_files"] == ["mux"]
+    assert normalized["progress"]["has_results"] is True
+
+
+def test_normalize_interrupts_stale_progress():
+    now = 1000. + report_schema.PROGRESS_TIMEOUT_SECONDS + 1
+    normalized = report_schema.normalize_report_data(_in_progress_report(updated_at=1000.), now=now)
+    assert normalized["progress"]["interrupted"] is True
+    assert normalized["progress"]["in_progress"] is False
+    assert [test["test_name"] for test in normalized["all_failed_tests"]] == ["old"]
+
+
+def test_normalize_marks_failed_run_interrupted():
+    report_data = {**_in_progress_report(updated_at=1000.), "progress": {"in_progress": False, "failed": True}}
+    normalized = report_schema.normalize_report_data(report_data, now=1010.)
+    assert normalized["progress"]["interrupted"] is True
+    assert [test["test_name"] for test in normalized["all_failed_tests"]] == ["old"]
+
+
+def test_summarize_report_data():
+    report_data = {
+        "all_failed_tests": [{"failed_steps": [{}, {}]}, {"failed_steps": None}, {}],
+        "missing_files": ["a"],
+        "circuit_info": [{"analysis_errors": ["x", "y"]}, {}],
+    }
+    assert report_schema.summarize_report_data(report_data) == {
+        "failed_test_count": 2, "missing_file_count": 1, "analysis_error_count": 2,
+    }
+    assert report_schema.summarize_report_data(None) == {
+        "failed_test_count": 0, "missing_file_count": 0, "analysis_error_count": 0,
+    }
+
+
+def test_apply_report_patch():
+    report_data = {"init": True}
+    report_data = report_schema.apply_report_patch(report_data, {
+        "set": {"progress": {"in_progress": True}, "progress_failed_tests": []},
+    })
+    report_data = report_schema.apply_report_patch(report_data, {"append": {"progress_failed_tests": [{"n": 1}]}})
+    report_data = report_schema.apply_report_patch(report_data, {"append": {"progress_failed_tests": [{"n": 2}]}})
+    assert report_data == {"progress": {"in_progress": True}, "progress_failed_tests": [{"n": 1}, {"n": 2}]}
+    assert report_schema.is_in_progress(report_data)
+
+
+def test_apply_report_patch_keeps_input():
+    report_data = {"progress_failed_tests": [{"n": 1}]}
+    report_schema.apply_report_patch(report_data, {"append": {"progress_failed_tests": [{"n": 2}]}})
+    assert report_data == {"progress_failed_tests": [{"n": 1}]}
+
+
+@pytest.mark.parametrize("patch", [
+    [],
+    {"replace": {}},
+    {"set": ["progress"]},
+    {"append": {"progress": [1]}},
+    {"append": {"progress_failed_tests": {"n": 1}}},
+    {"set": {"schema_version": report_schema.LATEST_SCHEMA_VERSION + 1}},
+])
+def test_apply_report_patch_rejects_malformed(patch):
+    with pytest.raises(ValueError):
+        report_schema.apply_report_patch({"progress": {"in_progress": True}}, patch)
+
+
+def test_is_in_progress():
+    assert not report_schema.is_in_progress(None)
+    assert not report_schema.is_in_progress({"progress": {"in_progress": False}})
+    assert report_schema.is_in_progress({"progress": {"in_progress": True}})
@@ -0,0 +1,95 @@
+import random
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from report_server import history
+from report_server.loadtest import LoadTestConfig, synthesize_report_data
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory: pytest.TempPathFactory):
+    """The server module, imported against a temporary database, static report directory and config."""
+    directory = tmp_path_factory.mktemp("report_server")
+    Path(directory, "server_config.toml").write_text("")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("DATABASE_PATH", str(Path(directory, "reports.db")))
+        monkeypatch.setenv("STATIC_REPORT_DIR", str(Path(directory, "static_reports")))
+        monkeypatch.setenv("REPORT_SERVER_METRICS_DIR", str(Path(directory, "metrics")))
+        monkeypatch.setenv("REPORT_SERVER_CONFIG_PATH", str(Path(directory, "server_config.toml")))
+        from report_server import report_server
+
+        yield report_server
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def headers(server) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {server.AUTH_TOKEN}"}
+
+
+def _report(seed: int, lab_number: int = 1) -> Dict:
+    return synthesize_report_data(random.Random(seed), lab_number, LoadTestConfig(steps_per_test=3,
+                                                                                   schematic_bytes=200))
+
+
+def test_versions_rebuild_from_deltas(client, headers):
+    posted = [_report(seed) for seed in range(history.KEYFRAME_INTERVAL + 2)]
+    for report_data in posted:
+        response = client.post("/report/1/history", json=report_data, headers=headers)
+        assert response.status_code == 201
+    report_uuid = response.get_json()["uuid"]
+
+    versions = client.get(f"/report/{report_uuid}/versions", headers=headers).get_json()["versions"]
+    assert [version["version"] for version in versions] == list(range(1, len(posted) + 1))
+    assert [version["version"] for version in versions if version["keyframe"]] == [1, history.KEYFRAME_INTERVAL + 1]
+    for version, report_data in enumerate(posted, start=1):
+        response = client.get(f"/report/{report_uuid}/versions/{version}", headers=headers)
+        assert response.get_json()["report_data"] == report_data
+
+    assert client.get(f"/report/{report_uuid}/versions/{len(posted) + 1}", headers=headers).status_code == 404
+
+
+def test_patch_merges_partial_results(server, client, headers):
+    report_uuid = client.post("/report/1/patched", json={"init": True}, headers=headers).get_json()["uuid"]
+
+    patches = [
+        {"set": {"progress": {"in_progress": True, "schema_version": 2}, "progress_failed_tests": []}},
+        {"append": {"progress_failed_tests": [{"test_name": "first", "failed_steps": []}]}},
+        {"append": {"progress_failed_tests": [{"test_name": "second", "failed_steps": []}]}},
+    ]
+    for patch in patches:
+        response = client.patch(f"/report/{report_uuid}", json=patch, headers=headers)
+        assert response.get_json()["in_progress"] is True
+
+    with server.app.app_context():
+        report_data = server.db.session.get(server.Report, report_uuid).report_data
+    assert "init" not in report_data
+    assert [test["test_name"] for test in report_data["progress_failed_tests"]] == ["first", "second"]
+    assert report_data["progress"]["updated_at"] > 0
+    # Partial results are never kept as versions
+    assert client.get(f"/report/{report_uuid}/versions", headers=headers).get_json()["versions"] == []
+
+    response = client.patch(f"/report/{report_uuid}", json={"append": {"progress": [1]}}, headers=headers)
+    assert response.status_code == 400
+    assert client.patch(f"/report/{report_uuid}", json=patches[0]).status_code == 401
+
+
+def test_prerender_skips_reports_in_progress(server, client, headers):
+    done_uuid = client.post("/report/7/done", json=_report(1, 7), headers=headers).get_json()["uuid"]
+    running_uuid = client.post("/report/7/running", json={"init": True}, headers=headers).get_json()["uuid"]
+    client.patch(f"/report/{running_uuid}", json={"set": {"progress": {"in_progress": True}}}, headers=headers)
+
+    assert server.prerender_lab(7) == 1
+    assert server.static_reports.get_report_path(7, done_uuid).exists()
+    assert not server.static_reports.get_report_path(7, running_uuid).exists()
+
+    # A new upload drops the pre-rendered file so it is never served stale
+    client.post("/report/7/done", json=_report(2, 7), headers=headers)
+    assert not server.static_reports.get_report_path(7, done_uuid).exists()
+
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+import requests
+
+from cse140l.lab.runner import LabRunner
+
+
+class _Publisher:
+    def __init__(self):
+        self.calls: List[str] = []
+        self.patches: List[Dict] = []
+
+    def publish(self, patch: Dict) -> None:
+        self.calls.append("publish")
+        self.patches.append(patch)
+
+    def flush(self) -> None:
+        self.calls.append("flush")
+
+    def close(self) -> None:
+        self.calls.append("close")
+
+
+class _Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.text = ""
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code}", response=self)
+
+    def json(self) -> Dict:
+        return {"uuid": "report-uuid"}
+
+
+@pytest.fixture
+def runner(monkeypatch: pytest.MonkeyPatch) -> LabRunner:
+    runner = LabRunner.__new__(LabRunner)
+    runner.config = SimpleNamespace(lab_number=3)
+    runner.publisher = _Publisher()
+    runner.report_uuid = None
+    monkeypatch.setattr(runner, "prepare_report_data", lambda: {"results": []})
+    return runner
+
+
+def _post(runner: LabRunner, monkeypatch: pytest.MonkeyPatch, status_code: int) -> _Publisher:
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: _Response(status_code))
+    publisher = runner.publisher
+    runner.post_report("http://reports", "A123", "token")
+    runner.close()
+    return publisher
+
+
+def test_publisher_dropped_after_successful_post(runner: LabRunner, monkeypatch: pytest.MonkeyPatch):
+    publisher = _post(runner, monkeypatch, 200)
+    assert publisher.calls == ["flush", "close"]
+    assert runner.publisher is None
+    assert runner.report_uuid == "report-uuid"
+
+
+def test_failed_post_marks_report_failed(runner: LabRunner, monkeypatch: pytest.MonkeyPatch):
+    publisher = _post(runner, monkeypatch, 500)
+    assert publisher.calls == ["flush", "publish", "close"]
+    assert publisher.patches == [{"set": {"progress": {"in_progress": False, "failed": True}}}]
+
+
+def test_failed_report_preparation_marks_report_failed(runner: LabRunner, monkeypatch: pytest.MonkeyPatch):
+    def fail():
+        raise RuntimeError("analysis crashed")
+
+    monkeypatch.setattr(runner, "prepare_report_data", fail)
+    publisher = runner.publisher
+    try:
+        with pytest.raises(RuntimeError):
+            runner.post_report("http://reports", "A123", "token")
+    finally:
+        runner.close()
+    assert publisher.calls == ["flush", "publish", "close"]
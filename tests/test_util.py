@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+
+from cse140l.digital.util import DEFAULT_MAX_OUTPUT_BYTES, DEFAULT_TIMEOUT, ProcessLimits, get_process_limits
+
+
+def _test_config(**overrides) -> SimpleNamespace:
+    fields = dict(max_output_bytes=None, max_failed_vectors=None, timeout=None, cpu_time_limit=None,
+                  memory_limit_mb=None, java_heap=None)
+    return SimpleNamespace(**{**fields, **overrides})
+
+
+def test_process_limits_default():
+    assert get_process_limits(_test_config()) == ProcessLimits(max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES,
+                                                               timeout=DEFAULT_TIMEOUT)
+
+
+def test_process_limits_from_config():
+    limits = get_process_limits(_test_config(max_failed_vectors=5, timeout=12., cpu_time_limit=30,
+                                             memory_limit_mb=512, java_heap="256m"))
+    assert limits == ProcessLimits(max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, max_failed_vectors=5, timeout=12.,
+                                   cpu_time=30, max_memory=512 * 1024 * 1024, java_heap="256m")